@@ -1,8 +1,144 @@
 from django.contrib import admin
-from .models import Listings, Category, User, Bids
+from django.contrib.auth.admin import UserAdmin
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.utils.functional import cached_property
 
-# Register your models here.
-admin.site.register(Listings)
-admin.site.register(Category)
-admin.site.register(User)
-admin.site.register(Bids)
+from .closing import close_listings, reopen_listings
+from .models import Bids, Category, Comment, Listings, User
+
+#how long the admin trusts an exact row count of a big table, where the database keeps no statistics
+COUNT_CACHE_SECONDS = 600
+
+
+def table_statistics_rows(model, using):
+    #the table's row count as the query planner last measured it, or None if it never has. SQLite keeps it
+    #in sqlite_stat1 after ANALYZE (or PRAGMA optimize); the largest index holds every row. PostgreSQL
+    #keeps it in pg_class, refreshed by autovacuum
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        try:
+            if connection.vendor == "sqlite":
+                cursor.execute("SELECT MAX(CAST(stat AS INTEGER)) FROM sqlite_stat1 WHERE tbl = %s", [table])
+            elif connection.vendor == "postgresql":
+                cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+            else:
+                return None
+        except DatabaseError:
+            #no sqlite_stat1 until the first ANALYZE
+            return None
+        row = cursor.fetchone()
+    return row[0] if row and row[0] and row[0] > 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    #the changelist paginator for big tables. An unfiltered changelist takes its total from the planner's
+    #statistics, or else from an exact count cached for COUNT_CACHE_SECONDS, instead of a COUNT(*) that
+    #reads the whole table on every page. Filtered changelists and small tables are counted exactly
+    estimate_above = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if queryset.query.where:
+            return super().count
+        model = queryset.model
+        estimate = table_statistics_rows(model, queryset.db)
+        if estimate is None:
+            key = f"auctions:admin:count:{model._meta.db_table}"
+            estimate = cache.get(key)
+            if estimate is None:
+                estimate = super().count
+                cache.set(key, estimate, COUNT_CACHE_SECONDS)
+                return estimate
+        return estimate if estimate > self.estimate_above else super().count
+
+
+def id_batches(queryset, size=500):
+    #an action's selection as lists of ids, read before anything changes: the selection may be defined by
+    #the changelist's filters (e.g. "open"), which the action itself makes untrue
+    ids = list(queryset.values_list("pk", flat=True))
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+class BigTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    #a filtered changelist would otherwise count the whole table as well, for its "(N total)" link
+    show_full_result_count = False
+
+
+@admin.register(Listings)
+class ListingsAdmin(BigTableAdmin):
+    #current_bid is annotated onto the changelist's one query; the listing's __str__ isn't used, as it
+    #looks up the category
+    list_display = ("id", "title", "category", "listed_by", "current_bid", "bid_count", "active_status", "end_time", "winner")
+    list_display_links = ("id", "title")
+    list_select_related = ("category", "listed_by", "winner")
+    #active_status is read through the partial active/closed indexes, category through
+    #listing_category_created_idx
+    list_filter = ("active_status", "category")
+    autocomplete_fields = ("category",)
+    raw_id_fields = ("listed_by", "winner")
+    readonly_fields = ("current_price", "top_bid", "bid_count", "comment_count", "closed_at", "updated_at")
+    actions = ("close_auctions", "relist_auctions")
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_current_bid()
+
+    @admin.display(description="Current bid", ordering="current_bid")
+    def current_bid(self, listing):
+        return listing.current_bid
+
+    @admin.action(description="Close selected auctions")
+    def close_auctions(self, request, queryset):
+        #one UPDATE per batch of the selection, with winners, notifications and stats as when they expire
+        closed = sum(close_listings(batch) for batch in id_batches(queryset))
+        self.message_user(request, f"Closed {closed} auction(s).")
+
+    @admin.action(description="Relist selected auctions")
+    def relist_auctions(self, request, queryset):
+        reopened = sum(reopen_listings(batch) for batch in id_batches(queryset))
+        self.message_user(request, f"Relisted {reopened} auction(s).")
+
+
+class ListingIdMixin:
+    #the listing as its id: naming the foreign key in list_display would fetch each row's listing
+
+    @admin.display(description="Listing", ordering="listing")
+    def listing_number(self, obj):
+        return obj.listing_id
+
+
+@admin.register(Bids)
+class BidsAdmin(ListingIdMixin, BigTableAdmin):
+    list_display = ("id", "listing_number", "bidder", "bid_amount", "timestamp")
+    list_select_related = ("bidder",)
+    raw_id_fields = ("listing", "bidder")
+
+
+@admin.register(Comment)
+class CommentAdmin(ListingIdMixin, BigTableAdmin):
+    list_display = ("id", "listing_number", "user", "created_at")
+    list_select_related = ("user",)
+    raw_id_fields = ("listing", "user")
+
+
+@admin.register(Category)
+class CategoryAdmin(admin.ModelAdmin):
+    #searchable for the listings' category autocomplete, in the order of the unique index on name
+    search_fields = ("name",)
+    ordering = ("name",)
+
+
+@admin.register(User)
+class AuctionUserAdmin(UserAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    #UserAdmin's filters are on unindexed flags, each a scan of the table
+    list_filter = ()
+    #the watchlist as ids: a select box would load every listing
+    fieldsets = UserAdmin.fieldsets + (("Auctions", {"fields": ("watchlist",)}),)
+    raw_id_fields = ("watchlist",)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class AuctionsConfig(AppConfig):
     name = 'auctions'
+
+    def ready(self):
+        #connect the cache invalidation, post-migrate and connection setup handlers
+        from . import signals  # noqa: F401
@@ -0,0 +1,104 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .cache import invalidate_catalogue, invalidate_listing, invalidate_watchlist_counts
+from .models import (
+    ArchivedBid, ArchivedComment, ArchivedListing, Bids, CategoryStats, Comment, Listings, OutboxEvent, ProxyBid,
+)
+
+#the columns each archived row is copied from; the rest of a listing (top bid, watch flag, end time, ...)
+#only matters while it is open
+LISTING_FIELDS = [
+    "id", "title", "category_id", "item_detail", "starting_bid", "photo_url", "image", "thumbnails",
+    "listed_by_id", "winner_id", "current_price", "bid_count", "comment_count", "creation_time", "closed_at",
+]
+BID_FIELDS = ["id", "listing_id", "bid_amount", "timestamp", "bidder_id"]
+COMMENT_FIELDS = ["id", "listing_id", "user_id", "text", "created_at"]
+
+
+def get_archive_after_days():
+    return getattr(settings, "AUCTIONS_ARCHIVE_AFTER_DAYS", 30)
+
+
+def archivable_listings(now=None, days=None):
+    #closed listings that closed more than days ago; ones closed before closed_at was recorded go by their
+    #last change instead. A listing with a notification still waiting to go out stays until it has been
+    #sent, since the outbox event refers to it
+    days = get_archive_after_days() if days is None else days
+    cutoff = (now or timezone.now()) - timedelta(days=days)
+    pending = OutboxEvent.objects.filter(listing=OuterRef("pk"), status=OutboxEvent.PENDING)
+    return (
+        Listings.objects.filter(active_status=False)
+        .filter(Q(closed_at__lt=cutoff) | Q(closed_at__isnull=True, updated_at__lt=cutoff))
+        .exclude(Exists(pending))
+    )
+
+
+def archive_closed_listings(days=None, batch_size=200, now=None, log=None):
+    #move old closed listings, with their bids and comments, into the archive tables: a batch per
+    #transaction, so readers and bidders only ever wait on one short write. A batch is copied and deleted
+    #in the same transaction, so a listing is always in exactly one of the two places. Returns counts of
+    #what was moved
+    now = now or timezone.now()
+    log = log or (lambda message: None)
+    counts = {"listings": 0, "bids": 0, "comments": 0}
+    last = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                archivable_listings(now, days).filter(pk__gt=last).order_by("pk")
+                .select_for_update(skip_locked=True).values(*LISTING_FIELDS)[:batch_size]
+            )
+            if not batch:
+                return counts
+            last = batch[-1]["id"]
+            ids = [row["id"] for row in batch]
+            watchers = archive_batch(batch, now, counts)
+        #the moved listings' cached fragments, their watchers' badges and the pages that listed them, once
+        #the move has committed
+        for pk in ids:
+            invalidate_listing(pk)
+        invalidate_watchlist_counts(watchers)
+        invalidate_catalogue()
+        log(f"{counts['listings']} listings archived")
+
+
+def archive_batch(batch, now, counts):
+    #copy one batch of listing rows and everything hanging off them, then delete the originals. Returns
+    #the users who had any of them on their watchlist
+    ids = [row["id"] for row in batch]
+    ArchivedListing.objects.bulk_create([ArchivedListing(archived_at=now, **row) for row in batch])
+    bids = Bids.objects.filter(listing_id__in=ids).values(*BID_FIELDS)
+    counts["bids"] += len(ArchivedBid.objects.bulk_create([ArchivedBid(**row) for row in bids], batch_size=500))
+    comments = Comment.objects.filter(listing_id__in=ids).values(*COMMENT_FIELDS)
+    counts["comments"] += len(ArchivedComment.objects.bulk_create([ArchivedComment(**row) for row in comments], batch_size=500))
+
+    through = Listings.watchlist.through
+    watchers = list(through.objects.filter(listings_id__in=ids).values_list("user_id", flat=True).distinct())
+    #children first, the listings last. Foreign keys are only checked at commit, so the listings' top_bid
+    #pointing at bids deleted a statement earlier is fine
+    for model, column in [
+        (through, "listings_id"), (OutboxEvent, "listing_id"), (ProxyBid, "listing_id"),
+        (Comment, "listing_id"), (Bids, "listing_id"), (Listings, "id"),
+    ]:
+        delete_rows(model, column, ids)
+    #the category pages drop these listings, so their version stamp moves
+    categories = {row["category_id"] for row in batch}
+    CategoryStats.objects.filter(pk__in=categories).update(updated_at=now)
+    counts["listings"] += len(ids)
+    return watchers
+
+
+def delete_rows(model, column, ids):
+    #a plain DELETE ... WHERE column IN (ids). The ORM's delete() would load every row first: to send
+    #Listings' delete signals one listing at a time, and to null the top_bid of listings pointing at
+    #bids, which are being deleted anyway
+    quote = connection.ops.quote_name
+    placeholders = ", ".join(["%s"] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {quote(model._meta.db_table)} WHERE {quote(column)} IN ({placeholders})", ids)
+        return cursor.rowcount
@@ -0,0 +1,285 @@
+import asyncio
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.db import OperationalError, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from .bidding import BidRejected, place_bid as engine_place_bid
+from .models import Listings, User
+from .search import icontains_page, search_page, search_terms
+from .seeding import seed
+
+#benchmark scenarios, registered with @scenario. Each is called as fn(context, run) for every timed run
+#and does the work being measured; context is what setup_context() built for the seeded database.
+#A scenario that serves several requests per run says how many, so a throughput can be reported
+SCENARIOS = {}
+
+#simultaneous requests in each run of the *_concurrent scenarios
+CONCURRENCY = 50
+
+#threads bidding at once in the bid_contention scenario, and the bids each one places per run
+WRITERS = 16
+BIDS_PER_WRITER = 10
+
+
+def scenario(name, requests=1):
+    def register(fn):
+        fn.requests = requests
+        SCENARIOS[name] = fn
+        return fn
+    return register
+
+
+@contextmanager
+def scratch_databases():
+    #a throwaway test database for every configured alias, so benchmarks and replays never touch real data
+    setup_test_environment()
+    #cached rows from whatever database was used before would point at rows that don't exist here
+    cache.clear()
+    old_names, old_test_names = {}, {}
+    scratch_dir = tempfile.mkdtemp()
+    try:
+        for alias in connections:
+            settings_dict = connections[alias].settings_dict
+            old_names[alias] = settings_dict["NAME"]
+            if connections[alias].vendor == "sqlite":
+                #a file rather than SQLite's default in-memory test database, so journal mode, locking and
+                #the connection pragmas behave as they do on the real database
+                old_test_names[alias] = settings_dict["TEST"].get("NAME")
+                settings_dict["TEST"]["NAME"] = os.path.join(scratch_dir, f"{alias}.sqlite3")
+            connections[alias].creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        yield
+    finally:
+        for alias, name in old_names.items():
+            connections[alias].creation.destroy_test_db(name, verbosity=0)
+        for alias, test_name in old_test_names.items():
+            connections[alias].settings_dict["TEST"]["NAME"] = test_name
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+        teardown_test_environment()
+        cache.clear()
+
+
+def setup_context(rng):
+    user = User.objects.order_by("pk").first()
+    client = Client()
+    client.force_login(user)
+    active = list(Listings.objects.filter(active_status=True).exclude(listed_by=user).values_list("pk", flat=True)[:600])
+    #hand some active listings to the benchmark user so close_auction always has one of theirs to close
+    split = len(active) - min(100, len(active) // 5)
+    closable = active[split:]
+    Listings.objects.filter(pk__in=closable).update(listed_by=user)
+    bidders = list(User.objects.exclude(pk=user.pk).order_by("pk")[:WRITERS])
+    return {
+        "rng": rng, "user": user, "client": client, "active": active[:split], "closable": closable, "bidders": bidders,
+        "asgi": ASGIHandler(),
+    }
+
+
+@scenario("index")
+def index(context, run):
+    context["client"].get(reverse("index"))
+
+
+@scenario("listing_detail")
+def listing_detail(context, run):
+    context["client"].get(reverse("individual_listing", args=[context["rng"].choice(context["active"])]))
+
+
+@scenario("place_bid")
+def place_bid(context, run):
+    listing_id = context["rng"].choice(context["active"])
+    price = Listings.objects.values_list("current_price", flat=True).get(pk=listing_id)
+    context["client"].post(reverse("add_bid", args=[listing_id]), {"bid_amount": str(price + Decimal("1.00"))})
+
+
+@scenario("close_auction")
+def close_auction(context, run):
+    #close one of the user's own listings each run, so every run does real work
+    if not context["closable"]:
+        return
+    context["client"].post(reverse("close_auction", args=[context["closable"].pop()]))
+
+
+@scenario("watchlist")
+def watchlist(context, run):
+    context["client"].get(reverse("watchlist"))
+
+
+def search_text(context):
+    #a seeded listing's number: a selective search, which the index answers from a few postings while
+    #icontains has to read through the table to find enough rows
+    return str(context["rng"].choice(context["active"]))
+
+
+@scenario("search")
+def search(context, run):
+    search_page(Listings.objects.feed(context["user"]), search_text(context))
+
+
+@scenario("search_icontains")
+def search_icontains(context, run):
+    #the same search as a table scan, for comparison with the full-text index
+    icontains_page(Listings.objects.feed(context["user"]), search_terms(search_text(context)))
+
+
+@scenario("index_wsgi_concurrent", requests=CONCURRENCY)
+def index_wsgi_concurrent(context, run):
+    #a burst of index requests through the WSGI handler, one worker thread per request
+    def get(_):
+        client = Client()
+        client.cookies = context["client"].cookies
+        try:
+            client.get(reverse("index"))
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(CONCURRENCY) as pool:
+        list(pool.map(get, range(CONCURRENCY)))
+
+
+async def asgi_get(application, path, cookies):
+    #one GET sent straight to an ASGI application, the way a server sends it. AsyncClient isn't used: it
+    #runs every request's sync work (ORM calls, rendering) in the one calling thread, where the handler
+    #gives each request a thread of its own
+    headers = [(b"host", b"testserver")]
+    if cookies:
+        headers.append((b"cookie", "; ".join(f"{key}={morsel.value}" for key, morsel in cookies.items()).encode()))
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "", "headers": headers,
+        "client": ("127.0.0.1", 0), "server": ("testserver", 80),
+    }
+    body = [{"type": "http.request", "body": b"", "more_body": False}]
+    disconnected = asyncio.Event()
+    sent = []
+
+    async def receive():
+        if body:
+            return body.pop()
+        #the client stays connected until the response is complete
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    await application(scope, receive, send)
+    return sent[0]["status"]
+
+
+@scenario("index_asgi_concurrent", requests=CONCURRENCY)
+def index_asgi_concurrent(context, run):
+    #the same burst through the ASGI handler and the project's full middleware stack, all requests in
+    #flight on one event loop
+    async def burst():
+        await asyncio.gather(*(
+            asgi_get(context["asgi"], reverse("index"), context["client"].cookies) for _ in range(CONCURRENCY)
+        ))
+
+    asyncio.run(burst())
+
+
+@scenario("bid_contention", requests=WRITERS * BIDS_PER_WRITER)
+def bid_contention(context, run):
+    #many bidders at once, all on the same few listings, straight through the bid engine. Retries are off
+    #so every "database is locked" is counted rather than hidden; run it with AUCTIONS_DB_PROFILE=default
+    #and then tuned to compare the two (--compare shows the difference)
+    listings = context["active"][:4]
+    barrier = threading.Barrier(len(context["bidders"]))
+    counts = {"bids": 0, "rejected": 0, "lock_errors": 0}
+    lock = threading.Lock()
+
+    def bid_loop(bidder, seed):
+        rng = random.Random(seed)
+        tally = dict.fromkeys(counts, 0)
+        barrier.wait()
+        try:
+            for _ in range(BIDS_PER_WRITER):
+                listing_id = rng.choice(listings)
+                price = Listings.objects.values_list("current_price", flat=True).get(pk=listing_id) or Decimal("0")
+                try:
+                    engine_place_bid(listing_id, bidder, price + Decimal(rng.randint(1, 500)) / 100, retries=0)
+                    tally["bids"] += 1
+                except BidRejected:
+                    tally["rejected"] += 1
+                except OperationalError:
+                    tally["lock_errors"] += 1
+        finally:
+            connections.close_all()
+            with lock:
+                for key, value in tally.items():
+                    counts[key] += value
+
+    threads = [
+        threading.Thread(target=bid_loop, args=(bidder, run * WRITERS + i)) for i, bidder in enumerate(context["bidders"])
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counts
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_scenario(fn, context, repeat):
+    timings, query_counts = [], []
+    #a scenario may also return counters (e.g. lock errors); they are added up over all runs
+    counters = {}
+    for run in range(repeat):
+        with CaptureQueriesContext(connections["default"]) as queries:
+            start = time.perf_counter()
+            counted = fn(context, run)
+            timings.append((time.perf_counter() - start) * 1000)
+        query_counts.append(len(queries))
+        for key, value in (counted or {}).items():
+            counters[key] = counters.get(key, 0) + value
+    median = statistics.median(timings)
+    result = {
+        "median_ms": round(median, 3),
+        "throughput_rps": round(fn.requests / median * 1000, 1),
+        "p95_ms": round(percentile(timings, 0.95), 3),
+        "min_ms": round(min(timings), 3),
+        "queries": max(query_counts),
+        **counters,
+    }
+    if "lock_errors" in counters:
+        result["lock_error_rate"] = round(counters["lock_errors"] / (fn.requests * repeat), 4)
+    return result
+
+
+def run_benchmarks(sizes, names=None, repeat=20, users=200, log=None):
+    #seed a fresh database at each size and time every scenario against it
+    log = log or (lambda message: None)
+    names = names or list(SCENARIOS)
+    results = []
+    for size in sizes:
+        with scratch_databases():
+            rng = random.Random(size)
+            log(f"seeding {size} listings")
+            seed(users=users, listings=size, rng=rng)
+            context = setup_context(rng)
+            for name in names:
+                result = run_scenario(SCENARIOS[name], context, repeat)
+                line = f"{size:>8} {name:<24} {result['median_ms']:>9.2f}ms median {result['queries']:>4} queries"
+                if "lock_error_rate" in result:
+                    line += f" {result['lock_error_rate']:>7.1%} lock errors"
+                log(line)
+                results.append({"size": size, "scenario": name, **result})
+    return results
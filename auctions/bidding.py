@@ -0,0 +1,202 @@
+import random
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .events import bid_event, broker
+from .models import Bids, Listings, ProxyBid
+from .notifications import record_outbid
+from .stats import record_bids
+
+
+class BidRejected(Exception):
+    #raised when a bid can't win: it isn't above the current price, or the auction is closed or over
+    def __init__(self, message, current_bid=None):
+        super().__init__(message)
+        self.message = message
+        self.current_bid = current_bid
+
+
+def get_bid_increment():
+    #how far a proxy bid goes above the price it has to beat
+    return Decimal(str(getattr(settings, "AUCTIONS_BID_INCREMENT", "1.00")))
+
+
+def _price_state(listing_id):
+    #plain read with no transaction or lock - used to turn away stale bids cheaply
+    state = (
+        Listings.objects.filter(pk=listing_id)
+        .values("current_price", "starting_bid", "active_status", "end_time")
+        .first()
+    )
+    if state is None:
+        raise Listings.DoesNotExist("Listing not found.")
+    current_bid = state["current_price"] if state["current_price"] is not None else state["starting_bid"]
+    return current_bid, state["active_status"], state["end_time"]
+
+
+def _check_bid(listing_id, amount, now, lost_race=False):
+    current_bid, active, end_time = _price_state(listing_id)
+    if not active:
+        raise BidRejected("This auction is closed.", current_bid)
+    #an auction that has ended is closed for bidding even before the sweeper gets to it
+    if end_time is not None and end_time <= now:
+        raise BidRejected("This auction has ended.", current_bid)
+    if amount <= current_bid or lost_race:
+        raise BidRejected("Bid amount must be greater than the current bid of: ", current_bid)
+
+
+def _with_retries(attempt_bid, retries):
+    for attempt in range(retries + 1):
+        try:
+            return attempt_bid()
+        except OperationalError:
+            #the database was too busy to take the lock (e.g. SQLite's "database is locked"); back
+            #off with jitter and try again - the retry re-checks the price in case the bid went stale
+            if attempt == retries:
+                raise
+            time.sleep(random.uniform(0, min(0.05, 0.001 * 2 ** attempt)))
+
+
+def _announce(listing_id, amount, bidder):
+    #tell anyone watching the listing live, once the bid is really committed. The bid count costs a
+    #read, so it's only fetched when this process has someone to tell
+    if broker.subscriber_count(listing_id):
+        bid_count = Listings.objects.values_list("bid_count", flat=True).get(pk=listing_id)
+        event = bid_event(listing_id, amount, bidder.username, bid_count)
+        transaction.on_commit(lambda: broker.publish(listing_id, event))
+
+
+def place_bid(listing_id, bidder, amount, retries=5):
+    def attempt():
+        #fast path: most losing bids are stale (someone already bid more), and those are rejected
+        #from a lock-free read without ever opening a write transaction
+        now = timezone.now()
+        _check_bid(listing_id, amount, now)
+        with transaction.atomic():
+            #compare-and-set: the price only moves if it is still below this bid. The listing's
+            #price only ever goes up, so it doubles as the row's version number - if another bid
+            #landed first this matches no row and the bid has lost
+            claimed = (
+                Listings.objects
+                .filter(pk=listing_id, active_status=True)
+                .filter(Q(end_time__isnull=True) | Q(end_time__gt=now))
+                .filter(Q(current_price__lt=amount) | Q(current_price__isnull=True, starting_bid__lt=amount))
+                .update(current_price=amount, bid_count=F("bid_count") + 1, updated_at=now)
+            )
+            if not claimed:
+                _check_bid(listing_id, amount, now, lost_race=True)
+            #the UPDATE above holds the row's write lock until commit, so nothing can slip in
+            #between claiming the price and recording the bid as the top bid
+            bid = Bids.objects.create(listing_id=listing_id, bid_amount=amount, bidder=bidder)
+            #whoever held the top bid until now has been outbid - read under the same lock, so it is the
+            #bid this one really replaced. Telling them is left to the outbox worker. The seller's own
+            #starting bid is the top bid until the first real one, and the seller is never told they were
+            #outbid by it
+            holder, seller = Listings.objects.values_list("top_bid__bidder_id", "listed_by_id").get(pk=listing_id)
+            outbid = [holder] if holder not in (bidder.pk, seller) else []
+            Listings.objects.filter(pk=listing_id).update(top_bid=bid)
+            _announce(listing_id, amount, bidder)
+            #anyone with a proxy bid above this one answers it straight away, in the same transaction.
+            #This transaction has just set the bid state, so it is passed along rather than read back
+            state = {"current_price": amount, "starting_bid": None, "top_bid__bidder_id": bidder.pk, "listed_by_id": seller}
+            if _resolve_proxies(listing_id, state, outbid, placed=1) is None:
+                record_bids(listing_id, 1, now)
+                record_outbid(listing_id, outbid, amount, now)
+        return bid
+
+    return _with_retries(attempt, retries)
+
+
+def set_proxy_bid(listing_id, bidder, max_amount, retries=5):
+    #store (or change) the bidder's maximum for the listing and let the engine bid for them. Returns the
+    #bid placed on their behalf, or None if nothing needed placing (e.g. they already hold the top bid)
+    def attempt():
+        now = timezone.now()
+        _check_bid(listing_id, max_amount, now)
+        with transaction.atomic():
+            #lock the listing first, so a proxy saved by a concurrent request is either already committed
+            #(and seen below) or waits for this one to finish
+            state = _locked_state(listing_id)
+            if not state["active_status"] or (state["end_time"] is not None and state["end_time"] <= now):
+                #the auction closed since the lock-free check
+                _check_bid(listing_id, max_amount, now)
+            #saved with one upsert statement
+            ProxyBid.objects.bulk_create(
+                [ProxyBid(listing_id=listing_id, bidder=bidder, max_amount=max_amount)],
+                update_conflicts=True, unique_fields=["listing", "bidder"], update_fields=["max_amount"],
+            )
+            return _resolve_proxies(listing_id, state)
+
+    return _with_retries(attempt, retries)
+
+
+def _locked_state(listing_id):
+    #the listing's bid state, with its row locked until the transaction ends where the database has
+    #row locks (on SQLite the first write in the transaction serialises it instead)
+    return (
+        Listings.objects.select_for_update(of=("self",))
+        .values("current_price", "starting_bid", "top_bid__bidder_id", "listed_by_id", "active_status", "end_time")
+        .get(pk=listing_id)
+    )
+
+
+def _resolve_proxies(listing_id, state=None, outbid=(), placed=0):
+    #settle every proxy on the listing in one step. Only the two highest maximums matter: the highest
+    #one wins, at one increment above whatever is left to beat (the runner-up's maximum or the current
+    #price, if that is held by someone else), capped at its own maximum. Both come off the front of the
+    #proxy ranking index, so this is the same two-row read for two proxies or two thousand.
+    #Must run inside a transaction that has already locked the listing (see _locked_state), or written
+    #to it, so two resolutions on one listing always run one after the other. When a proxy answers, the
+    #caller's own bookkeeping is folded into this one's: placed is how many bids the caller placed, for the
+    #category stats, and outbid the users it outbid, who are told along with everyone the answering proxy
+    #outbids - unless it is their own proxy answering, which puts them straight back on top
+    proxies = list(
+        ProxyBid.objects.filter(listing_id=listing_id)
+        .select_related("bidder")
+        .order_by("-max_amount", "created_at")[:2]
+    )
+    if not proxies:
+        return None
+    leader, runner_up = proxies[0], proxies[1] if len(proxies) > 1 else None
+    state = state or _locked_state(listing_id)
+    price = state["current_price"] if state["current_price"] is not None else state["starting_bid"]
+    holder = state["top_bid__bidder_id"]
+
+    #the most anyone other than the leader is offering
+    rival = runner_up.max_amount if runner_up else None
+    if holder != leader.bidder_id and (rival is None or price > rival):
+        rival = price
+    if rival is None:
+        #the leader already holds the top bid and has no competition
+        return None
+    #equal maximums go to the earlier proxy, at that maximum
+    target = min(leader.max_amount, rival + get_bid_increment())
+    if target <= price:
+        #either the leader can't beat the current price, or already holds it at a high enough price
+        return None
+
+    #the history shows the runner-up's proxy going to its maximum before the leader's answer
+    bids = []
+    if runner_up and price < runner_up.max_amount < target:
+        bids.append(Bids(listing_id=listing_id, bid_amount=runner_up.max_amount, bidder=runner_up.bidder))
+    bids.append(Bids(listing_id=listing_id, bid_amount=target, bidder=leader.bidder))
+    for bid in bids:
+        #saved one at a time so the bid ids follow the order the bids were made in
+        bid.save()
+    Listings.objects.filter(pk=listing_id).update(
+        current_price=target, top_bid=bids[-1], bid_count=F("bid_count") + len(bids), updated_at=timezone.now(),
+    )
+    record_bids(listing_id, placed + len(bids))
+    _announce(listing_id, target, leader.bidder)
+    #the previous holder has been outbid (unless it was the seller's starting bid), and so has the
+    #runner-up if its proxy bid went in
+    outbid = [*outbid, holder] + [bid.bidder_id for bid in bids[:-1]]
+    record_outbid(
+        listing_id, [user_id for user_id in outbid if user_id not in (leader.bidder_id, state["listed_by_id"])], target,
+    )
+    return bids[-1]
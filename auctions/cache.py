@@ -0,0 +1,144 @@
+import threading
+import uuid
+from collections import Counter
+
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from .models import Category
+from .replicas import primary_reads
+
+#how long each kind of entry may live; signal handlers in signals.py delete entries as soon as the
+#underlying rows change, so these are only an upper bound
+CATEGORIES_TIMEOUT = 60 * 60
+LISTING_FRAGMENT_TIMEOUT = 60 * 60
+WATCHLIST_COUNT_TIMEOUT = 60 * 60
+
+CATEGORIES_KEY = "auctions:categories"
+CATALOGUE_VERSION_KEY = "auctions:catalogue_version"
+
+#hit/miss counters for this process, per kind of entry, e.g. {"categories:hit": 10, "categories:miss": 1}
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(kind, outcome):
+    with _stats_lock:
+        _stats[f"{kind}:{outcome}"] += 1
+
+
+def cache_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_cache_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def cached(kind, key, compute, timeout):
+    #get key from the cache, or compute and store it on a miss. Counts the outcome under kind
+    value = cache.get(key)
+    if value is not None:
+        _count(kind, "hit")
+        return value
+    _count(kind, "miss")
+    #filled from the primary: the entry outlives the request, so a lagging replica's rows would stay
+    #cached as current long after the replica caught up
+    with primary_reads():
+        value = compute()
+    cache.set(key, value, timeout)
+    return value
+
+
+def get_categories():
+    return cached("categories", CATEGORIES_KEY, lambda: list(Category.objects.order_by("name")), CATEGORIES_TIMEOUT)
+
+
+def get_category(category_id):
+    #looked up in the cached category list, so category pages don't need a query for it
+    return next((category for category in get_categories() if category.id == category_id), None)
+
+
+def invalidate_categories():
+    cache.delete(CATEGORIES_KEY)
+
+
+def listing_fragment_key(listing_id):
+    return f"auctions:listing:{listing_id}:details"
+
+
+def get_listing_fragment(listing):
+    #the rendered details block of a listing (photo, description, seller, category). None of it changes
+    #when a bid lands, so it stays cached until the listing row itself is saved
+    return cached(
+        "listing_fragment",
+        listing_fragment_key(listing.pk),
+        lambda: render_to_string("auctions/listing_details.html", {"listing": listing}),
+        LISTING_FRAGMENT_TIMEOUT,
+    )
+
+
+def invalidate_listing(listing_id):
+    cache.delete(listing_fragment_key(listing_id))
+
+
+def invalidate_listings(listing_ids, batch_size=1000):
+    #the fragments of many listings, e.g. every listing in a renamed category, a batch of keys at a time
+    keys = []
+    for listing_id in listing_ids:
+        keys.append(listing_fragment_key(listing_id))
+        if len(keys) == batch_size:
+            cache.delete_many(keys)
+            keys = []
+    if keys:
+        cache.delete_many(keys)
+
+
+def watchlist_count_key(user_id):
+    return f"auctions:user:{user_id}:watchlist_count"
+
+
+def get_watchlist_count(user):
+    return cached(
+        "watchlist_count",
+        watchlist_count_key(user.pk),
+        lambda: user.watchlist.count(),
+        WATCHLIST_COUNT_TIMEOUT,
+    )
+
+
+def watchlist_version_key(user_id):
+    return f"auctions:user:{user_id}:watchlist_version"
+
+
+def get_watchlist_version(user):
+    #an opaque token that changes whenever the user's watchlist does, for the ETags of pages that show
+    #watchlist state
+    return version_token(watchlist_version_key(user.pk), WATCHLIST_COUNT_TIMEOUT)
+
+
+def get_catalogue_version():
+    #a token that changes whenever a listing is deleted or archived, for the ETags of the index and
+    #category pages. Their stamp is the newest updated_at, which a listing that is gone no longer has
+    return version_token(CATALOGUE_VERSION_KEY, LISTING_FRAGMENT_TIMEOUT)
+
+
+def invalidate_catalogue():
+    cache.delete(CATALOGUE_VERSION_KEY)
+
+
+def version_token(key, timeout):
+    #the token stored under key. If it has been evicted a new one is made, which only costs a full render
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(key, version, timeout):
+            version = cache.get(key, version)
+    return version
+
+
+def invalidate_watchlist_counts(user_ids):
+    #the count and the version token go together: whatever changed the count changed the watchlist
+    cache.delete_many([key for user_id in user_ids for key in (watchlist_count_key(user_id), watchlist_version_key(user_id))])
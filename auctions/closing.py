@@ -0,0 +1,98 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, OuterRef, Subquery, Value, When
+from django.utils import timezone
+
+from .models import Bids, Listings, OutboxEvent
+from .notifications import record_won
+from .stats import record_closes, record_reopens
+
+
+def close_listings(listing_ids, now=None):
+    #close a batch of auctions in one statement: the winner is whoever placed the listing's top bid
+    #(None when nobody bid), resolved by a correlated subquery instead of a lookup per listing. A top bid
+    #of the seller's own - the starting bid create_listing records - wins nothing, so that's None too.
+    #Listings that are already closed are skipped, so closing the same batch twice - or from two
+    #processes at once - is harmless. Returns how many listings this call actually closed
+    now = now or timezone.now()
+    top_bidder = Bids.objects.filter(pk=OuterRef("top_bid")).exclude(bidder=OuterRef("listed_by")).values("bidder")[:1]
+    with transaction.atomic():
+        #a bulk update sends no post_save, which is fine here: the cached details fragment and watchlist
+        #counts don't depend on whether a listing is open
+        closed = Listings.objects.filter(pk__in=listing_ids, active_status=True).update(
+            active_status=False,
+            winner=Subquery(top_bidder),
+            closed_at=now,
+            updated_at=now,
+        )
+        if closed:
+            #the closed_at stamp picks out the listings this call (and not an earlier one) closed
+            rows = list(
+                Listings.objects.filter(pk__in=listing_ids, closed_at=now)
+                .values_list("pk", "category_id", "winner_id", "listed_by_id", "current_price")
+            )
+            #the winners hear about it from the outbox worker, if and only if the close commits
+            record_won([(pk, winner_id, price) for pk, _, winner_id, _, price in rows], now)
+            record_closes([row[1:] for row in rows], now)
+    return closed
+
+
+def get_relist_days():
+    #how long a relisted auction whose end time had passed runs for
+    return getattr(settings, "AUCTIONS_RELIST_DAYS", 7)
+
+
+def reopen_listings(listing_ids, now=None):
+    #put a batch of closed auctions back on the market in one statement, the reverse of close_listings:
+    #the winner is cleared and bidding carries on from the current price. A listing whose end time has
+    #passed gets a new one get_relist_days() away, or the sweep would close it again straight away.
+    #Open listings are skipped. Returns how many listings this call reopened
+    now = now or timezone.now()
+    ends = now + timedelta(days=get_relist_days())
+    with transaction.atomic():
+        #the rows as they were, for the stats to take their closes back out
+        rows = list(
+            Listings.objects.filter(pk__in=listing_ids, active_status=False)
+            .select_for_update().values_list("pk", "category_id", "winner_id", "listed_by_id", "current_price")
+        )
+        if not rows:
+            return 0
+        ids = [row[0] for row in rows]
+        reopened = Listings.objects.filter(pk__in=ids, active_status=False).update(
+            active_status=True,
+            winner=None,
+            closed_at=None,
+            end_time=Case(When(end_time__lte=now, then=Value(ends)), default=F("end_time")),
+            updated_at=now,
+        )
+        #an "auction won" notice still waiting to go out is no longer true
+        OutboxEvent.objects.filter(
+            listing_id__in=ids, kind=OutboxEvent.WON, status=OutboxEvent.PENDING,
+        ).delete()
+        record_reopens([row[1:] for row in rows], now)
+    return reopened
+
+
+def due_listings(now=None):
+    #open listings whose end time has passed, oldest deadline first (read from listing_due_idx)
+    now = now or timezone.now()
+    return Listings.objects.filter(active_status=True, end_time__isnull=False, end_time__lte=now).order_by("end_time")
+
+
+def close_expired_auctions(batch_size=500, now=None):
+    #close every auction that has ended, a batch per transaction so no write lock is held for long.
+    #Where the database supports it, SKIP LOCKED lets several sweepers share the work without waiting
+    #on each other; elsewhere they may pick the same batch, and the active_status guard in
+    #close_listings makes sure each listing is only closed once
+    now = now or timezone.now()
+    closed = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                due_listings(now).select_for_update(skip_locked=True).values_list("pk", flat=True)[:batch_size]
+            )
+            if not batch:
+                return closed
+            closed += close_listings(batch, now)
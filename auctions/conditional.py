@@ -0,0 +1,101 @@
+import hashlib
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.messages import get_messages
+
+from django.db.models import Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .cache import get_catalogue_version, get_categories, get_watchlist_version
+from .helpers import aresolve_user
+from .models import Listings
+from .stats import acategory_stats
+
+
+def conditional(version_func):
+    #django.views.decorators.http.condition for the async read views. condition() calls its ETag and
+    #Last-Modified functions synchronously, which rules out the async ORM; here version_func is awaited
+    #and returns (etag, last_modified) together, since both come from the same lookup. When the
+    #client's copy is current the view never runs and a 304 goes back instead
+    def decorator(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            #a page carrying flash messages is a one-off: it gets neither a 304 nor a validator, or the
+            #browser would show the messages again from its copy the next time the page is unchanged
+            if request.method not in ("GET", "HEAD") or get_messages(request):
+                return await view(request, *args, **kwargs)
+            etag, last_modified = await version_func(request, *args, **kwargs)
+            if etag is None:
+                #nothing to version (e.g. the listing doesn't exist) - let the view deal with it
+                return await view(request, *args, **kwargs)
+            etag = quote_etag(etag)
+            timestamp = int(last_modified.timestamp()) if last_modified else None
+            response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            response.headers.setdefault("ETag", etag)
+            if timestamp:
+                response.headers.setdefault("Last-Modified", http_date(timestamp))
+            #pages differ per user, so only the user's own browser may keep them, and must revalidate
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return inner
+    return decorator
+
+
+def page_tag(user, categories=False, catalogue=False):
+    #the parts of a page's version that live in the cache: who is looking, the state of their watchlist
+    #(the badge and the "on your watchlist" flags), for pages that list listings the catalogue token and,
+    #for pages that name them, the categories. A cache miss reloads the categories, so this runs in a
+    #worker thread
+    tag = f"u{user.pk}.{get_watchlist_version(user)}" if user.is_authenticated else "anon"
+    if catalogue:
+        tag += f"-c{get_catalogue_version()[:12]}"
+    if categories:
+        names = "|".join(f"{category.pk}:{category.name}" for category in get_categories())
+        tag += "-" + hashlib.md5(names.encode(), usedforsecurity=False).hexdigest()[:12]
+    return tag
+
+
+async def catalogue_stamp():
+    #the newest change to any listing, read off the end of listing_updated_idx
+    return (await Listings.objects.aaggregate(stamp=Max("updated_at")))["stamp"]
+
+
+async def catalogue_version(request, *args, **kwargs):
+    #the index changes whenever any listing does, or one is deleted or archived
+    user = await aresolve_user(request)
+    stamp = await catalogue_stamp()
+    return f"catalogue-{stamp.timestamp() if stamp else 0}-{await sync_to_async(page_tag)(user, catalogue=True)}", stamp
+
+
+async def category_version(request, category_id):
+    #a category's page changes whenever any listing does (or goes), its stats are rebuilt, or the
+    #categories are renamed. The stats row is kept on the request for the view
+    user = await aresolve_user(request)
+    stamps = [await catalogue_stamp()]
+    stats = await acategory_stats(request, category_id)
+    if stats is not None:
+        stamps.append(stats.updated_at)
+    stamp = max((stamp for stamp in stamps if stamp), default=None)
+    tag = await sync_to_async(page_tag)(user, categories=True, catalogue=True)
+    return f"category-{category_id}-{stamp.timestamp() if stamp else 0}-{tag}", stamp
+
+
+async def categories_version(request):
+    #the categories page changes with any category's stats, which it reads once for this and the view
+    user = await aresolve_user(request)
+    stamp = max((stats.updated_at for stats in (await acategory_stats(request)).values()), default=None)
+    tag = await sync_to_async(page_tag)(user, categories=True)
+    return f"categories-{stamp.timestamp() if stamp else 0}-{tag}", stamp
+
+
+async def listing_version(request, listing_id):
+    #one primary key lookup of the listing's own version stamp
+    user = await aresolve_user(request)
+    stamp = await Listings.objects.filter(pk=listing_id).values_list("updated_at", flat=True).afirst()
+    if stamp is None:
+        return None, None
+    return f"listing-{listing_id}-{stamp.timestamp()}-{await sync_to_async(page_tag)(user)}", stamp
@@ -1,11 +1,14 @@
-from django.conf import settings
-from .models import Listings
+from django.utils.functional import SimpleLazyObject
+
+from .cache import get_watchlist_count
 
 def watchlist_item_count(request):
+    #lazy, so pages that never show the watchlist badge never look the count up. When a page does, it's
+    #this user's cached count (see cache.get_watchlist_count), not a count over the whole table
     if request.user.is_authenticated:
-        count = Listings.objects.filter(watchlist_status=True).count()
+        count = SimpleLazyObject(lambda: get_watchlist_count(request.user))
     else:
         count = 0
     return {
         'watchlist_item_count': count
-    }
\ No newline at end of file
+    }
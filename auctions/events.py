@@ -0,0 +1,107 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+
+
+class Subscription:
+    #one watcher of one listing: a bounded queue that lives on the watcher's event loop
+
+    def __init__(self, listing_id, loop, maxsize):
+        self.listing_id = listing_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def deliver(self, event):
+        #runs on the subscriber's own loop. A watcher that has fallen behind drops its oldest event
+        #rather than letting the queue grow - only the latest price matters to it
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout=None):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class Broker:
+    #in-process fan-out of listing events. Publishing costs one loop callback per watcher and never
+    #blocks the publisher; it only reaches watchers connected to this process
+
+    def __init__(self, queue_size=None):
+        self.queue_size = queue_size or getattr(settings, "AUCTIONS_EVENT_QUEUE_SIZE", 8)
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, listing_id):
+        subscription = Subscription(listing_id, asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscribers[listing_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            watchers = self._subscribers.get(subscription.listing_id)
+            if watchers is not None:
+                watchers.discard(subscription)
+                if not watchers:
+                    del self._subscribers[subscription.listing_id]
+
+    def subscriber_count(self, listing_id):
+        with self._lock:
+            return len(self._subscribers.get(listing_id, ()))
+
+    def publish(self, listing_id, event):
+        #safe to call from any thread, e.g. a transaction.on_commit callback in a sync view
+        with self._lock:
+            watchers = list(self._subscribers.get(listing_id, ()))
+        for subscription in watchers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                #the watcher's loop has shut down without unsubscribing
+                self.unsubscribe(subscription)
+
+
+broker = Broker()
+
+
+def bid_event(listing_id, price, bidder, bid_count):
+    return {"listing": listing_id, "price": str(price), "bidder": bidder, "bid_count": bid_count}
+
+
+def format_sse(event):
+    return f"data: {json.dumps(event)}\n\n"
+
+
+async def event_stream(listing_id, initial, keepalive=15):
+    #an async generator for a StreamingHttpResponse: the current state first, then every bid as it
+    #is committed, with a comment line every so often so proxies don't close an idle connection
+    subscription = broker.subscribe(listing_id)
+    try:
+        yield format_sse(initial)
+        while True:
+            try:
+                yield format_sse(await subscription.get(timeout=keepalive))
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+    finally:
+        broker.unsubscribe(subscription)
+
+
+async def wait_for_change(listing_id, read_state, since, timeout):
+    #the long-poll fallback: the listing's current state (from the awaitable read_state) if its bid count
+    #has moved on from since, otherwise the next event for it, or None if nothing happened in time. The
+    #subscription is taken before the state is read, so a bid committed in between is either already in
+    #the state or waiting in the queue, never lost to a poll that hangs until its timeout
+    subscription = broker.subscribe(listing_id)
+    try:
+        state = await read_state(listing_id)
+        if state["bid_count"] != since:
+            return state
+        return await subscription.get(timeout=timeout)
+    except asyncio.TimeoutError:
+        return None
+    finally:
+        broker.unsubscribe(subscription)
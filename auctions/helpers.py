@@ -1,23 +1,202 @@
-from auctions.models import Listings
+import base64
+import binascii
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import F, Q
+from django.http import StreamingHttpResponse
+from django.shortcuts import render
+from django.template.loader import get_template, render_to_string
+from django.utils import timezone
+
+from auctions.events import bid_event
+from auctions.models import Comment, Listings
 
 def get_current_bid(listing):
-    current_bid = listing.bids.order_by('-timestamp').first()
-    return current_bid.bid_amount if current_bid else listing.starting_bid
+    #current_price is the denormalized price kept up to date by record_bid, so no Bids query is needed
+    return listing.current_price if listing.current_price is not None else listing.starting_bid
+
+def get_current_bidder(listing):
+    #the top bid is a foreign key on the listing, so this is free when fetched with select_related
+    return listing.top_bid.bidder if listing.top_bid else None
+
+def listings_with_bids(listings, user=None):
+    #turn a Listings.objects.feed() queryset into the rows the index template loops over. Everything
+    #needed is already annotated or joined onto each listing, so this loop runs no further queries.
+    #bid_value is only filled in when the given user holds the top bid (or when no user is given)
+    rows = []
+    for listing in listings:
+        current_bidder = get_current_bidder(listing)
+        rows.append({
+            "listing": listing,
+            "current_bid": listing.current_bid,
+            "current_bidder": current_bidder,
+            "bid_value": listing.current_bid if user is None or current_bidder == user else None,
+        })
+    return rows
+
+def archived_with_bids(listings):
+    #the same rows for ArchivedListing, whose winner placed its last bid
+    return [
+        {"listing": listing, "current_bid": listing.current_bid, "current_bidder": listing.winner, "bid_value": listing.current_bid}
+        for listing in listings
+    ]
+
+def get_page_size():
+    return getattr(settings, "AUCTIONS_PAGE_SIZE", 25)
+
+def encode_cursor(listing):
+    #a cursor is the (creation_time, id) of the last listing on a page, so the next page can start
+    #right after it with an indexed range scan instead of an OFFSET that re-reads every earlier row
+    return encode_position(listing.creation_time, listing.pk)
+
+def encode_position(timestamp, pk):
+    raw = f"{timestamp.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    #returns None for a missing or tampered cursor, which simply means "start from the first page"
+    if not cursor:
+        return None
+    try:
+        created, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+def keyset_order(listings, cursor=None):
+    #newest listings first; id breaks ties between listings created in the same instant
+    listings = listings.order_by("-creation_time", "-id")
+    position = decode_cursor(cursor)
+    if position:
+        created, pk = position
+        listings = listings.filter(Q(creation_time__lt=created) | Q(creation_time=created, id__lt=pk))
+    return listings
+
+def keyset_page(listings, cursor=None, page_size=None):
+    #fetch one page plus one extra row - the extra row only tells us whether there is a next page
+    page_size = page_size or get_page_size()
+    page = list(keyset_order(listings, cursor)[:page_size + 1])
+    next_cursor = encode_cursor(page[page_size - 1]) if len(page) > page_size else None
+    return page[:page_size], next_cursor
+
+async def akeyset_page(listings, cursor=None, page_size=None):
+    #keyset_page for async views, fetched with the async ORM
+    page_size = page_size or get_page_size()
+    page = [listing async for listing in keyset_order(listings, cursor)[:page_size + 1]]
+    next_cursor = encode_cursor(page[page_size - 1]) if len(page) > page_size else None
+    return page[:page_size], next_cursor
+
+async def aresolve_user(request):
+    #resolve the session's user without blocking, and put it back on the request so template context
+    #processors (rendered in a worker thread) reuse it instead of loading the user a second time
+    request.user = await request.auser()
+    return request.user
+
+async def alist(queryset):
+    return [row async for row in queryset]
+
+async def is_watching(user, listing_id):
+    #whether an active listing is on this user's watchlist; always False for anonymous users
+    if not user.is_authenticated:
+        return False
+    return await user.watchlist.filter(pk=listing_id, active_status=True).aexists()
+
+async def arender(request, template, context):
+    #templates, context processors and the lazy watchlist badge may touch the ORM, which isn't allowed
+    #on the event loop, so rendering runs in a worker thread
+    return await sync_to_async(render)(request, template, context)
+
+async def arender_listing_page(request, template, context, listings):
+    #shared by the index and category pages: render one keyset page of listings, or stream them all
+    #when asked to with ?stream=1 (or always, if AUCTIONS_STREAM_LISTINGS is set)
+    if request.GET.get("stream") or getattr(settings, "AUCTIONS_STREAM_LISTINGS", False):
+        return await sync_to_async(stream_listing_page)(request, template, context, listings)
+    page, next_cursor = await akeyset_page(listings, request.GET.get("cursor"))
+    context.update({
+        "listings_with_bids": listings_with_bids(page),
+        "next_cursor": next_cursor,
+    })
+    return await arender(request, template, context)
+
+def stream_listing_page(request, template, context, listings, chunk_size=500):
+    #render the page once with a marker where the rows go, then send the rows one at a time from a
+    #database iterator, so memory stays flat however many listings there are
+    page = render_to_string(template, {**context, "streaming": True}, request=request)
+    head, tail = page.split("<!--listing-rows-->", 1)
+    row_template = get_template("auctions/listing_row.html")
+
+    def rows():
+        yield head
+        for listing in keyset_order(listings).iterator(chunk_size=chunk_size):
+            #rows are rendered without the request so context processors don't run once per row
+            yield row_template.render({"listing_with_bid": listings_with_bids([listing])[0]})
+        yield tail
+
+    return StreamingHttpResponse(rows())
+
+def get_comments_page_size():
+    return getattr(settings, "AUCTIONS_COMMENTS_PAGE_SIZE", 20)
+
+def comment_order(listing_id, cursor=None):
+    #a listing's comments newest first, with each comment's user joined in. Walks comment_listing_time_idx
+    #backwards (the index ends in the rowid, which breaks ties), starting after the cursor's comment
+    comments = Comment.objects.filter(listing_id=listing_id).select_related("user").order_by("-created_at", "-id")
+    position = decode_cursor(cursor)
+    if position:
+        created, pk = position
+        comments = comments.filter(Q(created_at__lt=created) | Q(created_at=created, id__lt=pk))
+    return comments
+
+async def acomment_page(listing_id, cursor=None, page_size=None):
+    #one page of a listing's comment thread plus the cursor for the next, the same way akeyset_page pages
+    #listings; only the page is ever read, however long the thread is
+    page_size = page_size or get_comments_page_size()
+    page = [comment async for comment in comment_order(listing_id, cursor)[:page_size + 1]]
+    next_cursor = encode_position(page[page_size - 1].created_at, page[page_size - 1].pk) if len(page) > page_size else None
+    return page[:page_size], next_cursor
+
+def record_bid(listing, bid):
+    #must be called inside the same transaction that saved the bid, so the listing's price, top bid
+    #and bid count can never disagree with the Bids table
+    Listings.objects.filter(pk=listing.pk).update(
+        current_price=bid.bid_amount,
+        top_bid=bid,
+        bid_count=F("bid_count") + 1,
+        updated_at=timezone.now(),
+    )
+    listing.current_price = bid.bid_amount
+    listing.top_bid = bid
+    listing.bid_count += 1
 
 def get_listing_context(listing_id):
-    listing = Listings.objects.get(id=listing_id)
+    listing = Listings.objects.select_related("category", "listed_by", "winner", "top_bid__bidder").get(id=listing_id)
+    return listing_context(listing)
+
+async def aget_listing_context(listing_id):
+    listing = await Listings.objects.select_related("category", "listed_by", "winner", "top_bid__bidder").aget(id=listing_id)
+    return listing_context(listing)
+
+def listing_context(listing):
     return {
         "listing": listing,
         "title": listing.title,
         "photo_url": listing.photo_url,
         "item_detail": listing.item_detail,
-        "current_bid": listing.bids.order_by('-timestamp').first().bid_amount if listing.bids.exists() else None,
+        "current_bid": listing.current_price,
         "listed_by": listing.listed_by,
         "category": listing.category,
-        "bid_count": listing.bids.count(),
+        "bid_count": listing.bid_count,
+        "comment_count": listing.comment_count,
         "active_status": listing.active_status,
         "watchlist_status": listing.watchlist_status,
         "starting_bid": listing.starting_bid,
         "winner": listing.winner,
     }
 
+async def aget_bid_state(listing_id):
+    #the listing's live bid state in the same shape as the events place_bid publishes
+    listing = await Listings.objects.select_related("top_bid__bidder").aget(id=listing_id)
+    bidder = get_current_bidder(listing)
+    return bid_event(listing.pk, get_current_bid(listing), bidder.username if bidder else None, listing.bid_count)
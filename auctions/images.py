@@ -0,0 +1,218 @@
+import hashlib
+import logging
+import multiprocessing
+import threading
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .cache import invalidate_listing
+from .models import Listings
+from .thumbnails import Image, image_extension, readable, render_thumbnails
+
+logger = logging.getLogger("auctions.images")
+
+#where listing images are stored in MEDIA_ROOT. Every file is named by a hash of its contents, so a name
+#always means the same bytes: the files can be cached forever, and the same image is stored only once
+ORIGINALS_DIR = "listings"
+THUMBNAILS_DIR = "listings/thumbs"
+
+
+class ImageRejected(Exception):
+    #raised for an upload or download that isn't an image we accept
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+def get_thumbnail_widths():
+    return sorted(getattr(settings, "AUCTIONS_THUMBNAIL_WIDTHS", [160, 320, 640]))
+
+
+def get_max_image_bytes():
+    return getattr(settings, "AUCTIONS_MAX_IMAGE_BYTES", 5 * 1024 * 1024)
+
+
+def get_thumbnail_workers():
+    #processes in the thumbnail pool; 0 resizes in the calling thread instead (e.g. in tests)
+    return getattr(settings, "AUCTIONS_THUMBNAIL_WORKERS", 2)
+
+
+def thumbnails_enabled():
+    return Image is not None
+
+
+def store(data, extension, directory=ORIGINALS_DIR, suffix=""):
+    name = f"{directory}/{hashlib.sha256(data).hexdigest()[:24]}{suffix}.{extension}"
+    if not default_storage.exists(name):
+        name = default_storage.save(name, ContentFile(data))
+    return name
+
+
+def ingest(data):
+    #check an image's bytes and store them, returning the stored name for Listings.image
+    if len(data) > get_max_image_bytes():
+        raise ImageRejected(f"Images can be at most {get_max_image_bytes() // (1024 * 1024)}MB.")
+    extension = image_extension(data)
+    if extension is None or not readable(data):
+        raise ImageRejected("Upload a JPEG, PNG, GIF or WebP image.")
+    return store(data, extension)
+
+
+def download(url, timeout=10):
+    #fetch a hot-linked photo_url for ingest, reading no more than the size limit allows
+    if not url.startswith(("http://", "https://")):
+        raise ImageRejected(f"Not a web address: {url}")
+    request = urllib.request.Request(url, headers={"User-Agent": "auctions-image-ingest"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        data = response.read(get_max_image_bytes() + 1)
+    if len(data) > get_max_image_bytes():
+        raise ImageRejected(f"{url} is larger than {get_max_image_bytes()} bytes.")
+    return data
+
+
+def store_thumbnails(rendered):
+    #{width: stored name} for the output of render_thumbnails, as kept in Listings.thumbnails
+    return {
+        str(width): store(data, "jpg", THUMBNAILS_DIR, f"-{width}w") for width, data in sorted(rendered.items())
+    }
+
+
+def save_thumbnails(listing_id, image, rendered):
+    #record the thumbnails on the listing, unless its image was replaced while they were being made. The
+    #version stamp moves so cached copies of its pages pick them up
+    thumbnails = store_thumbnails(rendered)
+    updated = Listings.objects.filter(pk=listing_id, image=image).update(thumbnails=thumbnails, updated_at=timezone.now())
+    invalidate_listing(listing_id)
+    return updated
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(workers=None):
+    #the process pool, started on first use. Workers are spawned rather than forked, as forking a process
+    #that is already running threads (a web server's) can leave a worker holding a copied lock forever
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=workers or get_thumbnail_workers(), mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def schedule_thumbnails(listing_id, image):
+    #make the listing's thumbnails in the background and return at once: the listing shows its original
+    #image until they're ready. Without Pillow there is nothing to do
+    if not thumbnails_enabled():
+        return
+    with default_storage.open(image) as f:
+        data = f.read()
+    if not get_thumbnail_workers():
+        try:
+            save_thumbnails(listing_id, image, render_thumbnails(data, get_thumbnail_widths()))
+        except Exception:
+            logger.exception("Could not make thumbnails for listing %s from %s", listing_id, image)
+        return
+    future = get_pool().submit(render_thumbnails, data, get_thumbnail_widths())
+    future.add_done_callback(partial(_thumbnails_done, listing_id, image))
+
+
+def _thumbnails_done(listing_id, image, future):
+    #runs on the pool's management thread in this process, outside any request, so it looks after its own
+    #database connection the way a request would
+    close_old_connections()
+    try:
+        save_thumbnails(listing_id, image, future.result())
+    except Exception:
+        logger.exception("Could not make thumbnails for listing %s from %s", listing_id, image)
+    finally:
+        close_old_connections()
+
+
+def backfill_images(batch_size=100, workers=None, fetch=True, timeout=10, log=None):
+    #bring existing listings onto local images, a batch at a time: download the photo_url of listings
+    #without an image (a thread per download, since they mostly wait on the network), then make the
+    #thumbnails of listings without any on a process pool. Listings whose photo can't be fetched keep
+    #showing their photo_url. Returns counts of what was done
+    log = log or (lambda message: None)
+    counts = {"downloaded": 0, "failed": 0, "thumbnailed": 0}
+    if fetch:
+        pending = Listings.objects.filter(image="").exclude(photo_url="")
+        with ThreadPoolExecutor(max_workers=8) as downloads:
+            for batch in _batches(pending, batch_size):
+                results = downloads.map(partial(_fetch, timeout=timeout), [listing.photo_url for listing in batch])
+                fetched = []
+                for listing, (image, error) in zip(batch, results):
+                    if error:
+                        counts["failed"] += 1
+                        log(f"listing {listing.pk}: {error}")
+                        continue
+                    listing.image, listing.updated_at = image, timezone.now()
+                    fetched.append(listing)
+                Listings.objects.bulk_update(fetched, ["image", "updated_at"])
+                for listing in fetched:
+                    invalidate_listing(listing.pk)
+                counts["downloaded"] += len(fetched)
+                log(f"{counts['downloaded']} images downloaded")
+
+    if not thumbnails_enabled():
+        log("Pillow is not installed, so no thumbnails were made")
+        return counts
+    pool = ProcessPoolExecutor(max_workers=workers or get_thumbnail_workers() or 1)
+    try:
+        for batch in _batches(Listings.objects.exclude(image="").filter(thumbnails={}), batch_size):
+            images = []
+            for listing in batch:
+                with default_storage.open(listing.image.name) as f:
+                    images.append(f.read())
+            futures = [pool.submit(render_thumbnails, data, get_thumbnail_widths()) for data in images]
+            done = []
+            for listing, future in zip(batch, futures):
+                try:
+                    listing.thumbnails = store_thumbnails(future.result())
+                except Exception as error:
+                    #e.g. a file that looked like an image but isn't one; it keeps its original
+                    counts["failed"] += 1
+                    log(f"listing {listing.pk}: {error!r}")
+                    continue
+                listing.updated_at = timezone.now()
+                done.append(listing)
+            Listings.objects.bulk_update(done, ["thumbnails", "updated_at"])
+            for listing in done:
+                invalidate_listing(listing.pk)
+            counts["thumbnailed"] += len(done)
+            log(f"{counts['thumbnailed']} listings thumbnailed")
+    finally:
+        pool.shutdown()
+    return counts
+
+
+def _fetch(url, timeout):
+    #(stored name, None) or (None, the reason it failed), so one bad host doesn't stop the batch
+    try:
+        return ingest(download(url, timeout)), None
+    except ImageRejected as rejection:
+        return None, rejection.message
+    except OSError as error:
+        return None, str(error)
+
+
+def _batches(queryset, batch_size):
+    #keyset batches by id, so listings updated along the way (and dropping out of the filter) are never
+    #skipped the way they would be with offsets
+    last = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last).only("id", "photo_url", "image", "thumbnails").order_by("pk")[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1].pk
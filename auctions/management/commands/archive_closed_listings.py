@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from auctions.archive import archive_closed_listings, get_archive_after_days
+
+
+class Command(BaseCommand):
+    help = (
+        "Move listings closed more than --days ago, with their bids and comments, into the archive tables. "
+        "Safe to rerun or run from cron: each batch is moved in its own transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, help="Default: AUCTIONS_ARCHIVE_AFTER_DAYS.")
+        parser.add_argument("--batch-size", type=int, default=200)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        days = get_archive_after_days() if options["days"] is None else options["days"]
+        counts = archive_closed_listings(
+            days=days,
+            batch_size=options["batch_size"],
+            log=lambda message: self.stdout.write(f"  {message}") if options["verbosity"] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {counts['listings']} listings closed over {days} days ago, with {counts['bids']} bids "
+            f"and {counts['comments']} comments, in {time.perf_counter() - start:.2f}s."
+        ))
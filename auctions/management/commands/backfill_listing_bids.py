@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from auctions.models import Bids, Comment, Listings
+
+
+class Command(BaseCommand):
+    help = "Recompute each listing's current_price, top_bid and bid_count from the Bids table, and comment_count from Comment."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        #the most recent bid for each listing, fetched as a correlated subquery so the whole table is
+        #read in one statement instead of one query per listing
+        latest_bid = Bids.objects.filter(listing=OuterRef("pk")).order_by("-timestamp", "-id")
+        comment_count = (
+            Comment.objects.filter(listing=OuterRef("pk")).order_by().values("listing").annotate(n=Count("pk")).values("n")
+        )
+        listings = (
+            Listings.objects
+            .annotate(
+                latest_bid_id=Subquery(latest_bid.values("id")[:1]),
+                latest_bid_amount=Subquery(latest_bid.values("bid_amount")[:1]),
+                counted_bids=Count("bids"),
+                #a correlated count rather than a second join, which would multiply bids by comments
+                counted_comments=Coalesce(Subquery(comment_count), 0),
+            )
+            .only("id")
+            .order_by("id")
+        )
+
+        updated = 0
+        batch = []
+        for listing in listings.iterator(chunk_size=batch_size):
+            listing.top_bid_id = listing.latest_bid_id
+            listing.current_price = listing.latest_bid_amount
+            listing.bid_count = listing.counted_bids
+            listing.comment_count = listing.counted_comments
+            #bulk_update doesn't touch auto_now fields, and the pages' ETags depend on this one
+            listing.updated_at = timezone.now()
+            batch.append(listing)
+            if len(batch) >= batch_size:
+                updated += self._flush(batch)
+                batch = []
+        if batch:
+            updated += self._flush(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled bid state for {updated} listing(s)."))
+
+    def _flush(self, batch):
+        with transaction.atomic():
+            Listings.objects.bulk_update(batch, ["top_bid", "current_price", "bid_count", "comment_count", "updated_at"])
+        return len(batch)
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from auctions.images import backfill_images, thumbnails_enabled
+
+
+class Command(BaseCommand):
+    help = (
+        "Download the hot-linked photo_url of listings without a local image, then make thumbnails for "
+        "every listing image without them. Safe to rerun: only listings still missing something are touched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--workers", type=int, help="Thumbnail processes. Default: AUCTIONS_THUMBNAIL_WORKERS.")
+        parser.add_argument("--no-download", action="store_true", help="Only make thumbnails for stored images.")
+        parser.add_argument("--timeout", type=float, default=10.0, help="Seconds to wait for each download.")
+
+    def handle(self, *args, **options):
+        if not thumbnails_enabled():
+            self.stderr.write("Pillow is not installed: images will be stored but no thumbnails made.")
+        counts = backfill_images(
+            batch_size=options["batch_size"],
+            workers=options["workers"],
+            fetch=not options["no_download"],
+            timeout=options["timeout"],
+            log=lambda message: self.stdout.write(f"  {message}") if options["verbosity"] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Downloaded {counts['downloaded']} images and thumbnailed {counts['thumbnailed']} listings "
+            f"({counts['failed']} failed)."
+        ))
@@ -0,0 +1,67 @@
+import json
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+from auctions.benchmarks import SCENARIOS, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = "Time the main auction workloads on freshly seeded databases of each size and write the results as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="1000,10000,100000", help="Comma-separated listing counts.")
+        parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="Only run these scenarios.")
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--output", default="bench_results.json")
+        parser.add_argument("--compare", help="A previous results file to print the change against.")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options["sizes"].split(",")]
+        except ValueError:
+            raise CommandError("--sizes must be a comma-separated list of integers.")
+
+        results = run_benchmarks(
+            sizes, names=options["scenario"], repeat=options["repeat"], users=options["users"], log=self.stdout.write,
+        )
+        report = {"meta": self.meta(options), "results": results}
+        with open(options["output"], "w") as output:
+            json.dump(report, output, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(results)} results to {options['output']}."))
+
+        if options["compare"]:
+            self.compare(options["compare"], results)
+
+    def meta(self, options):
+        try:
+            commit = subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            "commit": commit,
+            "created": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "repeat": options["repeat"],
+            "users": options["users"],
+        }
+
+    def compare(self, path, results):
+        with open(path) as previous_file:
+            previous = {(r["size"], r["scenario"]): r for r in json.load(previous_file)["results"]}
+        for result in results:
+            before = previous.get((result["size"], result["scenario"]))
+            if before is None:
+                continue
+            change = (result["median_ms"] - before["median_ms"]) / before["median_ms"] * 100 if before["median_ms"] else 0
+            self.stdout.write(
+                f"{result['size']:>8} {result['scenario']:<16} {before['median_ms']:>9.2f}ms -> "
+                f"{result['median_ms']:>9.2f}ms ({change:+.1f}%)  queries {before['queries']} -> {result['queries']}"
+            )
@@ -0,0 +1,151 @@
+import json
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import URLPattern, reverse
+
+from auctions import urls as auction_urls
+from auctions.benchmarks import scratch_databases
+from auctions.helpers import record_bid
+from auctions.models import Bids, Category, Comment, Listings, User
+
+#the most SQL statements each view may run for the fixed scenario below. Lower these when a view gets
+#cheaper; raising one should come with a reason in the commit that does it
+QUERY_BUDGETS = {
+    "index": 5,
+    "categories": 4,
+    "listings_by_category": 5,
+    "closed_listings": 4,
+    "create_listing": 8,
+    "listings_page": 3,
+    "individual_listing": 6,
+    "listing_comments": 3,
+    "listing_events": 0,
+    "listing_poll": 1,
+    "add_bid": 11,
+    "add_proxy_bid": 7,
+    "add_comment": 5,
+    "add_to_watchlist": 4,
+    "close_auction": 9,
+    "remove_from_watchlist": 6,
+    "login": 7,
+    "logout": 4,
+    "register": 8,
+    "search": 6,
+    "watchlist": 3,
+}
+
+#how each view is exercised; anything not listed is a GET
+REQUESTS = {
+    "search": ("get", lambda s: {"q": "listing", "min_price": "5"}),
+    "create_listing": ("post", lambda s: {
+        "title": "New item", "category": s["category"].name, "description": "Details",
+        "starting_bid": "5.00", "photo_url": "",
+    }),
+    "add_bid": ("post", lambda s: {"bid_amount": "1000.00"}),
+    "add_proxy_bid": ("post", lambda s: {"max_amount": "2000.00"}),
+    "add_comment": ("post", lambda s: {"comment": "Is this still available?"}),
+    "add_to_watchlist": ("post", lambda s: {}),
+    "remove_from_watchlist": ("post", lambda s: {}),
+    "close_auction": ("post", lambda s: {}),
+    "login": ("post", lambda s: {"username": "buyer", "password": "password"}),
+    "register": ("post", lambda s: {
+        "username": "newcomer", "email": "newcomer@example.com", "password": "password", "confirmation": "password",
+    }),
+}
+
+#views that need to start from a logged-out session
+ANONYMOUS = {"login", "register"}
+
+
+def build_scenario(listings=20):
+    category = Category.objects.create(name="Books")
+    seller = User.objects.create_user("seller", "seller@example.com", "password")
+    buyer = User.objects.create_user("buyer", "buyer@example.com", "password")
+    created = []
+    for i in range(listings):
+        listing = Listings.objects.create(
+            title=f"Listing {i}", category=category, item_detail="Details",
+            starting_bid=Decimal("10.00"), listed_by=seller, active_status=i % 4 != 0,
+        )
+        for amount, bidder in ((Decimal("11.00"), buyer), (Decimal("12.00"), seller)):
+            record_bid(listing, Bids.objects.create(listing=listing, bid_amount=amount, bidder=bidder))
+        Comment.objects.create(listing=listing, user=buyer, text="Nice")
+        created.append(listing)
+    active = [listing for listing in created if listing.active_status]
+    buyer.watchlist.add(*active[:5])
+    #the buyer closes an auction of their own, so close_auction has something to act on
+    own = Listings.objects.create(
+        title="Buyer's item", category=category, item_detail="Details",
+        starting_bid=Decimal("1.00"), listed_by=buyer,
+    )
+    return {"category": category, "user": buyer, "listing": active[0], "own_listing": own}
+
+
+def url_for(pattern, scenario):
+    kwargs = {}
+    if "listing_id" in pattern.pattern.converters:
+        listing = scenario["own_listing"] if pattern.name == "close_auction" else scenario["listing"]
+        kwargs["listing_id"] = listing.id
+    if "category_id" in pattern.pattern.converters:
+        kwargs["category_id"] = scenario["category"].id
+    return reverse(pattern.name, kwargs=kwargs)
+
+
+class Command(BaseCommand):
+    help = "Replay a fixed scenario against every auctions URL and fail if a view exceeds its query budget."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--report", help="Write the per-view results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        with scratch_databases():
+            results = self.replay()
+
+        if options["report"]:
+            with open(options["report"], "w") as report:
+                json.dump(results, report, indent=2)
+
+        failures = []
+        for name, result in results.items():
+            budget = QUERY_BUDGETS.get(name)
+            status = "ok"
+            if budget is None:
+                status = "no budget"
+                failures.append(f"{name}: no query budget set ({result['queries']} queries)")
+            elif result["queries"] > budget:
+                status = "OVER BUDGET"
+                failures.append(f"{name}: {result['queries']} queries, budget is {budget}")
+            if result["status"] >= 500:
+                status = "ERROR"
+                failures.append(f"{name}: responded with {result['status']}")
+            if result["duplicates"]:
+                status = "N+1"
+                failures.append(f"{name}: repeated statements {result['duplicates']}")
+            self.stdout.write(f"{name:<24} {result['queries']:>4} / {budget}  {result['db_ms']:>8.2f}ms db  {status}")
+
+        if failures:
+            raise CommandError("Query budget check failed:\n" + "\n".join(failures))
+        self.stdout.write(self.style.SUCCESS("All views are within their query budgets."))
+
+    def replay(self):
+        scenario = build_scenario()
+        results = {}
+        for pattern in auction_urls.urlpatterns:
+            if not isinstance(pattern, URLPattern):
+                continue
+            client = Client()
+            if pattern.name not in ANONYMOUS:
+                client.force_login(scenario["user"])
+            method, data = REQUESTS.get(pattern.name, ("get", lambda s: {}))
+            response = getattr(client, method)(url_for(pattern, scenario), data(scenario))
+            profile = response.query_profile
+            results[pattern.name] = {
+                "status": response.status_code,
+                "queries": profile.query_count,
+                "db_ms": round(profile.db_time * 1000, 2),
+                "template_ms": round(profile.template_time * 1000, 2),
+                "duplicates": profile.duplicates(),
+            }
+        return results
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from auctions.closing import close_expired_auctions
+
+
+class Command(BaseCommand):
+    help = "Close every auction whose end time has passed. Safe to run from cron or in several processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--loop", action="store_true", help="Keep sweeping instead of exiting after one pass.")
+        parser.add_argument("--interval", type=float, default=5.0, help="Seconds between sweeps with --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.perf_counter()
+            closed = close_expired_auctions(batch_size=options["batch_size"])
+            if closed or not options["loop"]:
+                self.stdout.write(f"Closed {closed} auctions in {time.perf_counter() - start:.2f}s.")
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
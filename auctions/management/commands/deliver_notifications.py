@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from auctions.notifications import deliver_notifications
+
+
+class Command(BaseCommand):
+    help = "Send queued outbid and auction-won notifications. Safe to run from cron or in several processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--loop", action="store_true", help="Keep delivering instead of exiting after one pass.")
+        parser.add_argument("--interval", type=float, default=2.0, help="Seconds between passes with --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.perf_counter()
+            counts = deliver_notifications(batch_size=options["batch_size"])
+            if any(counts.values()) or not options["loop"]:
+                self.stdout.write(
+                    f"Sent {counts['sent']} notifications for {counts['events']} events, "
+                    f"{counts['retried']} events to retry, {counts['failed']} given up on "
+                    f"in {time.perf_counter() - start:.2f}s."
+                )
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
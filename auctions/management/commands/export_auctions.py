@@ -0,0 +1,34 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from auctions.transfer import EXPORTS, write_csv, write_jsonl
+
+
+class Command(BaseCommand):
+    help = "Stream categories, users, listings, bids and comments to JSONL (all types) or CSV (one type)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", "-o", default="-", help="File to write to; - for standard output.")
+        parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+        parser.add_argument("--type", dest="kinds", action="append", choices=list(EXPORTS),
+                            help="Record type to export; repeat for several. CSV takes exactly one. Default: all.")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        kinds = options["kinds"] or list(EXPORTS)
+        if options["format"] == "csv" and len(kinds) != 1:
+            raise CommandError("A CSV export holds a single record type; pass exactly one --type.")
+        #keep EXPORTS' order whatever order the types were given in, so a file always imports cleanly
+        kinds = [kind for kind in EXPORTS if kind in kinds]
+
+        stream = sys.stdout if options["output"] == "-" else open(options["output"], "w", newline="")
+        try:
+            if options["format"] == "csv":
+                written = write_csv(stream, kinds[0], options["chunk_size"])
+            else:
+                written = write_jsonl(stream, kinds, options["chunk_size"])
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+        self.stderr.write(f"Exported {written} records.")
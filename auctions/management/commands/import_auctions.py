@@ -0,0 +1,42 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from auctions.transfer import EXPORTS, ImportConflict, import_records, read_csv, read_jsonl
+
+
+class Command(BaseCommand):
+    help = "Load a file written by export_auctions, in batches, resuming from a checkpoint if interrupted."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to read; - for standard input.")
+        parser.add_argument("--format", choices=["jsonl", "csv"], help="Default: from the file extension.")
+        parser.add_argument("--type", dest="kind", choices=list(EXPORTS), help="Record type of a CSV file.")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--checkpoint", help="Checkpoint file. Default: <path>.checkpoint; none for stdin.")
+        parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or ("csv" if path.endswith(".csv") else "jsonl")
+        if file_format == "csv" and not options["kind"]:
+            raise CommandError("A CSV file holds a single record type; say which with --type.")
+        checkpoint = options["checkpoint"] or (None if path == "-" else f"{path}.checkpoint")
+        if options["restart"] and checkpoint:
+            open(checkpoint, "w").close()
+
+        stream = sys.stdin if path == "-" else open(path, newline="")
+        try:
+            records = read_csv(stream, options["kind"]) if file_format == "csv" else read_jsonl(stream)
+            imported = import_records(
+                records,
+                batch_size=options["batch_size"],
+                checkpoint=checkpoint,
+                log=lambda message: self.stdout.write(f"  {message}") if options["verbosity"] > 1 else None,
+            )
+        except ImportConflict as error:
+            raise CommandError(error.message)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        self.stdout.write(self.style.SUCCESS(f"Imported {imported} records."))
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from auctions.stats import numpy, rebuild_category_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute every category's market stats from the listings and bids, correcting any drift in the "
+        "incrementally kept counts and refreshing the medians. Run it periodically, e.g. hourly from cron."
+    )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        rebuilt = rebuild_category_stats()
+        medians = "NumPy" if numpy is not None else "the statistics module"
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt stats for {rebuilt} categories in {time.perf_counter() - start:.2f}s (medians by {medians})."
+        ))
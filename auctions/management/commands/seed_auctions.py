@@ -0,0 +1,30 @@
+import random
+
+from django.core.management.base import BaseCommand
+
+from auctions.seeding import seed
+
+
+class Command(BaseCommand):
+    help = "Bulk-create synthetic users, listings, bids, comments and watchlists for load testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--listings", type=int, default=1000)
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--seed", type=int, default=0, help="Random seed, so runs are repeatable.")
+        parser.add_argument("--no-comments", action="store_true")
+        parser.add_argument("--no-watchlists", action="store_true")
+
+    def handle(self, *args, **options):
+        totals = seed(
+            users=options["users"],
+            listings=options["listings"],
+            comments=not options["no_comments"],
+            watchlists=not options["no_watchlists"],
+            batch_size=options["batch_size"],
+            rng=random.Random(options["seed"]),
+            log=lambda message: self.stdout.write(f"  {message}") if options["verbosity"] > 1 else None,
+        )
+        summary = ", ".join(f"{count} {name}" for name, count in totals.items())
+        self.stdout.write(self.style.SUCCESS(f"Seeded {summary}."))
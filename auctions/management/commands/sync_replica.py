@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from auctions.replicas import sync_replica
+
+
+class Command(BaseCommand):
+    help = "Copy the primary database into the read replica's file (the local stand-in for replication)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=None, help="The replica's alias (default: AUCTIONS_READ_REPLICA, or replica).")
+        parser.add_argument("--loop", action="store_true", help="Keep copying instead of exiting after one pass.")
+        parser.add_argument("--interval", type=float, default=5.0, help="Seconds between copies with --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.perf_counter()
+            try:
+                copied = sync_replica(options["database"])
+            except ValueError as error:
+                raise CommandError(str(error))
+            if not copied:
+                raise CommandError("The replica is the primary's own file; set AUCTIONS_DB_REPLICA_PATH to copy to.")
+            if not options["loop"]:
+                self.stdout.write(f"Replica synced in {time.perf_counter() - start:.2f}s.")
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,219 @@
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.base import Template
+from django.urls import Resolver404, resolve
+
+from .replicas import get_read_replica, replica_reads
+
+logger = logging.getLogger("auctions.profiler")
+
+#set after a write request; while the browser holds it, that user's reads stay on the primary
+PRIMARY_COOKIE = "auctions_primary"
+
+#the same statement shape running this many times in one request is reported as a likely N+1
+N_PLUS_ONE_THRESHOLD = 3
+
+#the profile of the request being handled. A context variable rather than a thread-local: under ASGI many
+#requests share the event loop's thread, and each worker thread a request's sync code runs in sees a copy
+_profile = ContextVar("auctions_request_profile", default=None)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\bIN \((?:\s*\?\s*,?)+\)", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+def fingerprint(sql):
+    #reduce a statement to its shape: literals become ?, IN lists collapse, whitespace is normalised,
+    #so "WHERE id = 3" and "WHERE id = 4" count as the same query
+    sql = _LITERALS.sub("?", sql.replace("%s", "?"))
+    sql = _IN_LISTS.sub("IN (...)", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+class RequestProfile:
+    #collects what one request did: every SQL statement and its time, plus time spent rendering templates
+
+    def __init__(self):
+        self.queries = []
+        self.template_time = 0.0
+        self._template_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        #installed with connection.execute_wrapper(), so it sees every statement on every alias. Requests
+        #handled at the same time may share a thread, and so a connection (e.g. under the test client);
+        #each profile only counts the statements of its own request
+        if _profile.get() is not self:
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((fingerprint(sql), time.perf_counter() - start))
+
+    @property
+    def query_count(self):
+        return len(self.queries)
+
+    @property
+    def db_time(self):
+        return sum(duration for _, duration in self.queries)
+
+    def duplicates(self):
+        counts = Counter(sql for sql, _ in self.queries)
+        return {sql: count for sql, count in counts.items() if count >= N_PLUS_ONE_THRESHOLD}
+
+    def as_dict(self, request, response, total_time):
+        match = request.resolver_match
+        return {
+            "view": match.view_name if match else None,
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "queries": self.query_count,
+            "db_ms": round(self.db_time * 1000, 2),
+            "template_ms": round(self.template_time * 1000, 2),
+            "total_ms": round(total_time * 1000, 2),
+            "duplicates": self.duplicates(),
+        }
+
+
+def _instrument_templates():
+    #wrap Template.render once per process to time the outermost render of each profiled request;
+    #included and extended templates render inside it and aren't counted twice
+    if getattr(Template.render, "_auctions_profiled", False):
+        return
+    original_render = Template.render
+
+    def render(self, context):
+        profile = _profile.get()
+        if profile is None or profile._template_depth:
+            return original_render(self, context)
+        profile._template_depth += 1
+        start = time.perf_counter()
+        try:
+            return original_render(self, context)
+        finally:
+            profile._template_depth -= 1
+            profile.template_time += time.perf_counter() - start
+
+    render._auctions_profiled = True
+    Template.render = render
+
+
+class QueryProfilerMiddleware:
+    #records each request's query count, duplicated statements (N+1 suspects), database time and
+    #template render time; sends them back as a Server-Timing header and logs them as JSON.
+    #Turn off with AUCTIONS_QUERY_PROFILER = False. Runs either way round, so under ASGI the async
+    #views stay on the event loop instead of the whole stack being run one request at a time in a thread
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, "AUCTIONS_QUERY_PROFILER", True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        _instrument_templates()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile = RequestProfile()
+        token = _profile.set(profile)
+        start = time.perf_counter()
+        try:
+            with self.wrap_connections(profile):
+                response = self.get_response(request)
+        finally:
+            _profile.reset(token)
+        return self.report(request, response, profile, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        profile = RequestProfile()
+        token = _profile.set(profile)
+        start = time.perf_counter()
+        #database connections belong to the thread the request's ORM calls are sent to (sync_to_async's
+        #thread-sensitive one), not to the event loop's, so the wrappers are put on and taken off there
+        wrappers = await sync_to_async(self.wrap_connections)(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(wrappers.close)()
+            _profile.reset(token)
+        return self.report(request, response, profile, time.perf_counter() - start)
+
+    def wrap_connections(self, profile):
+        stack = ExitStack()
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(profile))
+        return stack
+
+    def report(self, request, response, profile, total_time):
+        #streamed responses run their row queries after this point, so only the page setup is counted
+        response["Server-Timing"] = ", ".join([
+            f'db;dur={profile.db_time * 1000:.2f};desc="{profile.query_count} queries"',
+            f"tpl;dur={profile.template_time * 1000:.2f}",
+            f"total;dur={total_time * 1000:.2f}",
+        ])
+        response.query_profile = profile
+
+        record = profile.as_dict(request, response, total_time)
+        if record["duplicates"]:
+            logger.warning(json.dumps(record))
+        else:
+            logger.info(json.dumps(record))
+        return response
+
+
+class ReadReplicaMiddleware:
+    #sends the reads of GET requests to the browsing views (AUCTIONS_REPLICA_VIEWS) to the read replica,
+    #if there is one (AUCTIONS_READ_REPLICA). Every write request leaves a cookie that keeps the user on
+    #the primary for AUCTIONS_REPLICA_STICKY_SECONDS, long enough for the replica to catch up, so nobody
+    #is shown a page without the bid or comment they just made. Sync and async capable, like the profiler
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with replica_reads(self.reads_from_replica(request)):
+            #a streamed page reads its rows after this returns, from the primary
+            response = self.get_response(request)
+        return self.pin_to_primary(request, response)
+
+    async def __acall__(self, request):
+        #the context variable set here is copied into the worker threads the view's queries run in
+        with replica_reads(self.reads_from_replica(request)):
+            response = await self.get_response(request)
+        return self.pin_to_primary(request, response)
+
+    def pin_to_primary(self, request, response):
+        if request.method not in ("GET", "HEAD", "OPTIONS") and get_read_replica():
+            max_age = getattr(settings, "AUCTIONS_REPLICA_STICKY_SECONDS", 10)
+            response.set_cookie(PRIMARY_COOKIE, "1", max_age=max_age, httponly=True, samesite="Lax")
+        return response
+
+    def reads_from_replica(self, request):
+        if not get_read_replica() or request.method not in ("GET", "HEAD") or PRIMARY_COOKIE in request.COOKIES:
+            return False
+        try:
+            view_name = resolve(request.path_info).url_name
+        except Resolver404:
+            return False
+        return view_name in getattr(settings, "AUCTIONS_REPLICA_VIEWS", ())
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:26
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def dedupe_category_names(apps, schema_editor):
+    #before the name becomes unique: keep the oldest category of each name, move the duplicates'
+    #listings onto it, then delete the duplicates
+    Category = apps.get_model('auctions', 'Category')
+    Listings = apps.get_model('auctions', 'Listings')
+    duplicated = Category.objects.values('name').annotate(count=Count('id'), keep=Min('id')).filter(count__gt=1)
+    for row in duplicated:
+        extras = Category.objects.filter(name=row['name']).exclude(id=row['keep'])
+        Listings.objects.filter(category__in=extras).update(category_id=row['keep'])
+        extras.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0006_listings_denormalized_bids'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_category_names, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='category',
+            name='name',
+            field=models.CharField(max_length=128, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='bids',
+            index=models.Index(fields=['listing', 'timestamp'], name='bid_listing_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['listing', 'created_at'], name='comment_listing_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listings',
+            index=models.Index(condition=models.Q(('active_status', True)), fields=['creation_time', 'id'], name='listing_active_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listings',
+            index=models.Index(condition=models.Q(('active_status', False)), fields=['creation_time', 'id'], name='listing_closed_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listings',
+            index=models.Index(fields=['category', 'creation_time', 'id'], name='listing_category_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listings',
+            index=models.Index(condition=models.Q(('active_status', False), ('winner__isnull', False)), fields=['winner', 'creation_time'], name='listing_won_idx'),
+        ),
+    ]
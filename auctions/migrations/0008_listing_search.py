@@ -0,0 +1,61 @@
+from django.db import migrations
+
+#an external-content FTS5 index over listing titles and descriptions: the text itself stays in
+#auctions_listings and the index only holds the tokens. Triggers keep it in step with every insert,
+#update and delete, including bulk_create and queryset.update(), which signals would miss
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE auctions_listings_fts USING fts5(
+        title, item_detail,
+        content='auctions_listings', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER auctions_listings_fts_insert AFTER INSERT ON auctions_listings BEGIN
+        INSERT INTO auctions_listings_fts(rowid, title, item_detail) VALUES (new.id, new.title, new.item_detail);
+    END
+    """,
+    """
+    CREATE TRIGGER auctions_listings_fts_delete AFTER DELETE ON auctions_listings BEGIN
+        INSERT INTO auctions_listings_fts(auctions_listings_fts, rowid, title, item_detail)
+        VALUES ('delete', old.id, old.title, old.item_detail);
+    END
+    """,
+    #only edits to the indexed text need reindexing, not every bid that updates the price
+    """
+    CREATE TRIGGER auctions_listings_fts_update AFTER UPDATE OF title, item_detail ON auctions_listings BEGIN
+        INSERT INTO auctions_listings_fts(auctions_listings_fts, rowid, title, item_detail)
+        VALUES ('delete', old.id, old.title, old.item_detail);
+        INSERT INTO auctions_listings_fts(rowid, title, item_detail) VALUES (new.id, new.title, new.item_detail);
+    END
+    """,
+    "INSERT INTO auctions_listings_fts(auctions_listings_fts) VALUES ('rebuild')",
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS auctions_listings_fts_insert",
+    "DROP TRIGGER IF EXISTS auctions_listings_fts_delete",
+    "DROP TRIGGER IF EXISTS auctions_listings_fts_update",
+    "DROP TABLE IF EXISTS auctions_listings_fts",
+]
+
+
+def run_on_sqlite(statements):
+    #FTS5 is SQLite only; on other databases search falls back to icontains (see auctions/search.py)
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'sqlite':
+            for sql in statements:
+                schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0007_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_on_sqlite(CREATE_SQL), run_on_sqlite(DROP_SQL)),
+    ]
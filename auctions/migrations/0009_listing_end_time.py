@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0008_listing_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listings',
+            name='closed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='listings',
+            name='end_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='listings',
+            index=models.Index(condition=models.Q(('active_status', True), ('end_time__isnull', False)), fields=['end_time'], name='listing_due_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def start_from_creation_time(apps, schema_editor):
+    #existing listings last changed no later than now; their creation time is the best guess we have
+    Listings = apps.get_model('auctions', 'Listings')
+    Listings.objects.update(updated_at=F('creation_time'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0010_proxy_bids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listings',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(start_from_creation_time, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='listings',
+            index=models.Index(fields=['updated_at'], name='listing_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_comments(apps, schema_editor):
+    #one UPDATE with a correlated count per listing
+    Listings = apps.get_model('auctions', 'Listings')
+    Comment = apps.get_model('auctions', 'Comment')
+    counts = Comment.objects.filter(listing=OuterRef('pk')).order_by().values('listing').annotate(n=Count('pk')).values('n')
+    Listings.objects.update(comment_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0011_listings_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listings',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_comments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:26
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Count, F, Q, Sum
+
+
+def create_stats(apps, schema_editor):
+    #a stats row per category with its listing counts. The medians and bid velocity are left to the first
+    #manage.py rebuild_category_stats
+    Category = apps.get_model('auctions', 'Category')
+    CategoryStats = apps.get_model('auctions', 'CategoryStats')
+    Listings = apps.get_model('auctions', 'Listings')
+    now = django.utils.timezone.now()
+    #sold to someone other than the seller, whose own starting bid can be a closed listing's top bid
+    sold = Q(active_status=False, winner__isnull=False) & ~Q(winner=F('listed_by'))
+    counts = {
+        row['category']: row
+        for row in Listings.objects.order_by().values('category').annotate(
+            active=Count('pk', filter=Q(active_status=True)),
+            closed=Count('pk', filter=Q(active_status=False)),
+            sold=Count('pk', filter=sold),
+            value=Sum('current_price', filter=sold),
+        )
+    }
+    empty = {'active': 0, 'closed': 0, 'sold': 0, 'value': None}
+    CategoryStats.objects.bulk_create([
+        CategoryStats(
+            category_id=pk,
+            active_count=counts.get(pk, empty)['active'],
+            closed_count=counts.get(pk, empty)['closed'],
+            sold_count=counts.get(pk, empty)['sold'],
+            sold_value=counts.get(pk, empty)['value'] or 0,
+            window_started_at=now,
+            updated_at=now,
+        )
+        for pk in Category.objects.values_list('pk', flat=True)
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0013_outbox_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryStats',
+            fields=[
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='auctions.category')),
+                ('active_count', models.PositiveIntegerField(default=0)),
+                ('closed_count', models.PositiveIntegerField(default=0)),
+                ('sold_count', models.PositiveIntegerField(default=0)),
+                ('sold_value', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('median_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('window_bids', models.PositiveIntegerField(default=0)),
+                ('window_started_at', models.DateTimeField()),
+                ('rebuilt_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.RunPython(create_stats, migrations.RunPython.noop),
+    ]
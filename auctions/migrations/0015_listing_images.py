@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0014_category_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listings',
+            name='image',
+            field=models.FileField(blank=True, default='', max_length=200, upload_to='listings/'),
+        ),
+        migrations.AddField(
+            model_name='listings',
+            name='thumbnails',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -1,6 +1,11 @@
+from decimal import Decimal
+
 from django.contrib.auth.models import AbstractUser, User
 from django.db import models
+from django.db.models import Exists, OuterRef, Value
+from django.db.models.functions import Coalesce
 from django.conf import settings
+from django.utils import timezone
 
 class Bids(models.Model):
     listing = models.ForeignKey("Listings", on_delete=models.CASCADE, related_name="bids")
@@ -8,9 +13,14 @@ class Bids(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     bidder = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="bids")
 
+    class Meta:
+        indexes = [
+            #a listing's bid history, newest first
+            models.Index(fields=["listing", "timestamp"], name="bid_listing_time_idx"),
+        ]
     
 class Category(models.Model):
-    name = models.CharField(max_length=128)
+    name = models.CharField(max_length=128, unique=True)
 
     def __str__(self):
         return self.name
@@ -22,8 +32,42 @@ class Comment(models.Model):
     text = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            #a listing's comment thread in posting order
+            models.Index(fields=["listing", "created_at"], name="comment_listing_time_idx"),
+        ]
+
     def __str__(self):
-        return f"Comment by {self.user.username} on {self.listing.title}"
+        #the listing's id rather than its title, so listing comments (e.g. in the admin) doesn't fetch a
+        #listing per comment; the user should be fetched with select_related("user")
+        return f"Comment by {self.user.username} on listing {self.listing_id}"
+
+
+class ListingsQuerySet(models.QuerySet):
+    #chainable building blocks for listing pages, so that a page of listings with prices, bidders and
+    #watchlist flags comes back from a single SQL statement
+
+    def with_current_bid(self):
+        #current_price is null until the first bid is recorded, in which case the starting bid applies
+        return self.annotate(current_bid=Coalesce("current_price", "starting_bid"))
+
+    def with_top_bidder(self):
+        return self.select_related("top_bid__bidder")
+
+    def with_watch_flag(self, user):
+        if user is None or not user.is_authenticated:
+            return self.annotate(is_watched=Value(False))
+        watched = Listings.watchlist.through.objects.filter(listings_id=OuterRef("pk"), user_id=user.pk)
+        return self.annotate(is_watched=Exists(watched))
+
+    def feed(self, user=None):
+        return (
+            self.select_related("category", "listed_by", "winner")
+            .with_current_bid()
+            .with_top_bidder()
+            .with_watch_flag(user)
+        )
 
 
 class Listings(models.Model):
@@ -32,22 +76,240 @@ class Listings(models.Model):
     item_detail = models.CharField(max_length=512) 
     starting_bid = models.DecimalField(max_digits=10, decimal_places=2)
     photo_url = models.URLField(max_length=200, default="")
+    #a local copy of the photo, uploaded or ingested from photo_url, and the thumbnails made from it as
+    #{width: name} (see images.py). photo_url is only hot-linked while there's no local copy
+    image = models.FileField(upload_to="listings/", max_length=200, blank=True, default="")
+    thumbnails = models.JSONField(default=dict, blank=True)
     listed_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="listings")
     creation_time = models.DateTimeField(auto_now_add=True)
     active_status = models.BooleanField(default=True)
     watchlist_status = models.BooleanField(default=False)
     winner = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name="won_listings")
+    #denormalized bid state, kept in step with the Bids table by helpers.record_bid so that listing
+    #pages can show the price and top bidder without querying Bids for every row
+    current_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    top_bid = models.ForeignKey("Bids", null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    bid_count = models.PositiveIntegerField(default=0)
+    #kept up to date by add_comment, so a listing page can show the size of its thread without counting it
+    comment_count = models.PositiveIntegerField(default=0)
+    #when bidding stops; listings without one stay open until their owner closes them. Expired listings
+    #are closed by the close_expired_auctions command, which stamps closed_at
+    end_time = models.DateTimeField(null=True, blank=True)
+    closed_at = models.DateTimeField(null=True, blank=True)
+    #bumped by every change that shows on a listing page (bids, comments, closing), including the bulk
+    #.update() calls that auto_now doesn't see; it drives the pages' ETag and Last-Modified headers
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ListingsQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            #the active and closed listing pages, keyset-paginated on (creation_time, id). These are partial
+            #indexes because a boolean filter is compiled to a bare WHERE "active_status" (or NOT ...),
+            #which SQLite can only match against an index with the same WHERE clause
+            models.Index(
+                fields=["creation_time", "id"], condition=models.Q(active_status=True), name="listing_active_created_idx",
+            ),
+            models.Index(
+                fields=["creation_time", "id"], condition=models.Q(active_status=False), name="listing_closed_created_idx",
+            ),
+            #category pages, keyset-paginated the same way
+            models.Index(fields=["category", "creation_time", "id"], name="listing_category_created_idx"),
+            #"auctions you won" only ever looks at closed listings that have a winner
+            models.Index(
+                fields=["winner", "creation_time"],
+                condition=models.Q(active_status=False, winner__isnull=False),
+                name="listing_won_idx",
+            ),
+            #MAX(updated_at) is the catalogue's version stamp, read off the end of this index
+            models.Index(fields=["updated_at"], name="listing_updated_idx"),
+            #the expiry sweep only ever scans open listings that have an end time, oldest deadline first
+            models.Index(
+                fields=["end_time"],
+                condition=models.Q(active_status=True, end_time__isnull=False),
+                name="listing_due_idx",
+            ),
+        ]
 
     def __str__(self):
-        most_recent_bid = self.bids.order_by('-timestamp').first()
-        if most_recent_bid:
-            return f"{self.title} in the {self.category} Category has a current bid price of {most_recent_bid.bid_amount}"
+        if self.current_price is not None:
+            return f"{self.title} in the {self.category} Category has a current bid price of {self.current_price}"
         else:
             return f"{self.title} in the {self.category} Category has no bids yet."
         
+class ProxyBid(models.Model):
+    #a standing "bid for me up to max_amount" on a listing. The bid engine places the smallest winning
+    #bid on the bidder's behalf whenever someone else bids, so they don't have to keep coming back
+    listing = models.ForeignKey("Listings", on_delete=models.CASCADE, related_name="proxy_bids")
+    bidder = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="proxy_bids")
+    max_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["listing", "bidder"], name="proxy_bid_unique_bidder"),
+        ]
+        indexes = [
+            #the two highest proxies on a listing (the earlier one wins a tie) are read straight off the
+            #front of this index, however many proxies the listing has
+            models.Index(fields=["listing", "-max_amount", "created_at"], name="proxy_bid_ranking_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.bidder} bids up to {self.max_amount} on {self.listing_id}"
+
+
+class CategoryStats(models.Model):
+    #a category's market figures, kept up to date by the bid engine, listing creation and closing (see
+    #stats.py) so category pages read them from one row instead of aggregating Bids and Listings. The
+    #median can't be maintained a row at a time; it, and any drift in the counters, is put right by
+    #manage.py rebuild_category_stats, meant to run periodically
+    category = models.OneToOneField("Category", on_delete=models.CASCADE, primary_key=True, related_name="stats")
+    active_count = models.PositiveIntegerField(default=0)
+    closed_count = models.PositiveIntegerField(default=0)
+    #closed with a winner, and the winning prices' total
+    sold_count = models.PositiveIntegerField(default=0)
+    sold_value = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    #the median winning price as of the last rebuild
+    median_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    #bids placed since window_started_at, for the bid velocity. A rebuild moves the window up to the last
+    #AUCTIONS_STATS_WINDOW_DAYS
+    window_bids = models.PositiveIntegerField(default=0)
+    window_started_at = models.DateTimeField()
+    rebuilt_at = models.DateTimeField(null=True, blank=True)
+    #set by every change, including the bulk updates that skip auto_now; the category pages' version stamp
+    updated_at = models.DateTimeField()
+
+    @property
+    def mean_price(self):
+        return (self.sold_value / self.sold_count).quantize(Decimal("0.01")) if self.sold_count else None
+
+    @property
+    def sell_through(self):
+        #the share of closed auctions that found a buyer, as a percentage
+        return round(100 * self.sold_count / self.closed_count) if self.closed_count else None
+
+    @property
+    def bid_velocity(self):
+        #bids per day over the window
+        days = (timezone.now() - self.window_started_at).total_seconds() / 86400
+        return round(self.window_bids / days, 1) if days > 0 else None
+
+    def __str__(self):
+        return f"Stats for category {self.category_id}"
+
+
+class OutboxEvent(models.Model):
+    #a notification waiting to go out, written in the same transaction as the bid or close that caused it
+    #so it is sent if and only if that commits. manage.py deliver_notifications sends them (see
+    #notifications.py), which keeps delivery - and any slowness or failure in it - off the bidding path
+    OUTBID = "outbid"
+    WON = "won"
+    KIND_CHOICES = [(OUTBID, "Outbid"), (WON, "Auction won")]
+
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUS_CHOICES = [(PENDING, "Pending"), (SENT, "Sent"), (FAILED, "Failed")]
+
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    recipient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="outbox_events")
+    listing = models.ForeignKey("Listings", on_delete=models.CASCADE, related_name="outbox_events")
+    #what the message needs that may have changed by the time it is sent, e.g. the amount that outbid them
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default=PENDING)
+    created_at = models.DateTimeField(auto_now_add=True)
+    #not sent before this time: pushed back after each failed attempt
+    available_at = models.DateTimeField()
+    #a worker that claimed the event has it until then; after that another worker may take it over
+    claimed_until = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            #the worker only ever scans pending events, oldest due first; sent ones drop out of the index
+            models.Index(fields=["available_at", "id"], condition=models.Q(status="pending"), name="outbox_due_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} for user {self.recipient_id} on listing {self.listing_id} ({self.status})"
+
+
+class ArchivedListing(models.Model):
+    #a listing that closed more than AUCTIONS_ARCHIVE_AFTER_DAYS ago, moved out of Listings by
+    #manage.py archive_closed_listings (see archive.py) with its bids and comments, so the tables every
+    #live page and bid reads stay the size of the open market. Only what a closed auction still shows is
+    #kept, under the listing's own id
+    id = models.IntegerField(primary_key=True)
+    title = models.CharField(max_length=128)
+    category = models.ForeignKey("Category", on_delete=models.CASCADE, related_name="archived_listings")
+    item_detail = models.CharField(max_length=512)
+    starting_bid = models.DecimalField(max_digits=10, decimal_places=2)
+    photo_url = models.URLField(max_length=200, default="")
+    image = models.FileField(upload_to="listings/", max_length=200, blank=True, default="")
+    thumbnails = models.JSONField(default=dict, blank=True)
+    listed_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="archived_listings")
+    winner = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name="archived_wins")
+    #the winning (last) bid, or None when nobody bid
+    current_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    bid_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    creation_time = models.DateTimeField()
+    closed_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField()
+
+    #archived listings are always closed and never watched, whatever page they're shown on
+    active_status = False
+    is_watched = False
+
+    class Meta:
+        indexes = [
+            #the closed listings page, newest first like the live ones
+            models.Index(fields=["creation_time", "id"], name="archived_created_idx"),
+            models.Index(fields=["winner", "creation_time"], condition=models.Q(winner__isnull=False), name="archived_won_idx"),
+        ]
+
+    @property
+    def current_bid(self):
+        return self.current_price if self.current_price is not None else self.starting_bid
+
+    def __str__(self):
+        return f"{self.title} (archived)"
+
+
+class ArchivedBid(models.Model):
+    id = models.IntegerField(primary_key=True)
+    listing = models.ForeignKey("ArchivedListing", on_delete=models.CASCADE, related_name="bids")
+    bid_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    timestamp = models.DateTimeField()
+    bidder = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="archived_bids")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["listing", "timestamp"], name="archived_bid_listing_time_idx"),
+        ]
+
+
+class ArchivedComment(models.Model):
+    id = models.IntegerField(primary_key=True)
+    listing = models.ForeignKey("ArchivedListing", on_delete=models.CASCADE, related_name="comments")
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="archived_comments")
+    text = models.TextField()
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["listing", "created_at"], name="archived_comment_time_idx"),
+        ]
+
+
 class User(AbstractUser):
     watchlist = models.ManyToManyField(Listings, related_name = "watchlist", blank=True)
 
     @property
     def watchlist_item_count(self):
-        return self.watchlist.count()
\ No newline at end of file
+        #cached per user and dropped by the m2m_changed handler in signals.py whenever the watchlist changes
+        from .cache import get_watchlist_count
+        return get_watchlist_count(self)
\ No newline at end of file
@@ -0,0 +1,199 @@
+import json
+import sys
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import OutboxEvent
+
+#what LocmemBackend has sent, in order, like django.core.mail.outbox. Tests clear it between runs
+outbox = []
+
+
+def record_outbid(listing_id, recipient_ids, amount, now=None):
+    #queue an "outbid" notification for each user who has just lost the top bid on the listing. Must be
+    #called inside the bid's transaction, so the notification exists exactly when the bid does
+    now = now or timezone.now()
+    events = [
+        OutboxEvent(
+            kind=OutboxEvent.OUTBID, recipient_id=recipient_id, listing_id=listing_id,
+            payload={"amount": str(amount)}, available_at=now,
+        )
+        for recipient_id in dict.fromkeys(recipient_ids) if recipient_id is not None
+    ]
+    if events:
+        OutboxEvent.objects.bulk_create(events)
+
+
+def record_won(closed, closed_at):
+    #queue an "auction won" notification for the winner of each listing in closed, a list of
+    #(listing_id, winner_id, price) rows. Called in the closing transaction
+    events = [
+        OutboxEvent(
+            kind=OutboxEvent.WON, recipient_id=winner_id, listing_id=listing_id,
+            payload={"amount": str(price)}, available_at=closed_at,
+        )
+        for listing_id, winner_id, price in closed if winner_id is not None
+    ]
+    if events:
+        OutboxEvent.objects.bulk_create(events)
+
+
+class Notification:
+    #what a backend sends: one message per user, listing and kind, however many events it stands for
+
+    def __init__(self, kind, recipient, listing, amount, count=1):
+        self.kind = kind
+        self.recipient = recipient
+        self.listing = listing
+        self.amount = amount
+        self.count = count
+
+    @property
+    def subject(self):
+        if self.kind == OutboxEvent.WON:
+            return f"You won {self.listing.title}"
+        return f"You've been outbid on {self.listing.title}"
+
+    @property
+    def body(self):
+        if self.kind == OutboxEvent.WON:
+            return f"Congratulations {self.recipient.username}, you won {self.listing.title} with a bid of ${self.amount}."
+        times = f" ({self.count} times since we last told you)" if self.count > 1 else ""
+        return f"Someone outbid you on {self.listing.title}{times}. The top bid is now ${self.amount}."
+
+    def as_dict(self):
+        return {
+            "kind": self.kind, "recipient": self.recipient.username, "listing": self.listing.pk,
+            "amount": self.amount, "count": self.count, "subject": self.subject, "body": self.body,
+        }
+
+
+class BaseBackend:
+    #subclasses deliver one notification, raising if it couldn't be sent so the worker retries it later
+
+    def send(self, notification):
+        raise NotImplementedError
+
+
+class ConsoleBackend(BaseBackend):
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def send(self, notification):
+        self.stream.write(f"To {notification.recipient.username}: {notification.subject}\n{notification.body}\n")
+        self.stream.flush()
+
+
+class FileBackend(BaseBackend):
+    #appends one JSON object per line to AUCTIONS_NOTIFICATION_FILE
+
+    def __init__(self, path=None):
+        self.path = path or getattr(settings, "AUCTIONS_NOTIFICATION_FILE", None)
+        if not self.path:
+            raise ValueError("FileBackend needs AUCTIONS_NOTIFICATION_FILE to be set.")
+
+    def send(self, notification):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(notification.as_dict()) + "\n")
+
+
+class LocmemBackend(BaseBackend):
+    def send(self, notification):
+        outbox.append(notification)
+
+
+class EmailBackend(BaseBackend):
+    #sends through Django's own (equally pluggable) EMAIL_BACKEND. Users without an address are skipped
+
+    def send(self, notification):
+        if notification.recipient.email:
+            send_mail(notification.subject, notification.body, None, [notification.recipient.email])
+
+
+def get_backend():
+    return import_string(getattr(settings, "AUCTIONS_NOTIFICATION_BACKEND", "auctions.notifications.ConsoleBackend"))()
+
+
+def retry_delay(attempts):
+    #exponential backoff: the base delay after the first failure, doubling after each one after that
+    base = getattr(settings, "AUCTIONS_NOTIFICATION_RETRY_DELAY", 30)
+    ceiling = getattr(settings, "AUCTIONS_NOTIFICATION_MAX_RETRY_DELAY", 3600)
+    return timedelta(seconds=min(ceiling, base * 2 ** max(attempts - 1, 0)))
+
+
+def claim_batch(batch_size=100, now=None):
+    #take up to batch_size due events for this worker for AUCTIONS_NOTIFICATION_LEASE seconds. A worker
+    #that dies mid-batch loses them when the lease runs out, and they're sent again: delivery is at least
+    #once. Where the database supports SKIP LOCKED, workers claim different batches without waiting on
+    #each other; elsewhere the claimed_until guard on the UPDATE stops two workers sharing an event
+    now = now or timezone.now()
+    lease_until = now + timedelta(seconds=getattr(settings, "AUCTIONS_NOTIFICATION_LEASE", 300))
+    unclaimed = Q(claimed_until__isnull=True) | Q(claimed_until__lte=now)
+    with transaction.atomic():
+        ids = list(
+            OutboxEvent.objects.filter(status=OutboxEvent.PENDING, available_at__lte=now)
+            .filter(unclaimed)
+            .order_by("available_at", "id")
+            .select_for_update(skip_locked=True)
+            .values_list("pk", flat=True)[:batch_size]
+        )
+        if not ids:
+            return []
+        OutboxEvent.objects.filter(unclaimed, pk__in=ids).update(claimed_until=lease_until, attempts=F("attempts") + 1)
+    return list(
+        OutboxEvent.objects.filter(pk__in=ids, claimed_until=lease_until)
+        .select_related("recipient", "listing")
+        .order_by("id")
+    )
+
+
+def coalesce(events):
+    #one notification per (kind, recipient, listing): someone outbid five times in a minute hears about
+    #it once, at the latest amount. Returns (notification, the events it stands for) pairs
+    groups = {}
+    for event in events:
+        groups.setdefault((event.kind, event.recipient_id, event.listing_id), []).append(event)
+    return [
+        (Notification(group[-1].kind, group[-1].recipient, group[-1].listing, group[-1].payload.get("amount"), len(group)), group)
+        for group in groups.values()
+    ]
+
+
+def deliver_notifications(batch_size=100, now=None, backend=None):
+    #send everything that is due, a batch at a time. A notification that fails is put back with a longer
+    #delay each time, and given up on after AUCTIONS_NOTIFICATION_MAX_ATTEMPTS. Returns counts of
+    #events and notifications sent, and of events retried or given up on
+    now = now or timezone.now()
+    backend = backend or get_backend()
+    max_attempts = getattr(settings, "AUCTIONS_NOTIFICATION_MAX_ATTEMPTS", 8)
+    counts = {"events": 0, "sent": 0, "retried": 0, "failed": 0}
+    while True:
+        events = claim_batch(batch_size, now)
+        if not events:
+            return counts
+        sent_ids = []
+        for notification, group in coalesce(events):
+            ids = [event.pk for event in group]
+            try:
+                backend.send(notification)
+            except Exception as exc:
+                attempts = max(event.attempts for event in group)
+                retry = OutboxEvent.objects.filter(pk__in=ids)
+                if attempts >= max_attempts:
+                    retry.update(status=OutboxEvent.FAILED, claimed_until=None, last_error=repr(exc))
+                    counts["failed"] += len(ids)
+                else:
+                    retry.update(available_at=now + retry_delay(attempts), claimed_until=None, last_error=repr(exc))
+                    counts["retried"] += len(ids)
+            else:
+                sent_ids += ids
+                counts["sent"] += 1
+        if sent_ids:
+            OutboxEvent.objects.filter(pk__in=sent_ids).update(status=OutboxEvent.SENT, sent_at=now, claimed_until=None)
+            counts["events"] += len(sent_ids)
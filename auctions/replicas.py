@@ -0,0 +1,64 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+#whether reads made in the current context may go to the read replica. Off unless something turns it on,
+#so management commands, the bid engine and anything else outside a browsing request read the primary
+_replica_reads = ContextVar("auctions_replica_reads", default=False)
+
+#always read from the primary: a session or login missing from a lagging replica would sign the user out
+PRIMARY_ONLY_APPS = {"sessions"}
+
+
+def get_read_replica():
+    #the database alias browsing reads go to, or None when there is no replica
+    return getattr(settings, "AUCTIONS_READ_REPLICA", None)
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def primary_reads():
+    return replica_reads(False)
+
+
+class PrimaryReplicaRouter:
+    #reads go to the replica inside replica_reads() (see ReadReplicaMiddleware), everything else to the
+    #primary. The replica is a copy of the primary, so rows from either may be related to each other
+
+    def db_for_read(self, model, **hints):
+        replica = get_read_replica()
+        if replica and _replica_reads.get() and model._meta.app_label not in PRIMARY_ONLY_APPS:
+            return replica
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        #explicitly the primary: left to Django, saving a row read from the replica would write it back there
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+def sync_replica(replica=None, primary=DEFAULT_DB_ALIAS):
+    #copy the primary into the replica file with SQLite's online backup API, which takes a consistent
+    #snapshot while the primary stays open for reads and writes. Stands in for real replication, which
+    #SQLite doesn't have. Returns False when there is nothing to copy (the replica is the primary's file)
+    replica = replica or get_read_replica() or "replica"
+    source, target = connections[primary], connections[replica]
+    if source.vendor != "sqlite" or target.vendor != "sqlite":
+        raise ValueError("sync_replica copies SQLite databases; use the database's own replication instead.")
+    if source.settings_dict["NAME"] == target.settings_dict["NAME"]:
+        return False
+    source.ensure_connection()
+    target.ensure_connection()
+    source.connection.backup(target.connection)
+    return True
@@ -0,0 +1,189 @@
+import base64
+import binascii
+import re
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import Q
+
+from .helpers import encode_cursor, get_page_size, keyset_order
+from .models import Listings
+
+#the FTS5 index created by migration 0008, on SQLite only
+FTS_TABLE = "auctions_listings_fts"
+
+#the triggers that keep the index in step with auctions_listings, as first created by migration 0008.
+#SQLite drops a table's triggers whenever a migration has to rebuild the table (e.g. to add a NOT NULL
+#column), so ensure_search_triggers re-creates any that are missing after every migrate
+SEARCH_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS auctions_listings_fts_insert AFTER INSERT ON auctions_listings BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, item_detail) VALUES (new.id, new.title, new.item_detail);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS auctions_listings_fts_delete AFTER DELETE ON auctions_listings BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, item_detail)
+        VALUES ('delete', old.id, old.title, old.item_detail);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS auctions_listings_fts_update AFTER UPDATE OF title, item_detail ON auctions_listings BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, item_detail)
+        VALUES ('delete', old.id, old.title, old.item_detail);
+        INSERT INTO {FTS_TABLE}(rowid, title, item_detail) VALUES (new.id, new.title, new.item_detail);
+    END
+    """,
+]
+
+#BM25 column weights: a word in the title counts ten times as much as one in the description
+RANK = f"bm25({FTS_TABLE}, 10.0, 1.0)"
+
+#more words than this in one search are ignored rather than turned into an ever longer MATCH
+MAX_TERMS = 8
+
+
+def fts_available():
+    return connection.vendor == "sqlite"
+
+
+def ensure_search_triggers(using="default"):
+    db = connections[using]
+    if db.vendor != "sqlite":
+        return
+    with db.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [FTS_TABLE])
+        if cursor.fetchone() is None:
+            #migration 0008 hasn't run yet
+            return
+        for sql in SEARCH_TRIGGERS:
+            cursor.execute(sql)
+
+
+def search_terms(text):
+    return re.findall(r"\w+", (text or "").lower())[:MAX_TERMS]
+
+
+def match_expression(terms):
+    #user input never reaches MATCH as-is: every word becomes a quoted prefix term, so quotes and FTS
+    #operators typed into the search box can't break the query, and "lam" already finds "lamp"
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def encode_search_cursor(rank, pk):
+    #repr() of a float round-trips exactly, so the next page starts right after this row
+    return base64.urlsafe_b64encode(f"{rank!r}|{pk}".encode()).decode()
+
+
+def decode_search_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        rank, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return float(rank), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def search_page(listings, text, category=None, min_price=None, max_price=None, active=True, cursor=None, page_size=None):
+    #one page of listings matching the search text, best match first. listings is the queryset the rows
+    #are loaded from (e.g. Listings.objects.feed(user)). Returns (page, next_cursor, window) - like
+    #keyset_page, plus the number of newest matches the ranking was limited to, or None if it saw them all
+    terms = search_terms(text)
+    if not terms:
+        return [], None, None
+    if not fts_available():
+        return (*icontains_page(listings, terms, category, min_price, max_price, active, cursor, page_size), None)
+
+    page_size = page_size or get_page_size()
+    table = Listings._meta.db_table
+    match = match_expression(terms)
+    #the filters, for the listings table under the given alias
+    filters, filter_params = [], []
+    if category is not None:
+        filters.append("{0}.category_id = %s")
+        filter_params.append(category.pk)
+    if active is not None:
+        filters.append("{0}.active_status = %s")
+        filter_params.append(active)
+    #the current price has no column affinity, so the bounds are compared as numbers, not as text
+    if min_price is not None:
+        filters.append("COALESCE({0}.current_price, {0}.starting_bid) >= %s")
+        filter_params.append(float(min_price))
+    if max_price is not None:
+        filters.append("COALESCE({0}.current_price, {0}.starting_bid) <= %s")
+        filter_params.append(float(max_price))
+    #BM25 has to score every matching row before the best can be picked, so a broad search ("lamp")
+    #would cost time in proportion to the catalogue. Up to AUCTIONS_SEARCH_CANDIDATES matches are all
+    #ranked; past that, only the newest that many are, and the caller is told so it can say so. FTS5
+    #walks its doclists newest first, so finding the window's oldest row is cheap at any size. The window
+    #is taken over the matches that pass the filters - looking each one up by its primary key - or a
+    #filtered search would come up empty behind enough newer matches the filters turn away
+    candidates = getattr(settings, "AUCTIONS_SEARCH_CANDIDATES", 1000)
+    window = " ".join(f"AND {clause.format('c')}" for clause in filters)
+    with connection.cursor() as db:
+        #the oldest match in the window, and the next older one if there is any
+        db.execute(
+            f"SELECT {FTS_TABLE}.rowid FROM {FTS_TABLE} JOIN {table} c ON c.id = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH %s {window} ORDER BY {FTS_TABLE}.rowid DESC LIMIT 2 OFFSET %s",
+            [match, *filter_params, candidates - 1],
+        )
+        edge = [row[0] for row in db.fetchall()]
+    where = [f"{FTS_TABLE} MATCH %s", *(clause.format("l") for clause in filters)]
+    params = [match, *filter_params]
+    truncated = len(edge) == 2
+    if truncated:
+        where.append(f"{FTS_TABLE}.rowid >= %s")
+        params.append(edge[0])
+    #keyset pagination on (rank, id). Ranks drift a little as listings come and go, so a later page can
+    #repeat or skip a borderline row - the same trade-off every relevance-ordered search makes
+    position = decode_search_cursor(cursor)
+    if position:
+        where.append(f"({RANK} > %s OR ({RANK} = %s AND l.id > %s))")
+        params.extend([position[0], position[0], position[1]])
+
+    sql = (
+        f"SELECT l.id, {RANK} AS rank FROM {FTS_TABLE} JOIN {table} l ON l.id = {FTS_TABLE}.rowid "
+        f"WHERE {' AND '.join(where)} ORDER BY rank, l.id LIMIT %s"
+    )
+    with connection.cursor() as db:
+        db.execute(sql, params + [page_size + 1])
+        hits = db.fetchall()
+
+    next_cursor = encode_search_cursor(*reversed(hits[page_size - 1])) if len(hits) > page_size else None
+    hits = hits[:page_size]
+    found = listings.in_bulk([pk for pk, rank in hits])
+    return [found[pk] for pk, rank in hits if pk in found], next_cursor, candidates if truncated else None
+
+
+def icontains_page(listings, terms, category=None, min_price=None, max_price=None, active=True, cursor=None, page_size=None):
+    #the search without a full-text index: every term must appear in the title or description. This
+    #scans the whole table, so it's only the fallback for databases without FTS5 (and the benchmark's
+    #baseline); results come newest first since there is no relevance score
+    page_size = page_size or get_page_size()
+    for term in terms:
+        listings = listings.filter(Q(title__icontains=term) | Q(item_detail__icontains=term))
+    if category is not None:
+        listings = listings.filter(category=category)
+    if active is not None:
+        listings = listings.filter(active_status=active)
+    if min_price is not None or max_price is not None:
+        if "current_bid" not in listings.query.annotations:
+            listings = listings.with_current_bid()
+        if min_price is not None:
+            listings = listings.filter(current_bid__gte=min_price)
+        if max_price is not None:
+            listings = listings.filter(current_bid__lte=max_price)
+    page = list(keyset_order(listings, cursor)[:page_size + 1])
+    next_cursor = encode_cursor(page[page_size - 1]) if len(page) > page_size else None
+    return page[:page_size], next_cursor
+
+
+def rebuild_index():
+    #rebuild the whole index from the listings table in one pass, then merge its segments into one. Use
+    #after changing the tokenizer, or if rows were ever written with the triggers missing
+    with connection.cursor() as db:
+        db.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        db.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+        db.execute(f"SELECT COUNT(*) FROM {FTS_TABLE}")
+        return db.fetchone()[0]
@@ -0,0 +1,129 @@
+import json
+import os
+import random
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from .cache import invalidate_categories
+from .models import Bids, Category, Comment, Listings, User
+from .stats import rebuild_category_stats
+
+CATEGORIES_FIXTURE = os.path.join(settings.BASE_DIR, "categories.json")
+
+
+def power_law(rng, alpha, cap):
+    #a heavy-tailed count: most listings get a handful of bids/comments, a few get very many
+    return min(int(rng.paretovariate(alpha)) - 1, cap)
+
+
+def batched(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def seed_categories():
+    with open(CATEGORIES_FIXTURE) as fixture:
+        names = [row["fields"]["name"] for row in json.load(fixture)]
+    existing = set(Category.objects.filter(name__in=names).values_list("name", flat=True))
+    created = Category.objects.bulk_create([Category(name=name) for name in names if name not in existing])
+    if created:
+        #bulk_create sends no post_save, so the cached category list has to be dropped by hand
+        invalidate_categories()
+    return list(Category.objects.filter(name__in=names))
+
+
+def seed(users=100, listings=1000, comments=True, watchlists=True, batch_size=1000, rng=None, log=None):
+    #bulk-create a synthetic auction site. Everything is written with bulk_create in batches, and the
+    #denormalized bid columns on Listings are filled in as it goes, so the result is a consistent database
+    rng = rng or random.Random(0)
+    log = log or (lambda message: None)
+    categories = seed_categories()
+
+    password = make_password("password")
+    offset = User.objects.count()
+    created_users = []
+    for batch in batched([f"user{offset + i}" for i in range(users)], batch_size):
+        created_users += User.objects.bulk_create([
+            User(username=name, email=f"{name}@example.com", password=password) for name in batch
+        ])
+    log(f"{len(created_users)} users")
+
+    total_bids = total_comments = total_watches = 0
+    for start in range(0, listings, batch_size):
+        count = min(batch_size, listings - start)
+        with transaction.atomic():
+            new_listings = Listings.objects.bulk_create([
+                Listings(
+                    title=f"Item {start + i}",
+                    category=rng.choice(categories),
+                    item_detail=f"Synthetic listing {start + i} for load testing.",
+                    starting_bid=Decimal(rng.randint(100, 50000)) / 100,
+                    listed_by=rng.choice(created_users),
+                    active_status=rng.random() < 0.8,
+                )
+                for i in range(count)
+            ])
+
+            #the seller's starting bid, then a power-law number of strictly increasing bids by others
+            bids = []
+            for listing in new_listings:
+                price = listing.starting_bid
+                bids.append(Bids(listing=listing, bid_amount=price, bidder=listing.listed_by))
+                for _ in range(power_law(rng, 1.3, 200)):
+                    price += Decimal(rng.randint(1, 500)) / 100
+                    bids.append(Bids(listing=listing, bid_amount=price, bidder=rng.choice(created_users)))
+            for batch in batched(bids, batch_size):
+                Bids.objects.bulk_create(batch)
+            total_bids += len(bids)
+
+            #bids were appended in order, so the last bid seen for each listing is its top bid
+            for bid in bids:
+                bid.listing.top_bid = bid
+                bid.listing.current_price = bid.bid_amount
+                bid.listing.bid_count += 1
+            for listing in new_listings:
+                if not listing.active_status:
+                    listing.winner_id = listing.top_bid.bidder_id
+
+            new_comments = []
+            if comments:
+                new_comments = [
+                    Comment(listing=listing, user=rng.choice(created_users), text="Is this still available?")
+                    for listing in new_listings
+                    for _ in range(power_law(rng, 1.5, 100))
+                ]
+                for comment in new_comments:
+                    comment.listing.comment_count += 1
+            Listings.objects.bulk_update(
+                new_listings, ["top_bid", "current_price", "bid_count", "comment_count", "winner"], batch_size=batch_size,
+            )
+            for batch in batched(new_comments, batch_size):
+                Comment.objects.bulk_create(batch)
+            total_comments += len(new_comments)
+
+            if watchlists:
+                Watch = User.watchlist.through
+                watches = {
+                    (rng.choice(created_users).pk, listing.pk)
+                    for listing in new_listings
+                    for _ in range(power_law(rng, 1.5, 50))
+                }
+                Watch.objects.bulk_create(
+                    [Watch(user_id=user_id, listings_id=listing_id) for user_id, listing_id in watches],
+                    batch_size=batch_size,
+                )
+                total_watches += len(watches)
+        log(f"{start + count} listings")
+    #bulk_create skips the signals that keep the category stats up to date
+    rebuild_category_stats()
+
+    return {
+        "users": len(created_users),
+        "listings": listings,
+        "bids": total_bids,
+        "comments": total_comments,
+        "watchlist_entries": total_watches,
+    }
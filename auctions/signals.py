@@ -0,0 +1,98 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cache import (
+    invalidate_catalogue, invalidate_categories, invalidate_listing, invalidate_listings, invalidate_watchlist_counts,
+)
+from .models import Category, CategoryStats, Listings, User
+from .search import ensure_search_triggers
+from .stats import record_listing_created
+
+
+@receiver([post_save, post_delete], sender=Category)
+def category_changed(sender, **kwargs):
+    invalidate_categories()
+
+
+@receiver(post_save, sender=Category)
+def category_renamed(sender, instance, created, **kwargs):
+    #the cached details block of every listing in the category shows its name. Deleting a category
+    #deletes its listings, whose own signals drop their fragments
+    if not created:
+        listings = Listings.objects.filter(category=instance).values_list("pk", flat=True)
+        invalidate_listings(listings.iterator(chunk_size=2000))
+
+
+@receiver(post_save, sender=Category)
+def create_category_stats(sender, instance, created, **kwargs):
+    #every category has a stats row for the bid engine and closing to update. Categories created in bulk
+    #(seeding, imports) get theirs from rebuild_category_stats
+    if created:
+        now = timezone.now()
+        CategoryStats.objects.get_or_create(category=instance, defaults={"window_started_at": now, "updated_at": now})
+
+
+@receiver([post_save, post_delete], sender=Listings)
+def listing_changed(sender, instance, **kwargs):
+    invalidate_listing(instance.pk)
+
+
+@receiver(post_save, sender=Listings)
+def count_new_listing(sender, instance, created, **kwargs):
+    if created:
+        record_listing_created(instance)
+
+
+@receiver(post_delete, sender=Listings)
+def listing_removed(sender, instance, **kwargs):
+    #a deleted listing leaves no newer updated_at behind for the index and category ETags to notice. Once
+    #the delete has committed, so a page rendered in between can't be cached under the new version
+    transaction.on_commit(invalidate_catalogue)
+
+
+@receiver(pre_delete, sender=Listings)
+def listing_deleted(sender, instance, **kwargs):
+    #deleting a listing drops its watchlist rows without an m2m_changed signal
+    invalidate_watchlist_counts(instance.watchlist.values_list("pk", flat=True))
+
+
+@receiver(m2m_changed, sender=User.watchlist.through)
+def watchlist_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if not reverse:
+        #user.watchlist.add/remove/clear - only that user's count changed
+        invalidate_watchlist_counts([instance.pk])
+    elif pk_set is not None:
+        #listing.watchlist.add/remove - the users are the pks that were added or removed
+        invalidate_watchlist_counts(pk_set)
+    else:
+        #listing.watchlist.clear() doesn't say which users were affected, so the pre_clear hook records them
+        invalidate_watchlist_counts(getattr(instance, "_cleared_watchers", []))
+
+
+@receiver(m2m_changed, sender=User.watchlist.through)
+def remember_cleared_watchers(sender, instance, action, reverse, **kwargs):
+    if action == "pre_clear" and reverse:
+        instance._cleared_watchers = list(instance.watchlist.values_list("pk", flat=True))
+
+
+@receiver(post_migrate)
+def restore_search_triggers(sender, using, **kwargs):
+    #a migration that rebuilt auctions_listings took the full-text index's triggers with it
+    if sender.name == "auctions":
+        ensure_search_triggers(using)
+
+
+@receiver(connection_created)
+def tune_sqlite_connection(sender, connection, **kwargs):
+    #set up each new SQLite connection with the pragmas from settings (see commerce/database.py)
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, "AUCTIONS_SQLITE_PRAGMAS", {}).items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
@@ -0,0 +1,15 @@
+// "Load more comments": fetch the next page of the thread from the fragment endpoint and put it in place
+// of the link. Without JavaScript the link reloads the listing page at that page of the thread instead.
+document.addEventListener("click", function(event) {
+    const marker = event.target.closest(".load-more-comments");
+    if (!marker) {
+        return;
+    }
+    event.preventDefault();
+    fetch(marker.dataset.url)
+        .then(function(response) { return response.text(); })
+        .then(function(html) {
+            marker.insertAdjacentHTML("afterend", html);
+            marker.remove();
+        });
+});
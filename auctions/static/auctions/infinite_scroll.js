@@ -0,0 +1,34 @@
+// Infinite scroll for keyset-paginated listing pages: when the "Load more" marker scrolls into view,
+// fetch the next page of rows from the fragment endpoint and swap the marker for them.
+document.addEventListener("DOMContentLoaded", function() {
+    const container = document.querySelector(".listing-rows");
+    if (!container || !("IntersectionObserver" in window)) {
+        return;  // the plain "Load more" link still works without JavaScript
+    }
+
+    const observer = new IntersectionObserver(function(entries) {
+        entries.forEach(function(entry) {
+            if (!entry.isIntersecting) {
+                return;
+            }
+            const marker = entry.target;
+            observer.unobserve(marker);
+            fetch(marker.dataset.url)
+                .then(function(response) { return response.text(); })
+                .then(function(html) {
+                    marker.insertAdjacentHTML("afterend", html);
+                    marker.remove();
+                    watchMarker();
+                });
+        });
+    });
+
+    function watchMarker() {
+        const marker = container.querySelector(".load-more");
+        if (marker) {
+            observer.observe(marker);
+        }
+    }
+
+    watchMarker();
+});
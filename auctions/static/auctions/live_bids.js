@@ -0,0 +1,55 @@
+// Live bid updates on a listing page: listen to the listing's Server-Sent Events stream and patch the
+// price, top bidder and bid count in place. Without EventSource support (or under a WSGI server, where
+// the stream isn't served) fall back to long polling.
+document.addEventListener("DOMContentLoaded", function() {
+    const panel = document.getElementById("live-bids");
+    if (!panel) {
+        return;
+    }
+    let bidCount = parseInt(panel.dataset.bidCount, 10);
+
+    function update(state) {
+        bidCount = state.bid_count;
+        panel.querySelector(".live-price").textContent = state.price;
+        panel.querySelector(".live-bidder").textContent = state.bidder ? "Top bidder: " + state.bidder : "";
+        document.querySelectorAll(".live-bid-count").forEach(function(element) {
+            element.textContent = state.bid_count;
+        });
+    }
+
+    function poll() {
+        fetch(panel.dataset.pollUrl + "?since=" + bidCount)
+            .then(function(response) {
+                if (!response.ok) {
+                    throw new Error(response.status);
+                }
+                return response.status === 204 ? null : response.json();
+            })
+            .then(function(state) {
+                if (state) {
+                    update(state);
+                }
+                poll();
+            })
+            .catch(function() {
+                setTimeout(poll, 5000);  // back off while the server is unreachable
+            });
+    }
+
+    if (!("EventSource" in window)) {
+        poll();
+        return;
+    }
+    const source = new EventSource(panel.dataset.eventsUrl);
+    let connected = false;
+    source.onopen = function() { connected = true; };
+    source.onmessage = function(message) { update(JSON.parse(message.data)); };
+    source.onerror = function() {
+        // EventSource reconnects by itself after a dropped stream; if it never connected at all,
+        // the stream isn't available here, so switch to long polling
+        if (!connected) {
+            source.close();
+            poll();
+        }
+    };
+});
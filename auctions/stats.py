@@ -0,0 +1,186 @@
+import statistics
+from collections import defaultdict
+from itertools import chain
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q, Subquery, Sum, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import ArchivedBid, ArchivedListing, Bids, Category, CategoryStats, Listings
+
+try:
+    import numpy
+except ImportError:
+    #optional: without it the rebuild takes each category's median with the statistics module instead
+    numpy = None
+
+CENT = Decimal("0.01")
+
+
+def get_window_days():
+    #how many days of bids the bid velocity covers right after a rebuild
+    return getattr(settings, "AUCTIONS_STATS_WINDOW_DAYS", 7)
+
+
+def record_bids(listing_id, count=1, now=None):
+    #count bids placed on the listing towards its category's velocity. One UPDATE, with the category
+    #looked up by a subquery, in the bid's own transaction
+    category = Listings.objects.filter(pk=listing_id).values("category_id")[:1]
+    CategoryStats.objects.filter(pk=Subquery(category)).update(
+        window_bids=F("window_bids") + count, updated_at=now or timezone.now(),
+    )
+
+
+def record_listing_created(listing):
+    CategoryStats.objects.filter(pk=listing.category_id).update(
+        active_count=F("active_count") + 1, updated_at=timezone.now(),
+    )
+
+
+def close_deltas(closed):
+    #{category_id: [listings closed, sold, sold value]} for (category_id, winner_id, seller_id, price)
+    #rows. A listing is only sold to someone other than its seller: the seller's own starting bid is its
+    #top bid until somebody outbids it, and listings closed before that stopped counting as a win may
+    #still have the seller as their winner
+    deltas = defaultdict(lambda: [0, 0, Decimal(0)])
+    for category_id, winner_id, seller_id, price in closed:
+        delta = deltas[category_id]
+        delta[0] += 1
+        if winner_id is not None and winner_id != seller_id:
+            delta[1] += 1
+            delta[2] += price or 0
+    return deltas
+
+
+def record_closes(closed, now):
+    #fold a batch of just-closed listings, as (category_id, winner_id, seller_id, price) rows, into their
+    #categories' counts: one UPDATE per category in the batch
+    for category_id, (closed_count, sold_count, sold_value) in close_deltas(closed).items():
+        CategoryStats.objects.filter(pk=category_id).update(
+            #a counter that has drifted below the truth stays at zero until the next rebuild
+            active_count=Greatest(F("active_count") - closed_count, 0),
+            closed_count=F("closed_count") + closed_count,
+            sold_count=F("sold_count") + sold_count,
+            sold_value=F("sold_value") + sold_value,
+            updated_at=now,
+        )
+
+
+def record_reopens(reopened, now):
+    #take a batch of relisted listings, as (category_id, winner_id, seller_id, price) rows from before
+    #they were reopened, back out of their categories' counts: record_closes in reverse
+    for category_id, (closed_count, sold_count, sold_value) in close_deltas(reopened).items():
+        CategoryStats.objects.filter(pk=category_id).update(
+            active_count=F("active_count") + closed_count,
+            closed_count=Greatest(F("closed_count") - closed_count, 0),
+            sold_count=Greatest(F("sold_count") - sold_count, 0),
+            sold_value=Greatest(F("sold_value") - sold_value, 0),
+            updated_at=now,
+        )
+
+
+def median_prices(prices):
+    #each category's median price, from (category_id, price) pairs sorted by category and then price.
+    #With NumPy every category is done at once: the median sits in the middle of the category's run of
+    #the sorted array (between the two middle elements for an even count). Prices are worked in cents so
+    #the result is exact either way
+    categories, cents = [], []
+    for category_id, price in prices:
+        categories.append(category_id)
+        cents.append(int(price * 100))
+    if not cents:
+        return {}
+    if numpy is not None:
+        categories, cents = numpy.array(categories), numpy.array(cents, dtype=numpy.int64)
+        starts = numpy.flatnonzero(numpy.r_[True, categories[1:] != categories[:-1]])
+        sizes = numpy.diff(numpy.r_[starts, len(cents)])
+        doubled = cents[starts + (sizes - 1) // 2] + cents[starts + sizes // 2]
+        return {int(category_id): _price(int(total)) for category_id, total in zip(categories[starts], doubled)}
+    runs = defaultdict(list)
+    for category_id, amount in zip(categories, cents):
+        runs[category_id].append(amount)
+    return {category_id: _price(int(statistics.median(run) * 2)) for category_id, run in runs.items()}
+
+
+def _price(doubled_cents):
+    return (Decimal(doubled_cents) / 200).quantize(CENT)
+
+
+def category_stats(now=None):
+    #every category's figures computed from scratch: grouped counts of listings and of recent bids, and
+    #the sold prices in order for the medians. Archived listings (all closed) and their bids count too
+    now = now or timezone.now()
+    window_start = now - timedelta(days=get_window_days())
+    #sold to someone other than the seller, as in close_deltas
+    sold = Q(active_status=False, winner__isnull=False) & ~Q(winner=F("listed_by"))
+    stats = {
+        pk: CategoryStats(category_id=pk, window_started_at=window_start, rebuilt_at=now, updated_at=now)
+        for pk in Category.objects.values_list("pk", flat=True)
+    }
+    counts = Listings.objects.order_by().values("category").annotate(
+        active=Count("pk", filter=Q(active_status=True)),
+        closed=Count("pk", filter=Q(active_status=False)),
+        sold=Count("pk", filter=sold),
+        value=Sum("current_price", filter=sold),
+    )
+    archived_sold = Q(winner__isnull=False) & ~Q(winner=F("listed_by"))
+    archived_counts = ArchivedListing.objects.order_by().values("category").annotate(
+        active=Value(0), closed=Count("pk"), sold=Count("pk", filter=archived_sold),
+        value=Sum("current_price", filter=archived_sold),
+    )
+    for row in chain(counts, archived_counts):
+        row_stats = stats[row["category"]]
+        row_stats.active_count += row["active"]
+        row_stats.closed_count += row["closed"]
+        row_stats.sold_count += row["sold"]
+        row_stats.sold_value += row["value"] or 0
+    window = chain(
+        Bids.objects.filter(timestamp__gte=window_start).order_by().values("listing__category").annotate(n=Count("pk")),
+        ArchivedBid.objects.filter(timestamp__gte=window_start).order_by().values("listing__category").annotate(n=Count("pk")),
+    )
+    for row in window:
+        stats[row["listing__category"]].window_bids += row["n"]
+    #one sorted run of prices across both tables, which the medians need
+    prices = (
+        Listings.objects.filter(sold, current_price__isnull=False).values_list("category", "current_price")
+        .union(ArchivedListing.objects.filter(archived_sold, current_price__isnull=False).values_list("category", "current_price"), all=True)
+        .order_by("category", "current_price")
+    )
+    for category_id, median in median_prices(prices.iterator()).items():
+        stats[category_id].median_price = median
+    return list(stats.values())
+
+
+def rebuild_category_stats(now=None):
+    #recompute every category's stats and replace the incrementally kept ones, in one transaction so no
+    #bid or close is counted twice or lost in between. Returns how many categories were rebuilt
+    with transaction.atomic():
+        stats = category_stats(now)
+        CategoryStats.objects.bulk_create(
+            stats,
+            update_conflicts=True,
+            unique_fields=["category"],
+            update_fields=[
+                "active_count", "closed_count", "sold_count", "sold_value", "median_price",
+                "window_bids", "window_started_at", "rebuilt_at", "updated_at",
+            ],
+        )
+    return len(stats)
+
+
+async def acategory_stats(request, category_id=None):
+    #the stats of one category, or of every category by id, read once per request: a page's version
+    #function and the view itself both need them
+    if not hasattr(request, "_category_stats"):
+        request._category_stats = {}
+    if category_id not in request._category_stats:
+        if category_id is None:
+            stats = {row.category_id: row async for row in CategoryStats.objects.all()}
+        else:
+            stats = await CategoryStats.objects.filter(pk=category_id).afirst()
+        request._category_stats[category_id] = stats
+    return request._category_stats[category_id]
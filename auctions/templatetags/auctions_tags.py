@@ -0,0 +1,32 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+from auctions.cache import get_listing_fragment
+
+register = template.Library()
+
+
+@register.simple_tag
+def listing_details(listing):
+    #the cached, pre-rendered details block for a listing
+    return mark_safe(get_listing_fragment(listing))
+
+
+@register.simple_tag
+def listing_image(listing, sizes="(max-width: 600px) 100vw, 320px", loading="lazy", alt="Listing Image"):
+    #the listing's photo as a responsive <img>: its thumbnails in a srcset, for the browser to pick the
+    #smallest that fills the slot described by sizes. Until there are thumbnails it's the local original,
+    #and only a listing with no local copy hot-links its photo_url
+    if listing.thumbnails:
+        widths = sorted(listing.thumbnails, key=int)
+        srcset = ", ".join(f"{default_storage.url(listing.thumbnails[width])} {width}w" for width in widths)
+        #browsers without srcset get a middling size
+        fallback = next((width for width in widths if int(width) >= 320), widths[-1])
+        return format_html(
+            '<img src="{}" srcset="{}" sizes="{}" alt="{}" loading="{}" decoding="async">',
+            default_storage.url(listing.thumbnails[fallback]), srcset, sizes, alt, loading,
+        )
+    src = listing.image.url if listing.image else listing.photo_url
+    return format_html('<img src="{}" alt="{}" loading="{}" decoding="async">', src, alt, loading)
@@ -1,3 +1,1622 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import random
+import shutil
+import struct
+import tempfile
+import threading
+import zlib
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from itertools import islice
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection
+from django.template import RequestContext, Template
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from commerce.database import database_config
+
+from . import admin, events, images, notifications, views
+from .archive import archive_closed_listings
+from .bidding import BidRejected, place_bid, set_proxy_bid
+from .closing import close_expired_auctions, close_listings, due_listings
+from .events import Broker, bid_event
+from .cache import cache_stats, get_categories, get_listing_fragment, reset_cache_stats
+from .helpers import aget_bid_state, encode_cursor, keyset_order, record_bid
+from .middleware import PRIMARY_COOKIE, RequestProfile, fingerprint
+from .models import ArchivedListing, User, Listings, Category, CategoryStats, Bids, Comment, OutboxEvent, ProxyBid
+from .notifications import claim_batch, deliver_notifications
+from .replicas import replica_reads, sync_replica
+from .search import icontains_page, search_page, search_terms
+from . import stats
+from .signals import tune_sqlite_connection
+from .transfer import import_records, read_jsonl
+
+
+class AuctionTestCase(TestCase):
+
+    def setUp(self):
+        #the local-memory cache outlives each test's rolled-back transaction
+        cache.clear()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Books")
+        cls.seller = User.objects.create_user("seller", "seller@example.com", "password")
+        cls.bidder = User.objects.create_user("bidder", "bidder@example.com", "password")
+        #a second bidder: bids of the seller's own on their listing never win or outbid anyone
+        cls.rival = User.objects.create_user("rival", "rival@example.com", "password")
+
+    def make_listing(self, title="Listing", starting_bid="10.00", item_detail="Details", **kwargs):
+        return Listings.objects.create(
+            title=title,
+            category=self.category,
+            item_detail=item_detail,
+            starting_bid=Decimal(starting_bid),
+            listed_by=self.seller,
+            **kwargs,
+        )
+
+
+class DenormalizedBidStateTests(AuctionTestCase):
+
+    def test_create_listing_records_starting_bid(self):
+        self.client.force_login(self.seller)
+        self.client.post(reverse("create_listing"), {
+            "title": "Lamp", "category": "Books", "description": "A lamp", "starting_bid": "5.00", "photo_url": "",
+        })
+        listing = Listings.objects.get(title="Lamp")
+        self.assertEqual(listing.current_price, Decimal("5.00"))
+        self.assertEqual(listing.bid_count, 1)
+        self.assertEqual(listing.top_bid.bidder, self.seller)
+
+    def test_add_bid_moves_price_and_top_bid(self):
+        listing = self.make_listing()
+        self.client.force_login(self.bidder)
+        self.client.post(reverse("add_bid", args=[listing.id]), {"bid_amount": "12.50"})
+        self.client.post(reverse("add_bid", args=[listing.id]), {"bid_amount": "11.00"})
+        listing.refresh_from_db()
+        self.assertEqual(listing.current_price, Decimal("12.50"))
+        self.assertEqual(listing.bid_count, 1)
+        self.assertEqual(listing.top_bid.bidder, self.bidder)
+
+    def test_backfill_command_recomputes_bid_state(self):
+        listing = self.make_listing()
+        Bids.objects.create(listing=listing, bid_amount=Decimal("15.00"), bidder=self.bidder)
+        top = Bids.objects.create(listing=listing, bid_amount=Decimal("20.00"), bidder=self.seller)
+        call_command("backfill_listing_bids", stdout=StringIO())
+        listing.refresh_from_db()
+        self.assertEqual(listing.current_price, Decimal("20.00"))
+        self.assertEqual(listing.top_bid, top)
+        self.assertEqual(listing.bid_count, 2)
+
+
+class ListingFeedQueryCountTests(AuctionTestCase):
+
+    def add_listings(self, count, **kwargs):
+        for i in range(count):
+            listing = self.make_listing(title=f"Listing {i}", **kwargs)
+            bid = Bids.objects.create(listing=listing, bid_amount=Decimal("11.00"), bidder=self.bidder)
+            record_bid(listing, bid)
+
+    def count_queries(self, method, url, data=None, reset=None):
+        cache.clear()
+        if reset:
+            reset()
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data or {})
+        self.assertIn(response.status_code, (200, 302))
+        return len(queries)
+
+    def assertConstantQueries(self, method, url, data=None, reset=None, **listing_kwargs):
+        self.add_listings(2, **listing_kwargs)
+        small = self.count_queries(method, url, data, reset)
+        self.add_listings(10, **listing_kwargs)
+        self.assertEqual(self.count_queries(method, url, data, reset), small)
+
+    def test_index(self):
+        self.client.force_login(self.bidder)
+        self.assertConstantQueries("get", reverse("index"))
+
+    def test_closed_listings(self):
+        self.client.force_login(self.bidder)
+        self.assertConstantQueries("get", reverse("closed_listings"), active_status=False)
+
+    def test_add_to_watchlist(self):
+        self.client.force_login(self.bidder)
+        listing = self.make_listing()
+        self.assertConstantQueries("post", reverse("add_to_watchlist", args=[listing.id]), reset=self.bidder.watchlist.clear)
+
+    def test_login(self):
+        self.assertConstantQueries("post", reverse("login"), {"username": "bidder", "password": "password"}, reset=self.client.logout)
+
+    def test_feed_annotations(self):
+        self.add_listings(1)
+        self.bidder.watchlist.add(Listings.objects.get())
+        with self.assertNumQueries(1):
+            listing = Listings.objects.feed(self.bidder).get()
+            self.assertEqual(listing.current_bid, Decimal("11.00"))
+            self.assertEqual(listing.top_bid.bidder, self.bidder)
+            self.assertEqual(listing.category, self.category)
+            self.assertTrue(listing.is_watched)
+
+
+@override_settings(AUCTIONS_PAGE_SIZE=2)
+class KeysetPaginationTests(AuctionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.listings = [self.make_listing(title=f"Listing {i}") for i in range(5)]
+
+    def titles(self, response):
+        return [row["listing"].title for row in response.context["listings_with_bids"]]
+
+    def test_index_pages_follow_cursor_newest_first(self):
+        seen = []
+        response = self.client.get(reverse("index"))
+        while True:
+            seen += self.titles(response)
+            cursor = response.context["next_cursor"]
+            if not cursor:
+                break
+            response = self.client.get(reverse("listings_page"), {"cursor": cursor})
+        self.assertEqual(seen, [f"Listing {i}" for i in reversed(range(5))])
+
+    def test_category_page_and_fragment(self):
+        response = self.client.get(reverse("listings_by_category", args=[self.category.id]))
+        self.assertEqual(len(self.titles(response)), 2)
+        response = self.client.get(reverse("listings_page"), {
+            "cursor": response.context["next_cursor"], "category": self.category.id,
+        })
+        self.assertEqual(self.titles(response), ["Listing 2", "Listing 1"])
+
+    def test_bad_cursor_starts_from_first_page(self):
+        response = self.client.get(reverse("index"), {"cursor": "not-a-cursor"})
+        self.assertEqual(self.titles(response), ["Listing 4", "Listing 3"])
+
+    def test_streaming_mode_renders_every_row(self):
+        response = self.client.get(reverse("index"), {"stream": "1"})
+        self.assertTrue(response.streaming)
+        body = b"".join(response.streaming_content).decode()
+        for i in range(5):
+            self.assertIn(f"Listing {i}", body)
+        self.assertNotIn("<!--listing-rows-->", body)
+
+
+class BidEngineTests(AuctionTestCase):
+
+    def test_stale_bid_rejected_without_write(self):
+        listing = self.make_listing()
+        place_bid(listing.id, self.bidder, Decimal("15.00"))
+        with self.assertNumQueries(1):
+            with self.assertRaises(BidRejected) as rejected:
+                place_bid(listing.id, self.bidder, Decimal("12.00"))
+        self.assertEqual(rejected.exception.current_bid, Decimal("15.00"))
+
+    def test_closed_listing_rejects_bids(self):
+        listing = self.make_listing(active_status=False)
+        with self.assertRaises(BidRejected):
+            place_bid(listing.id, self.bidder, Decimal("50.00"))
+
+    def test_ended_listing_rejects_bids_before_it_is_swept(self):
+        listing = self.make_listing(end_time=timezone.now() - timedelta(seconds=1))
+        with self.assertRaises(BidRejected) as rejected:
+            place_bid(listing.id, self.bidder, Decimal("50.00"))
+        self.assertEqual(rejected.exception.message, "This auction has ended.")
+
+
+@override_settings(AUCTIONS_BID_INCREMENT="1.00")
+class ProxyBidTests(AuctionTestCase):
+
+    def state(self, listing):
+        listing.refresh_from_db()
+        return listing.current_price, listing.top_bid.bidder, listing.bid_count
+
+    def test_proxies_answer_each_other_and_manual_bids(self):
+        listing = self.make_listing()
+        buyer = User.objects.create_user("buyer", "buyer@example.com", "password")
+        set_proxy_bid(listing.id, self.bidder, Decimal("50.00"))
+        self.assertEqual(self.state(listing), (Decimal("11.00"), self.bidder, 1))
+        #the runner-up's maximum goes into the history, then the leader answers one increment above it
+        set_proxy_bid(listing.id, buyer, Decimal("30.00"))
+        self.assertEqual(self.state(listing), (Decimal("31.00"), self.bidder, 3))
+        self.assertEqual(list(listing.bids.order_by("id").values_list("bid_amount", flat=True)),
+                         [Decimal("11.00"), Decimal("30.00"), Decimal("31.00")])
+        #a manual bid is answered in the same request
+        place_bid(listing.id, self.rival, Decimal("40.00"))
+        self.assertEqual(self.state(listing), (Decimal("41.00"), self.bidder, 5))
+        #until it beats the leader's maximum
+        place_bid(listing.id, buyer, Decimal("60.00"))
+        self.assertEqual(self.state(listing), (Decimal("60.00"), buyer, 6))
+
+    def test_equal_maximums_go_to_the_earlier_proxy(self):
+        listing = self.make_listing()
+        set_proxy_bid(listing.id, self.bidder, Decimal("25.00"))
+        set_proxy_bid(listing.id, self.rival, Decimal("25.00"))
+        self.assertEqual(self.state(listing)[:2], (Decimal("25.00"), self.bidder))
+
+    def test_hundreds_of_competing_proxies(self):
+        listing = self.make_listing()
+        rng = random.Random(15)
+        users = User.objects.bulk_create([User(username=f"proxy{i}", password="!") for i in range(300)])
+        maximums = {user.pk: Decimal(rng.randint(1200, 90000)) / 100 for user in users}
+        ProxyBid.objects.bulk_create([
+            ProxyBid(listing=listing, bidder_id=user_id, max_amount=amount) for user_id, amount in maximums.items()
+        ])
+        #one manual bid settles all 300 proxies in a single step: the winner and price come from the top
+        #two maximums, with no bid-by-bid bidding war in between (the count includes the test's savepoints,
+        #one insert queueing the outbid notifications and one update of the category stats)
+        with self.assertNumQueries(13):
+            place_bid(listing.id, self.rival, Decimal("11.00"))
+
+        ranked = sorted(maximums.items(), key=lambda item: (-item[1], item[0]))
+        (winner, best), (runner_up, second) = ranked[0], ranked[1]
+        current_price, top_bidder, bid_count = self.state(listing)
+        self.assertEqual(top_bidder.pk, winner)
+        self.assertEqual(current_price, min(best, second + Decimal("1.00")))
+        #the manual bid, the runner-up's maximum and the winning answer
+        self.assertEqual(bid_count, 3)
+        self.assertEqual(list(listing.bids.order_by("id").values_list("bidder", "bid_amount")), [
+            (self.rival.pk, Decimal("11.00")), (runner_up, second), (winner, current_price),
+        ])
+
+    def test_proxy_below_current_bid_is_rejected(self):
+        listing = self.make_listing()
+        place_bid(listing.id, self.rival, Decimal("20.00"))
+        with self.assertRaises(BidRejected):
+            set_proxy_bid(listing.id, self.bidder, Decimal("15.00"))
+        self.assertFalse(ProxyBid.objects.exists())
+
+
+class AuctionExpiryTests(AuctionTestCase):
+
+    def test_sweep_closes_due_listings_in_batches(self):
+        past, future = timezone.now() - timedelta(minutes=1), timezone.now() + timedelta(days=1)
+        due = [self.make_listing(title=f"Due {i}", end_time=future) for i in range(5)]
+        open_ended = self.make_listing(end_time=future)
+        no_end = self.make_listing()
+        place_bid(due[0].id, self.bidder, Decimal("20.00"))
+        place_bid(due[0].id, self.rival, Decimal("25.00"))
+        place_bid(due[1].id, self.bidder, Decimal("20.00"))
+        Listings.objects.filter(pk__in=[listing.pk for listing in due]).update(end_time=past)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(close_expired_auctions(batch_size=2), 5)
+        #per batch of two: a select, the update, a select of what it closed (for the winners to notify)
+        #and an update of the category's stats; then a final select that finds nothing
+        statements = [query["sql"].split()[0] for query in queries.captured_queries]
+        self.assertEqual(
+            [verb for verb in statements if verb in ("SELECT", "UPDATE")],
+            ["SELECT", "UPDATE", "SELECT", "UPDATE"] * 3 + ["SELECT"],
+        )
+        winners = dict(Listings.objects.filter(pk__in=[listing.pk for listing in due]).values_list("pk", "winner"))
+        self.assertEqual(winners[due[0].pk], self.rival.pk)
+        self.assertEqual(winners[due[1].pk], self.bidder.pk)
+        self.assertIsNone(winners[due[2].pk])
+        self.assertFalse(Listings.objects.filter(pk__in=winners, closed_at__isnull=True).exists())
+        self.assertEqual(Listings.objects.filter(pk__in=[open_ended.pk, no_end.pk], active_status=True).count(), 2)
+        #sweeping again, or closing a closed listing, changes nothing
+        self.assertEqual(close_expired_auctions(), 0)
+        self.assertEqual(close_listings([due[0].pk]), 0)
+
+    def test_sweep_uses_due_index(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("EXPLAIN QUERY PLAN is SQLite specific")
+        sql, params = due_listings().values_list("pk", flat=True)[:500].query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            plan = " ".join(row[-1] for row in cursor.fetchall())
+        self.assertIn("listing_due_idx", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_close_auction_view_picks_top_bidder(self):
+        listing = self.make_listing()
+        place_bid(listing.id, self.bidder, Decimal("20.00"))
+        self.client.force_login(self.seller)
+        response = self.client.post(reverse("close_auction", args=[listing.id]), follow=True)
+        self.assertContains(response, "bidder wins the auction with a bid of $20.00")
+        listing.refresh_from_db()
+        self.assertEqual((listing.active_status, listing.winner), (False, self.bidder))
+        self.assertIsNotNone(listing.closed_at)
+
+
+class FailingBackend(notifications.BaseBackend):
+    def send(self, notification):
+        raise ConnectionError("mail server down")
+
+
+@override_settings(AUCTIONS_NOTIFICATION_BACKEND="auctions.notifications.LocmemBackend", AUCTIONS_NOTIFICATION_RETRY_DELAY=30)
+class NotificationTests(AuctionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        notifications.outbox.clear()
+        self.listing = self.make_listing(title="Clock")
+
+    def queued(self):
+        return list(OutboxEvent.objects.order_by("id").values_list("kind", "recipient", "listing", "payload"))
+
+    def test_outbid_and_won_are_queued_with_the_bid_and_close(self):
+        place_bid(self.listing.id, self.bidder, Decimal("20.00"))
+        place_bid(self.listing.id, self.rival, Decimal("25.00"))
+        #raising your own top bid outbids nobody, and a rejected bid queues nothing
+        place_bid(self.listing.id, self.rival, Decimal("30.00"))
+        with self.assertRaises(BidRejected):
+            place_bid(self.listing.id, self.bidder, Decimal("29.00"))
+        self.assertEqual(self.queued(), [("outbid", self.bidder.pk, self.listing.pk, {"amount": "25.00"})])
+
+        close_listings([self.listing.id])
+        close_listings([self.listing.id])
+        self.assertEqual(self.queued()[1:], [("won", self.rival.pk, self.listing.pk, {"amount": "30.00"})])
+
+    def listed_through_view(self, title):
+        #create_listing records the seller's starting bid as the listing's top bid
+        self.client.force_login(self.seller)
+        self.client.post(reverse("create_listing"), {
+            "title": title, "category": self.category.name, "description": "Oak", "starting_bid": "10.00", "photo_url": "",
+        })
+        return Listings.objects.select_related("top_bid").get(title=title)
+
+    def test_sellers_starting_bid_is_never_outbid_and_never_wins(self):
+        sold, unsold, proxied = (self.listed_through_view(title) for title in ("Desk", "Chair", "Lamp"))
+        self.assertEqual(sold.top_bid.bidder_id, self.seller.pk)
+        place_bid(sold.id, self.bidder, Decimal("15.00"))
+        set_proxy_bid(proxied.id, self.bidder, Decimal("50.00"))
+        self.assertEqual(self.queued(), [])
+        close_listings([sold.id, unsold.id])
+        self.assertEqual(self.queued(), [("won", self.bidder.pk, sold.pk, {"amount": "15.00"})])
+        self.assertIsNone(Listings.objects.get(pk=unsold.pk).winner)
+
+    def test_proxy_answer_outbids_the_manual_bidder(self):
+        set_proxy_bid(self.listing.id, self.bidder, Decimal("50.00"))
+        place_bid(self.listing.id, self.rival, Decimal("20.00"))
+        self.assertEqual(self.queued(), [("outbid", self.rival.pk, self.listing.pk, {"amount": "21.00"})])
+
+    def test_worker_coalesces_outbids_per_user_and_listing(self):
+        other = self.make_listing(title="Lamp")
+        for amount in ("20.00", "22.00", "24.00"):
+            place_bid(self.listing.id, self.bidder, Decimal(amount) - 1)
+            place_bid(self.listing.id, self.rival, Decimal(amount))
+        place_bid(other.id, self.bidder, Decimal("20.00"))
+        place_bid(other.id, self.rival, Decimal("21.00"))
+
+        counts = deliver_notifications()
+        self.assertEqual(counts, {"events": 6, "sent": 3, "retried": 0, "failed": 0})
+        sent = sorted((n.listing.title, n.recipient.username, n.amount, n.count) for n in notifications.outbox)
+        self.assertEqual(sent, [
+            ("Clock", "bidder", "24.00", 3), ("Clock", "rival", "23.00", 2), ("Lamp", "bidder", "21.00", 1),
+        ])
+        self.assertIn("3 times", next(n.body for n in notifications.outbox if n.count == 3))
+        self.assertFalse(OutboxEvent.objects.exclude(status=OutboxEvent.SENT).exists())
+        #sent events are never claimed again
+        self.assertEqual(deliver_notifications()["sent"], 0)
+
+    @override_settings(AUCTIONS_NOTIFICATION_MAX_ATTEMPTS=3)
+    def test_failed_delivery_is_retried_with_backoff(self):
+        place_bid(self.listing.id, self.bidder, Decimal("20.00"))
+        place_bid(self.listing.id, self.rival, Decimal("25.00"))
+        now = timezone.now()
+
+        self.assertEqual(deliver_notifications(now=now, backend=FailingBackend())["retried"], 1)
+        event = OutboxEvent.objects.get()
+        self.assertEqual((event.status, event.attempts, event.available_at), ("pending", 1, now + timedelta(seconds=30)))
+        self.assertIn("mail server down", event.last_error)
+        #not due again until the delay is up, which then doubles
+        self.assertEqual(deliver_notifications(now=now + timedelta(seconds=29), backend=FailingBackend())["retried"], 0)
+        now += timedelta(seconds=30)
+        deliver_notifications(now=now, backend=FailingBackend())
+        self.assertEqual(OutboxEvent.objects.get().available_at, now + timedelta(seconds=60))
+        #and after the last attempt it is given up on
+        self.assertEqual(deliver_notifications(now=now + timedelta(seconds=60), backend=FailingBackend())["failed"], 1)
+        self.assertEqual(OutboxEvent.objects.get().status, OutboxEvent.FAILED)
+        self.assertEqual(notifications.outbox, [])
+
+    def test_claimed_events_are_not_claimed_twice(self):
+        place_bid(self.listing.id, self.bidder, Decimal("20.00"))
+        place_bid(self.listing.id, self.rival, Decimal("25.00"))
+        now = timezone.now()
+        self.assertEqual(len(claim_batch(now=now)), 1)
+        self.assertEqual(claim_batch(now=now), [])
+        #a worker that died holding the event loses it once its lease runs out
+        self.assertEqual(len(claim_batch(now=now + timedelta(seconds=301))), 1)
+
+    def test_command_delivers(self):
+        close_listings([self.listing.id])
+        place_bid(self.make_listing().id, self.bidder, Decimal("20.00"))
+        out = StringIO()
+        call_command("deliver_notifications", stdout=out)
+        self.assertIn("Sent 0 notifications for 0 events", out.getvalue())
+
+        listing = self.make_listing(title="Vase")
+        place_bid(listing.id, self.bidder, Decimal("20.00"))
+        close_listings([listing.id])
+        out = StringIO()
+        call_command("deliver_notifications", stdout=out)
+        self.assertIn("Sent 1 notifications for 1 events", out.getvalue())
+        self.assertEqual(notifications.outbox[0].subject, "You won Vase")
+
+
+class CategoryStatsTests(AuctionTestCase):
+
+    def stats(self):
+        return CategoryStats.objects.get(pk=self.category.pk)
+
+    def counters(self):
+        row = self.stats()
+        return row.active_count, row.closed_count, row.sold_count, row.sold_value, row.window_bids
+
+    def make_market(self):
+        #three sold at 20, 30 and 45, one closed unsold, one still open with a bid
+        for price in ("20.00", "30.00", "45.00"):
+            listing = self.make_listing()
+            place_bid(listing.id, self.bidder, Decimal(price))
+            close_listings([listing.id])
+        close_listings([self.make_listing().id])
+        place_bid(self.make_listing().id, self.bidder, Decimal("12.00"))
+
+    def test_kept_up_to_date_by_listings_bids_and_closes(self):
+        self.make_market()
+        self.assertEqual(self.counters(), (1, 4, 3, Decimal("95.00"), 4))
+        row = self.stats()
+        self.assertEqual(row.mean_price, Decimal("31.67"))
+        self.assertEqual(row.sell_through, 75)
+        #proxies answering a bid count too
+        listing = self.make_listing()
+        set_proxy_bid(listing.id, self.rival, Decimal("50.00"))
+        place_bid(listing.id, self.bidder, Decimal("20.00"))
+        self.assertEqual(self.stats().window_bids, 7)
+
+    def test_rebuild_matches_and_adds_medians(self):
+        self.make_market()
+        incremental = self.counters()
+        CategoryStats.objects.update(active_count=0, window_bids=0, median_price=None)
+        self.assertEqual(stats.rebuild_category_stats(), 1)
+        self.assertEqual(self.counters(), incremental)
+        self.assertEqual(self.stats().median_price, Decimal("30.00"))
+        #a drifted counter never goes below zero
+        CategoryStats.objects.update(active_count=0)
+        close_listings([self.make_listing().id])
+        self.assertEqual(self.stats().active_count, 0)
+
+    def test_listing_closed_without_bids_is_not_sold(self):
+        #create_listing records the seller's starting bid as the top bid; closing it sells nothing
+        self.client.force_login(self.seller)
+        self.client.post(reverse("create_listing"), {
+            "title": "Atlas", "category": self.category.name, "description": "Old", "starting_bid": "80.00", "photo_url": "",
+        })
+        listing = Listings.objects.get(title="Atlas")
+        close_listings([listing.id])
+        self.assertEqual(self.counters()[:4], (0, 1, 0, Decimal("0.00")))
+        self.assertEqual((self.stats().sell_through, self.stats().mean_price), (0, None))
+        #nor does one closed before sellers stopped winning their own listings, once the stats are rebuilt
+        Listings.objects.filter(pk=listing.pk).update(winner=self.seller)
+        stats.rebuild_category_stats()
+        self.assertEqual(self.counters()[:4], (0, 1, 0, Decimal("0.00")))
+        self.assertIsNone(self.stats().median_price)
+
+    def test_median_prices(self):
+        prices = [(1, Decimal("5.00")), (1, Decimal("7.25")), (2, Decimal("1.00")), (2, Decimal("2.00")), (2, Decimal("9.99"))]
+        expected = {1: Decimal("6.12"), 2: Decimal("2.00")}
+        with patch.object(stats, "numpy", None):
+            self.assertEqual(stats.median_prices(prices), expected)
+        if stats.numpy is not None:
+            self.assertEqual(stats.median_prices(prices), expected)
+        self.assertEqual(stats.median_prices([]), {})
+
+    def test_category_pages_show_stats_and_change_with_them(self):
+        self.make_market()
+        self.client.force_login(self.bidder)
+        for url in (reverse("categories"), reverse("listings_by_category", args=[self.category.id])):
+            response = self.client.get(url)
+            self.assertContains(response, "75% sell-through")
+            self.assertContains(response, "mean $31.67")
+            stats.rebuild_category_stats(now=timezone.now() + timedelta(seconds=1))
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 200, url)
+
+    def test_new_categories_get_a_stats_row(self):
+        category = Category.objects.create(name="Lamps")
+        self.assertEqual(CategoryStats.objects.get(pk=category.pk).active_count, 0)
+
+    def test_command(self):
+        out = StringIO()
+        call_command("rebuild_category_stats", stdout=out)
+        self.assertIn("Rebuilt stats for 1 categories", out.getvalue())
+
+
+class ArchiveTests(AuctionTestCase):
+
+    def close_sold(self, price, closed_at, comment=None):
+        listing = self.make_listing(title=f"Sold at {price}")
+        place_bid(listing.id, self.bidder, Decimal(price) - 5)
+        place_bid(listing.id, self.rival, Decimal(price))
+        if comment:
+            Comment.objects.create(listing=listing, user=self.bidder, text=comment)
+        close_listings([listing.id], now=closed_at)
+        return listing
+
+    def make_closed(self):
+        #one sold and one unsold long ago, one sold yesterday and one still open, their notifications sent
+        self.long_ago = timezone.now() - timedelta(days=40)
+        old = self.close_sold("30.00", self.long_ago, comment="Mine!")
+        self.bidder.watchlist.add(old)
+        unsold = self.make_listing(title="Nobody wanted it")
+        close_listings([unsold.id], now=self.long_ago)
+        recent = self.close_sold("50.00", timezone.now() - timedelta(days=1))
+        self.make_listing(title="Still open")
+        OutboxEvent.objects.update(status=OutboxEvent.SENT)
+        return old, unsold, recent
+
+    def test_moves_old_closed_listings_with_their_bids_and_comments(self):
+        old, unsold, recent = self.make_closed()
+        counts = archive_closed_listings(days=30, batch_size=1)
+        self.assertEqual(counts, {"listings": 2, "bids": 2, "comments": 1})
+        self.assertFalse(Listings.objects.filter(pk__in=[old.pk, unsold.pk]).exists())
+        self.assertFalse(Bids.objects.filter(listing_id=old.pk).exists())
+        self.assertEqual(Listings.objects.count(), 2)
+        archived = ArchivedListing.objects.get(pk=old.pk)
+        self.assertEqual((archived.winner, archived.current_price, archived.bid_count), (self.rival, Decimal("30.00"), 2))
+        self.assertEqual(archived.closed_at, self.long_ago)
+        self.assertEqual(list(archived.bids.order_by("bid_amount").values_list("bid_amount", flat=True)), [Decimal("25.00"), Decimal("30.00")])
+        self.assertEqual(archived.comments.get().text, "Mine!")
+        self.assertEqual(self.bidder.watchlist.count(), 0)
+        self.assertIsNone(ArchivedListing.objects.get(pk=unsold.pk).winner)
+        #nothing left to move
+        self.assertEqual(archive_closed_listings(days=30)["listings"], 0)
+
+    def test_waits_for_pending_notifications(self):
+        old, _, _ = self.make_closed()
+        OutboxEvent.objects.filter(listing=old).update(status=OutboxEvent.PENDING)
+        self.assertEqual(archive_closed_listings(days=30)["listings"], 1)
+        self.assertTrue(Listings.objects.filter(pk=old.pk).exists())
+        OutboxEvent.objects.update(status=OutboxEvent.SENT)
+        self.assertEqual(archive_closed_listings(days=30)["listings"], 1)
+
+    def test_closed_listings_page_reads_both(self):
+        self.make_closed()
+        archive_closed_listings(days=30)
+        self.client.force_login(self.rival)
+        response = self.client.get(reverse("closed_listings"))
+        titles = [row["listing"].title for row in response.context["closed_listings_with_bids"]]
+        self.assertEqual(titles, ["Sold at 50.00", "Nobody wanted it", "Sold at 30.00"])
+        self.assertEqual([listing.title for listing in response.context["won_listings"]], ["Sold at 50.00", "Sold at 30.00"])
+        self.assertContains(response, "You won this auction!", count=2)
+
+    def test_stats_rebuild_counts_archived_listings(self):
+        self.make_closed()
+        stats.rebuild_category_stats()
+        before = CategoryStats.objects.values().get(pk=self.category.pk)
+        archive_closed_listings(days=30)
+        stats.rebuild_category_stats(now=before["rebuilt_at"])
+        after = CategoryStats.objects.values().get(pk=self.category.pk)
+        self.assertEqual(after, before)
+        self.assertEqual(after["median_price"], Decimal("40.00"))
+
+    def test_command(self):
+        self.make_closed()
+        out = StringIO()
+        call_command("archive_closed_listings", "--days", "30", stdout=out)
+        self.assertIn("Archived 2 listings closed over 30 days ago, with 2 bids and 1 comments", out.getvalue())
+
+
+class AdminTests(AuctionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(self.admin)
+
+    def add_listings(self, count):
+        for i in range(count):
+            listing = self.make_listing(title=f"Listing {i}")
+            place_bid(listing.id, self.bidder, Decimal("11.00"))
+            Comment.objects.create(listing=listing, user=self.bidder, text="Hi")
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def test_changelists_run_constant_queries(self):
+        for model in ("listings", "bids", "comment", "user"):
+            url = reverse(f"admin:auctions_{model}_changelist")
+            self.add_listings(2)
+            small = self.count_queries(url)
+            self.add_listings(10)
+            self.assertEqual(self.count_queries(url), small, model)
+        response = self.client.get(reverse("admin:auctions_listings_changelist"))
+        self.assertContains(response, "11.00")
+        self.assertEqual(self.count_queries(reverse("admin:auctions_listings_changelist") + "?active_status__exact=1"), small)
+
+    def test_estimated_count(self):
+        self.add_listings(3)
+        with patch.object(admin.EstimatedCountPaginator, "estimate_above", 0):
+            paginator = admin.EstimatedCountPaginator(Listings.objects.order_by("pk"), 100)
+            with self.assertNumQueries(2):
+                self.assertEqual(paginator.count, 3)
+            #the cached count stands in until the table has statistics
+            self.make_listing()
+            self.assertEqual(admin.EstimatedCountPaginator(Listings.objects.order_by("pk"), 100).count, 3)
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+            self.assertEqual(admin.EstimatedCountPaginator(Listings.objects.order_by("pk"), 100).count, 4)
+            #filtered changelists are counted exactly
+            self.assertEqual(admin.EstimatedCountPaginator(Listings.objects.filter(bid_count=1).order_by("pk"), 100).count, 3)
+        #as are small tables
+        self.make_listing()
+        self.assertEqual(admin.EstimatedCountPaginator(Listings.objects.order_by("pk"), 100).count, 5)
+
+    def test_close_and_relist_actions(self):
+        sold = self.make_listing(title="Sold")
+        place_bid(sold.id, self.bidder, Decimal("20.00"))
+        Listings.objects.filter(pk=sold.pk).update(end_time=timezone.now() - timedelta(hours=1))
+        unsold = self.make_listing(title="Unsold")
+        url = reverse("admin:auctions_listings_changelist")
+        #a selection made on the "open" filter, which closing makes untrue
+        self.client.post(url + "?active_status__exact=1", {"action": "close_auctions", "_selected_action": [sold.pk, unsold.pk]})
+        sold.refresh_from_db()
+        self.assertEqual((sold.active_status, sold.winner), (False, self.bidder))
+        stats_row = CategoryStats.objects.get(pk=self.category.pk)
+        self.assertEqual((stats_row.active_count, stats_row.closed_count, stats_row.sold_count), (0, 2, 1))
+        self.assertEqual(OutboxEvent.objects.filter(kind=OutboxEvent.WON).count(), 1)
+
+        before = timezone.now()
+        response = self.client.post(url, {"action": "relist_auctions", "_selected_action": [sold.pk, unsold.pk]}, follow=True)
+        self.assertContains(response, "Relisted 2 auction(s).")
+        sold.refresh_from_db()
+        self.assertEqual((sold.active_status, sold.winner, sold.closed_at, sold.current_price), (True, None, None, Decimal("20.00")))
+        self.assertGreater(sold.end_time, before + timedelta(days=6))
+        self.assertGreaterEqual(sold.updated_at, before)
+        self.assertIsNone(Listings.objects.get(pk=unsold.pk).end_time)
+        stats_row = CategoryStats.objects.get(pk=self.category.pk)
+        self.assertEqual((stats_row.active_count, stats_row.closed_count, stats_row.sold_count, stats_row.sold_value), (2, 0, 0, 0))
+        #the winner isn't told about an auction that is back on
+        self.assertFalse(OutboxEvent.objects.filter(kind=OutboxEvent.WON).exists())
+        #and bidding carries on from the last bid
+        with self.assertRaises(BidRejected):
+            place_bid(sold.id, self.rival, Decimal("20.00"))
+        place_bid(sold.id, self.rival, Decimal("21.00"))
+
+    def test_change_forms(self):
+        self.add_listings(1)
+        listing = Listings.objects.get()
+        for url in (
+            reverse("admin:auctions_listings_change", args=[listing.pk]),
+            reverse("admin:auctions_user_change", args=[self.bidder.pk]),
+            reverse("admin:auctions_bids_change", args=[Bids.objects.get().pk]),
+            reverse("admin:autocomplete") + "?app_label=auctions&model_name=listings&field_name=category&term=Bo",
+        ):
+            self.assertEqual(self.client.get(url).status_code, 200, url)
+
+
+class ConcurrentBidStressTests(TransactionTestCase):
+
+    THREADS = 16
+    BIDS_PER_THREAD = 125
+
+    def test_concurrent_bids_leave_exactly_one_winner(self):
+        category = Category.objects.create(name="Books")
+        seller = User.objects.create_user("seller", "seller@example.com", "password")
+        bidders = [User.objects.create_user(f"bidder{i}", f"bidder{i}@example.com", "password") for i in range(self.THREADS)]
+        listing = Listings.objects.create(
+            title="Hot item", category=category, item_detail="Details", starting_bid=Decimal("1.00"), listed_by=seller,
+        )
+        accepted, errors = [], []
+        barrier = threading.Barrier(self.THREADS)
+
+        def bid_loop(bidder, seed):
+            rng = random.Random(seed)
+            barrier.wait()
+            try:
+                for _ in range(self.BIDS_PER_THREAD):
+                    amount = Decimal(rng.randint(200, 500000)) / 100
+                    try:
+                        accepted.append(place_bid(listing.id, bidder, amount, retries=50))
+                    except BidRejected:
+                        pass
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=bid_loop, args=(bidder, i)) for i, bidder in enumerate(bidders)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        listing.refresh_from_db()
+        bids = list(Bids.objects.filter(listing=listing).order_by("id"))
+        amounts = [bid.bid_amount for bid in bids]
+        self.assertGreater(len(bids), 1)
+        self.assertEqual(len(bids), len(accepted))
+        self.assertEqual(listing.bid_count, len(bids))
+        #every accepted bid beat the one before it, so the top bid is unique
+        self.assertEqual(amounts, sorted(set(amounts)))
+        self.assertEqual(listing.top_bid, bids[-1])
+        self.assertEqual(listing.current_price, bids[-1].bid_amount)
+        self.assertEqual(Bids.objects.filter(listing=listing, bid_amount=listing.current_price).count(), 1)
+
+
+class DatabaseConfigTests(TestCase):
+
+    def test_profiles(self):
+        databases, pragmas = database_config("/srv", {})
+        self.assertEqual(databases["default"]["NAME"], "/srv/db.sqlite3")
+        self.assertEqual(databases["default"]["CONN_MAX_AGE"], 600)
+        self.assertEqual(pragmas["journal_mode"], "WAL")
+        #without a separate replica file, the replica alias is a second connection to the primary
+        self.assertEqual(databases["replica"]["NAME"], "/srv/db.sqlite3")
+        databases, pragmas = database_config("/srv", {"AUCTIONS_DB_REPLICA_PATH": "/srv/replica.sqlite3"})
+        self.assertEqual(databases["replica"]["NAME"], "/srv/replica.sqlite3")
+        databases, pragmas = database_config("/srv", {"AUCTIONS_DB_PROFILE": "default", "AUCTIONS_DB_HEALTH_CHECKS": "0"})
+        self.assertEqual((databases["default"]["CONN_MAX_AGE"], databases["default"]["CONN_HEALTH_CHECKS"]), (0, False))
+        self.assertEqual((databases["default"]["OPTIONS"], pragmas), ({}, {}))
+        with self.assertRaises(ValueError):
+            database_config("/srv", {"AUCTIONS_DB_PROFILE": "fast"})
+
+    @skipUnless(connection.vendor == "sqlite", "pragmas are SQLite's")
+    @override_settings(AUCTIONS_SQLITE_PRAGMAS={"busy_timeout": 1234, "temp_store": "MEMORY"})
+    def test_pragmas_run_on_new_connections(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA busy_timeout")
+            original = cursor.fetchone()[0]
+            #the test database's connection outlives this test, so its timeout is put back afterwards
+            self.addCleanup(connection.cursor().execute, f"PRAGMA busy_timeout = {original}")
+            tune_sqlite_connection(sender=None, connection=connection)
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], 1234)
+            cursor.execute("PRAGMA temp_store")
+            self.assertEqual(cursor.fetchone()[0], 2)
+
+
+@override_settings(AUCTIONS_READ_REPLICA="replica")
+class ReadReplicaTests(TransactionTestCase):
+    #the replica is a second SQLite file, brought up to date by sync_replica like a lagging replica would be
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Books")
+        self.seller = User.objects.create_user("seller", "seller@example.com", "password")
+        self.listing = Listings.objects.create(
+            title="Clock", category=category, item_detail="Details", starting_bid=Decimal("1.00"), listed_by=self.seller,
+        )
+        self.make_listing = lambda title: Listings.objects.create(
+            title=title, category=category, item_detail="Details", starting_bid=Decimal("1.00"), listed_by=self.seller,
+        )
+        sync_replica()
+
+    def test_browsing_reads_the_replica(self):
+        self.make_listing("Fresh vase")
+        self.assertNotContains(self.client.get(reverse("index")), "Fresh vase")
+        call_command("sync_replica", stdout=StringIO())
+        self.assertContains(self.client.get(reverse("index")), "Fresh vase")
+
+    def test_writers_read_their_own_writes(self):
+        self.client.force_login(self.seller)
+        url = reverse("individual_listing", args=[self.listing.id])
+        response = self.client.post(reverse("add_comment", args=[self.listing.id]), {"comment": "Still ticking"})
+        self.assertEqual(response.cookies[PRIMARY_COOKIE]["max-age"], 10)
+        self.assertContains(self.client.get(url), "Still ticking")
+        #once the marker has expired, the user is back on the (not yet synced) replica
+        del self.client.cookies[PRIMARY_COOKIE]
+        self.assertNotContains(self.client.get(url), "Still ticking")
+
+    async def test_writers_read_their_own_writes_over_asgi(self):
+        client = AsyncClient()
+        await client.aforce_login(self.seller)
+        url = reverse("individual_listing", args=[self.listing.id])
+        response = await client.post(reverse("add_comment", args=[self.listing.id]), {"comment": "Still ticking"})
+        self.assertEqual(response.cookies[PRIMARY_COOKIE]["max-age"], 10)
+        self.assertContains(await client.get(url), "Still ticking")
+        del client.cookies[PRIMARY_COOKIE]
+        self.assertNotContains(await client.get(url), "Still ticking")
+
+    def test_writes_go_to_the_primary(self):
+        with replica_reads():
+            listing = Listings.objects.get(pk=self.listing.pk)
+            self.assertEqual(listing._state.db, "replica")
+            listing.title = "Mantel clock"
+            listing.save()
+            self.assertEqual(Listings.objects.get(pk=self.listing.pk).title, "Clock")
+        self.assertEqual(Listings.objects.get(pk=self.listing.pk).title, "Mantel clock")
+
+
+class CacheTests(AuctionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        reset_cache_stats()
+
+    def test_categories_cached_until_changed(self):
+        self.client.force_login(self.bidder)
+        self.client.get(reverse("categories"))
+        with self.assertNumQueries(0):
+            self.assertEqual([c.name for c in get_categories()], ["Books"])
+        Category.objects.create(name="Art")
+        self.assertEqual([c.name for c in get_categories()], ["Art", "Books"])
+        self.assertEqual(cache_stats()["categories:miss"], 2)
+
+    def test_listing_fragment_invalidated_on_save(self):
+        listing = self.make_listing(title="Lamp")
+        listing = Listings.objects.select_related("category", "listed_by").get(pk=listing.pk)
+        self.assertIn("Details", get_listing_fragment(listing))
+        listing.item_detail = "A brass lamp"
+        listing.save()
+        self.assertIn("A brass lamp", get_listing_fragment(listing))
+        self.assertEqual(cache_stats()["listing_fragment:miss"], 2)
+
+    def test_listing_fragment_invalidated_on_category_rename(self):
+        listing = self.make_listing(title="Lamp")
+        url = reverse("individual_listing", args=[listing.pk])
+        self.assertContains(self.client.get(url), "Category: Books")
+        self.category.name = "Rare books"
+        self.category.save()
+        self.assertContains(self.client.get(url), "Category: Rare books")
+
+    def test_watchlist_count_invalidated_by_m2m_changes(self):
+        listing = self.make_listing()
+        self.assertEqual(self.bidder.watchlist_item_count, 0)
+        self.bidder.watchlist.add(listing)
+        self.assertEqual(self.bidder.watchlist_item_count, 1)
+        listing.watchlist.clear()
+        self.assertEqual(self.bidder.watchlist_item_count, 0)
+        with self.assertNumQueries(0):
+            self.bidder.watchlist_item_count
+
+
+class WatchlistBadgeTests(AuctionTestCase):
+
+    def render_for(self, user, template):
+        request = RequestFactory().get("/")
+        request.user = user
+        return Template(template).render(RequestContext(request))
+
+    def test_badge_not_computed_when_not_shown(self):
+        with self.assertNumQueries(0):
+            self.render_for(self.bidder, "{{ user.username }}")
+
+    def test_badge_is_per_user(self):
+        self.bidder.watchlist.add(self.make_listing())
+        self.assertEqual(self.render_for(self.bidder, "{{ watchlist_item_count }}"), "1")
+        self.assertEqual(self.render_for(self.seller, "{{ watchlist_item_count }}"), "0")
+
+    def test_badge_cost_independent_of_table_size(self):
+        costs = []
+        for size in (5, 200):
+            others = User.objects.bulk_create([User(username=f"watcher{size}-{i}") for i in range(size)])
+            listing = self.make_listing()
+            listing.watchlist.add(*others)
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.render_for(self.bidder, "{{ watchlist_item_count }}{{ watchlist_item_count }}")
+            with CaptureQueriesContext(connection) as cached_queries:
+                self.render_for(self.bidder, "{{ watchlist_item_count }}")
+            costs.append((len(queries), len(cached_queries)))
+        self.assertEqual(costs, [(1, 0), (1, 0)])
+
+
+class QueryProfilerTests(AuctionTestCase):
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse("index"))
+        self.assertRegex(response["Server-Timing"], r'^db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, total;dur=[\d.]+$')
+        #the page's version stamp, then the listings
+        self.assertEqual(response.query_profile.query_count, 2)
+        self.assertGreater(response.query_profile.template_time, 0)
+
+    async def test_profiles_requests_served_over_asgi(self):
+        #the async path counts the statements the view's worker thread ran, not the event loop's
+        response = await AsyncClient().get(reverse("index"))
+        self.assertIn('desc="2 queries"', response["Server-Timing"])
+        self.assertEqual(response.query_profile.query_count, 2)
+        self.assertGreater(response.query_profile.template_time, 0)
+
+    async def test_concurrent_requests_keep_their_own_profiles(self):
+        client = AsyncClient()
+        responses = await asyncio.gather(*(client.get(reverse("index")) for _ in range(5)))
+        self.assertEqual([response.query_profile.query_count for response in responses], [2] * 5)
+
+    def test_fingerprint_groups_repeated_statements(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id = 3 AND name = 'x'"),
+            fingerprint("SELECT  *  FROM t WHERE id = 4 AND name = 'y'"),
+        )
+        self.assertEqual(fingerprint("SELECT * FROM t WHERE id IN (%s, %s, %s)"), "SELECT * FROM t WHERE id IN (...)")
+
+    def test_n_plus_one_reported(self):
+        profile = RequestProfile()
+        for listing_id in range(5):
+            profile.queries.append((fingerprint(f"SELECT * FROM auctions_bids WHERE listing_id = {listing_id}"), 0.001))
+        self.assertEqual(profile.duplicates(), {"SELECT * FROM auctions_bids WHERE listing_id = ?": 5})
+
+
+class SeedAuctionsTests(TestCase):
+
+    def test_seeded_categories_show_up_at_once(self):
+        cache.clear()
+        self.assertEqual(get_categories(), [])
+        call_command("seed_auctions", users=2, listings=0, stdout=StringIO())
+        self.assertEqual(len(get_categories()), 16)
+
+    def test_seed_builds_consistent_bid_state(self):
+        call_command("seed_auctions", users=10, listings=50, batch_size=20, stdout=StringIO())
+        self.assertEqual(Listings.objects.count(), 50)
+        self.assertEqual(Category.objects.count(), 16)
+        for listing in Listings.objects.select_related("top_bid"):
+            bids = listing.bids.order_by("id")
+            self.assertEqual(listing.bid_count, bids.count())
+            self.assertEqual(listing.top_bid, bids.last())
+            self.assertEqual(listing.current_price, max(bid.bid_amount for bid in bids))
+            self.assertEqual(listing.comment_count, listing.comments.count())
+            if not listing.active_status:
+                self.assertEqual(listing.winner_id, listing.top_bid.bidder_id)
+
+
+class ExportImportTests(TestCase):
+
+    def setUp(self):
+        call_command("seed_auctions", users=5, listings=30, batch_size=10, stdout=StringIO())
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def snapshot(self):
+        return {
+            "listings": list(Listings.objects.order_by("pk").values_list(
+                "pk", "title", "category__name", "listed_by__username", "winner__username",
+                "current_price", "top_bid", "bid_count", "creation_time", "active_status",
+            )),
+            "bids": list(Bids.objects.order_by("pk").values_list("pk", "listing", "bid_amount", "bidder__username", "timestamp")),
+            "comments": list(Comment.objects.order_by("pk").values_list("pk", "listing", "user__username", "text", "created_at")),
+        }
+
+    def test_jsonl_round_trip_with_resume(self):
+        path = os.path.join(self.directory, "auctions.jsonl")
+        call_command("export_auctions", output=path, stderr=StringIO())
+        before = self.snapshot()
+        Listings.objects.all().delete()
+        User.objects.all().delete()
+        Category.objects.all().delete()
+
+        #pretend an earlier run committed the first 40 records before it was interrupted
+        with open(path) as export:
+            import_records(read_jsonl(islice(export, 40)), batch_size=7, checkpoint=path + ".checkpoint")
+        call_command("import_auctions", path, batch_size=7, stdout=StringIO())
+        self.assertEqual(self.snapshot(), before)
+        #running it again resumes at the end and changes nothing
+        call_command("import_auctions", path, stdout=StringIO())
+        self.assertEqual(self.snapshot(), before)
+
+    def test_rows_saved_during_an_import_get_their_own_timestamps(self):
+        path = os.path.join(self.directory, "auctions.jsonl")
+        call_command("export_auctions", output=path, stderr=StringIO())
+        Listings.objects.all().delete()
+        seller = User.objects.first()
+        category = Category.objects.first()
+        saved = []
+
+        def save_a_listing(message):
+            #another request listing an item between two chunks of the import
+            saved.append(Listings.objects.create(
+                title="Meanwhile", category=category, item_detail="Details", starting_bid=Decimal("1.00"), listed_by=seller,
+            ))
+
+        with open(path) as export:
+            import_records(read_jsonl(export), batch_size=25, log=save_a_listing)
+        self.assertTrue(saved)
+        self.assertTrue(all(listing.creation_time for listing in saved))
+
+    def test_import_stops_at_a_listing_id_taken_by_another_listing(self):
+        path = os.path.join(self.directory, "auctions.jsonl")
+        call_command("export_auctions", output=path, stderr=StringIO())
+        Listings.objects.all().delete()
+        seller = User.objects.first()
+        category = Category.objects.first()
+        #a different listing has since taken the first exported listing's id
+        with open(path) as export:
+            first = next(record for kind, record in read_jsonl(export) if kind == "listing")
+        other = Listings.objects.create(
+            id=first["id"], title="Unrelated", category=category, item_detail="Details",
+            starting_bid=Decimal("1.00"), listed_by=seller,
+        )
+        with self.assertRaisesMessage(CommandError, f"Listing {other.id} already exists"):
+            call_command("import_auctions", path, stdout=StringIO())
+        #none of the file's bids or comments ended up on it
+        other.refresh_from_db()
+        self.assertEqual((other.bids.count(), other.comments.count(), other.top_bid_id), (0, 0, None))
+
+    def test_csv_round_trip(self):
+        path = os.path.join(self.directory, "bids.csv")
+        call_command("export_auctions", output=path, format="csv", kinds=["bid"], stderr=StringIO())
+        before = self.snapshot()["bids"]
+        Bids.objects.all().delete()
+        call_command("import_auctions", path, kind="bid", stdout=StringIO())
+        self.assertEqual(self.snapshot()["bids"], before)
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN output is SQLite-specific")
+class QueryPlanTests(AuctionTestCase):
+    #every hot lookup in views.py and helpers.py must be answered from an index, not a table scan
+
+    def setUp(self):
+        super().setUp()
+        self.listing = self.make_listing()
+
+    def assertUsesIndex(self, queryset, index=None, sorted_by_index=False):
+        plan = queryset.explain()
+        if sorted_by_index:
+            #the keyset pages must come out of the index already in order, not be sorted afterwards
+            self.assertNotIn("TEMP B-TREE", plan)
+        for line in plan.splitlines():
+            #the outer table is the one a missing index would force a full SCAN of
+            if "SCAN" in line and "USING" not in line:
+                self.fail(f"table scan in query plan:\n{plan}")
+        if index:
+            self.assertIn(index, plan)
+
+    def test_active_listing_page(self):
+        page = keyset_order(Listings.objects.feed(self.bidder).filter(active_status=True))[:25]
+        self.assertUsesIndex(page, "listing_active_created_idx", sorted_by_index=True)
+
+    def test_active_listing_page_after_cursor(self):
+        cursor = encode_cursor(self.listing)
+        page = keyset_order(Listings.objects.feed(self.bidder).filter(active_status=True), cursor)[:25]
+        self.assertUsesIndex(page, "listing_active_created_idx", sorted_by_index=True)
+
+    def test_closed_listing_page(self):
+        page = keyset_order(Listings.objects.feed(self.bidder).filter(active_status=False))[:25]
+        self.assertUsesIndex(page, "listing_closed_created_idx", sorted_by_index=True)
+
+    def test_category_page(self):
+        page = keyset_order(Listings.objects.feed(self.bidder).filter(category=self.category))[:25]
+        self.assertUsesIndex(page, "listing_category_created_idx", sorted_by_index=True)
+
+    def test_won_listings(self):
+        self.assertUsesIndex(Listings.objects.filter(active_status=False, winner=self.bidder), "listing_won_idx")
+
+    def test_archived_listings(self):
+        self.assertUsesIndex(ArchivedListing.objects.order_by("-creation_time", "-id"), "archived_created_idx")
+        self.assertUsesIndex(ArchivedListing.objects.filter(winner=self.bidder).order_by("creation_time"), "archived_won_idx")
+
+    def test_bid_history(self):
+        self.assertUsesIndex(self.listing.bids.order_by("-timestamp"), "bid_listing_time_idx")
+
+    def test_comment_thread(self):
+        self.assertUsesIndex(self.listing.comments.order_by("created_at"), "comment_listing_time_idx")
+
+    def test_due_notifications(self):
+        self.assertUsesIndex(
+            OutboxEvent.objects.filter(status=OutboxEvent.PENDING, available_at__lte=timezone.now()).order_by("available_at", "id"),
+            "outbox_due_idx", sorted_by_index=True,
+        )
+
+    def test_category_by_name(self):
+        self.assertUsesIndex(Category.objects.filter(name="Books"))
+
+    def test_watchlist(self):
+        self.assertUsesIndex(self.bidder.watchlist.with_current_bid())
+        self.assertUsesIndex(self.bidder.watchlist.filter(pk=self.listing.pk, active_status=True))
+
+
+class AsyncReadViewTests(AuctionTestCase):
+    #the read views are async; drive them through the ASGI handler so any ORM access left on the event
+    #loop would raise SynchronousOnlyOperation
+
+    async def test_read_views_under_asgi(self):
+        listing = await sync_to_async(self.make_listing)(title="Async lamp")
+        await self.bidder.watchlist.aadd(listing)
+        await Comment.objects.acreate(listing=listing, user=self.bidder, text="First!")
+        client = AsyncClient()
+        await client.aforce_login(self.bidder)
+        pages = {
+            reverse("index"): "Async lamp",
+            reverse("individual_listing", args=[listing.id]): "First!",
+            reverse("categories"): "Books",
+            reverse("listings_by_category", args=[self.category.id]): "Async lamp",
+            reverse("watchlist"): "Async lamp",
+        }
+        for url, text in pages.items():
+            response = await client.get(url)
+            self.assertContains(response, text)
+
+    async def test_read_views_overlap_under_asgi(self):
+        #each request waits inside its view until the other has arrived too, which only happens if the
+        #middleware stack lets them run at the same time
+        resolve_user = views.aresolve_user
+        inside = []
+        both_inside = asyncio.Event()
+
+        async def wait_for_each_other(request):
+            inside.append(request.path)
+            if len(inside) == 2:
+                both_inside.set()
+            await asyncio.wait_for(both_inside.wait(), 3)
+            return await resolve_user(request)
+
+        client = AsyncClient()
+        with patch("auctions.views.aresolve_user", wait_for_each_other):
+            responses = await asyncio.gather(
+                client.get(reverse("index")), client.get(reverse("listings_by_category", args=[self.category.id])),
+            )
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+
+    async def test_listing_detail_watch_flag(self):
+        listing = await sync_to_async(self.make_listing)()
+        client = AsyncClient()
+        await client.aforce_login(self.bidder)
+        response = await client.get(reverse("individual_listing", args=[listing.id]))
+        self.assertFalse(response.context["watchlist_status"])
+        await self.bidder.watchlist.aadd(listing)
+        response = await client.get(reverse("individual_listing", args=[listing.id]))
+        self.assertTrue(response.context["watchlist_status"])
+
+
+class ConditionalGetTests(AuctionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.listing = self.make_listing(title="Clock")
+        self.client.force_login(self.bidder)
+
+    def revalidate(self, url):
+        #fetch the page, then ask again with its ETag the way a browser would
+        etag = self.client.get(url)["ETag"]
+        return etag, lambda: self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_pages_are_not_modified(self):
+        for url in (
+            reverse("index"), reverse("categories"), reverse("individual_listing", args=[self.listing.id]),
+            reverse("listings_by_category", args=[self.category.id]),
+        ):
+            etag, again = self.revalidate(url)
+            response = again()
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response["ETag"], etag)
+
+    def test_not_modified_costs_one_lookup(self):
+        url = reverse("individual_listing", args=[self.listing.id])
+        etag, again = self.revalidate(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(again().status_code, 304)
+        #the session and the user, then the listing's version stamp by primary key
+        self.assertEqual(len(queries), 3)
+        self.assertIn("updated_at", queries[-1]["sql"])
+
+    def test_bids_comments_and_watchlist_change_the_page(self):
+        url = reverse("individual_listing", args=[self.listing.id])
+        changes = [
+            lambda: place_bid(self.listing.id, self.bidder, Decimal("20.00")),
+            lambda: self.client.post(reverse("add_comment", args=[self.listing.id]), {"comment": "Ticking?"}),
+            lambda: self.bidder.watchlist.add(self.listing),
+        ]
+        for change in changes:
+            etag, again = self.revalidate(url)
+            change()
+            response = again()
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response["ETag"], etag)
+
+    def test_index_changes_with_any_listing(self):
+        etag, again = self.revalidate(reverse("index"))
+        other = self.make_listing(title="Vase")
+        self.assertEqual(again().status_code, 200)
+        etag, again = self.revalidate(reverse("index"))
+        close_listings([other.id])
+        self.assertEqual(again().status_code, 200)
+
+    def test_deleted_and_archived_listings_change_the_lists(self):
+        other = self.make_listing(title="Vase")
+        #the remaining listing is the newest one, so the newest updated_at doesn't move when the older goes
+        self.listing.save()
+        for url in (reverse("index"), reverse("listings_by_category", args=[self.category.id])):
+            etag, again = self.revalidate(url)
+            with self.captureOnCommitCallbacks(execute=True):
+                Listings.objects.filter(pk=other.pk).delete()
+            response = again()
+            self.assertEqual(response.status_code, 200, url)
+            self.assertNotContains(response, "Vase")
+            other = self.make_listing(title="Vase")
+            self.listing.save()
+        close_listings([other.id])
+        self.listing.save()
+        etag, again = self.revalidate(reverse("index"))
+        archive_closed_listings(days=0, now=timezone.now() + timedelta(seconds=1))
+        self.assertEqual(again().status_code, 200)
+
+    def test_pages_are_per_user(self):
+        etag, again = self.revalidate(reverse("index"))
+        self.client.force_login(self.seller)
+        self.assertEqual(again().status_code, 200)
+
+
+def tiny_png():
+    #a 1x1 PNG, written out by hand so the tests don't need Pillow
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    header = struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(b"\x00\x00\x80\x80")) + chunk(b"IEND", b"")
+
+
+PNG = tiny_png()
+
+
+def png_bytes(width, height):
+    from PIL import Image
+    buffer = BytesIO()
+    Image.new("RGB", (width, height), "teal").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class ListingImageTests(AuctionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        override = override_settings(MEDIA_ROOT=media, AUCTIONS_THUMBNAIL_WORKERS=0)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.client.force_login(self.seller)
+
+    def create(self, photo, title="Vase"):
+        #thumbnails are scheduled once the listing is committed
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse("create_listing"), {
+                "title": title, "category": "Books", "description": "Blue", "starting_bid": "5.00", "photo_url": "",
+                "photo": SimpleUploadedFile("photo.png", photo),
+            })
+
+    def test_upload_is_stored_by_content_hash(self):
+        self.create(PNG)
+        self.create(PNG, title="Second vase")
+        first, second = Listings.objects.order_by("id").values_list("image", flat=True)
+        #the same bytes are stored once, under a name that changes only with them
+        self.assertEqual(first, second)
+        self.assertRegex(first, r"^listings/[0-9a-f]{24}\.png$")
+        #served locally: the original, or its thumbnails once Pillow has made them
+        self.assertContains(self.client.get(reverse("index")), 'src="/media/listings/', count=2)
+
+    def test_non_images_are_rejected(self):
+        response = self.create(b"<html>not a photo</html>")
+        self.assertRedirects(response, reverse("create_listing"), fetch_redirect_response=False)
+        self.assertFalse(Listings.objects.exists())
+        self.assertContains(self.client.get(reverse("create_listing")), "Upload a JPEG, PNG, GIF or WebP image.")
+
+    def test_thumbnails_are_served_as_srcset(self):
+        listing = self.make_listing(photo_url="https://example.com/photo.jpg")
+        #a listing without a local copy still hot-links its photo
+        self.assertContains(self.client.get(reverse("index")), 'src="https://example.com/photo.jpg"')
+        Listings.objects.filter(pk=listing.pk).update(thumbnails={
+            "160": "listings/thumbs/a-160w.jpg", "640": "listings/thumbs/a-640w.jpg", "320": "listings/thumbs/a-320w.jpg",
+        })
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, 'src="/media/listings/thumbs/a-320w.jpg"')
+        self.assertContains(
+            response,
+            'srcset="/media/listings/thumbs/a-160w.jpg 160w, /media/listings/thumbs/a-320w.jpg 320w, '
+            '/media/listings/thumbs/a-640w.jpg 640w"',
+        )
+        self.assertNotContains(response, "example.com")
+
+    def test_media_is_cached_for_good(self):
+        name = images.ingest(PNG)
+        response = self.client.get(f"/media/{name}")
+        self.assertEqual(b"".join(response.streaming_content), PNG)
+        self.assertIn("max-age=31536000", response["Cache-Control"])
+        self.assertIn("immutable", response["Cache-Control"])
+
+    def test_backfill_downloads_photo_urls(self):
+        good = self.make_listing(photo_url="https://example.com/good.png")
+        bad = self.make_listing(photo_url="https://example.com/gone.png")
+        local = self.make_listing()
+
+        def download(url, timeout):
+            if "gone" in url:
+                raise OSError("404")
+            return PNG
+
+        #just the downloads, with or without Pillow
+        with patch.object(images, "download", download), patch.object(images, "Image", None):
+            counts = images.backfill_images(batch_size=1)
+        self.assertEqual((counts["downloaded"], counts["failed"]), (1, 1))
+        self.assertEqual(
+            dict(Listings.objects.values_list("pk", "image")),
+            {good.pk: images.ingest(PNG), bad.pk: "", local.pk: ""},
+        )
+
+    @skipUnless(images.thumbnails_enabled(), "thumbnails need Pillow")
+    def test_thumbnails_are_made_up_to_the_image_width(self):
+        rendered = images.render_thumbnails(png_bytes(400, 200), [160, 320, 640])
+        self.assertEqual(sorted(rendered), [160, 320, 400])
+        self.create(png_bytes(200, 100))
+        listing = Listings.objects.get()
+        self.assertEqual(sorted(listing.thumbnails, key=int), ["160", "200"])
+        self.assertRegex(listing.thumbnails["160"], r"^listings/thumbs/[0-9a-f]{24}-160w\.jpg$")
+
+    @skipUnless(images.thumbnails_enabled(), "thumbnails need Pillow")
+    def test_backfill_makes_missing_thumbnails(self):
+        listing = self.make_listing(image=images.ingest(png_bytes(300, 300)))
+        call_command("backfill_listing_images", "--no-download", "--workers=1", stdout=StringIO())
+        listing.refresh_from_db()
+        self.assertEqual(sorted(listing.thumbnails, key=int), ["160", "300"])
+
+
+class PostRedirectGetTests(AuctionTestCase):
+    #every POST commits its write and redirects; these are the statements each write costs on its own
+
+    def setUp(self):
+        super().setUp()
+        self.listing = self.make_listing(title="Clock")
+        self.client.force_login(self.bidder)
+
+    def assertRedirectedWrite(self, url, data, queries, target=None):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.post(url, data)
+        target = target or reverse("individual_listing", args=[self.listing.id])
+        self.assertRedirects(response, target, fetch_redirect_response=False)
+        #savepoints are the test case's transaction wrapping, not the view's work
+        self.assertEqual(len([query for query in captured if "SAVEPOINT" not in query["sql"]]), queries, url)
+
+    def test_each_post_redirects(self):
+        listing_id = self.listing.id
+        self.assertRedirectedWrite(reverse("add_bid", args=[listing_id]), {"bid_amount": "20.00"}, 9)
+        self.assertRedirectedWrite(reverse("add_bid", args=[listing_id]), {"bid_amount": "15.00"}, 3)
+        self.assertRedirectedWrite(reverse("add_proxy_bid", args=[listing_id]), {"max_amount": "30.00"}, 6)
+        self.assertRedirectedWrite(reverse("add_comment", args=[listing_id]), {"comment": "Ticking?"}, 4)
+        self.assertRedirectedWrite(reverse("add_to_watchlist", args=[listing_id]), {}, 6, reverse("index"))
+        self.assertRedirectedWrite(reverse("remove_from_watchlist", args=[listing_id]), {}, 5, reverse("index"))
+        self.assertRedirectedWrite(reverse("create_listing"), {
+            "title": "Vase", "category": "Books", "description": "Blue", "starting_bid": "5.00", "photo_url": "",
+        }, 7, reverse("index"))
+        self.client.force_login(self.seller)
+        self.assertRedirectedWrite(reverse("close_auction", args=[listing_id]), {}, 8)
+        self.client.logout()
+        self.assertRedirectedWrite(reverse("login"), {"username": "bidder", "password": "password"}, 5, reverse("index"))
+
+    def test_outcome_is_flashed_once(self):
+        url = reverse("individual_listing", args=[self.listing.id])
+        etag = self.client.get(url)["ETag"]
+        self.client.post(reverse("add_bid", args=[self.listing.id]), {"bid_amount": "5.00"})
+        #the page carrying the message is rendered even for a client holding a copy, and has no ETag
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, "Bid amount must be greater than the current bid of:  $10.00")
+        self.assertNotIn("ETag", response)
+        #the rejected bid changed nothing, so once the message has been shown the old copy is current again
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+@override_settings(AUCTIONS_COMMENTS_PAGE_SIZE=5)
+class CommentThreadTests(AuctionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.listing = self.make_listing()
+        self.client.force_login(self.bidder)
+
+    def add_comments(self, count):
+        start = Comment.objects.count()
+        Comment.objects.bulk_create([
+            Comment(listing=self.listing, user=self.bidder, text=f"Comment {start + i}") for i in range(count)
+        ])
+        Listings.objects.filter(pk=self.listing.pk).update(comment_count=start + count)
+
+    def test_pages_run_newest_first_and_cover_the_thread_once(self):
+        self.add_comments(12)
+        response = self.client.get(reverse("individual_listing", args=[self.listing.id]))
+        seen = [comment.text for comment in response.context["comments"]]
+        cursor = response.context["next_comments"]
+        while cursor:
+            response = self.client.get(reverse("listing_comments", args=[self.listing.id]), {"cursor": cursor})
+            seen += [comment.text for comment in response.context["comments"]]
+            cursor = response.context["next_comments"]
+        self.assertEqual(seen, [f"Comment {i}" for i in reversed(range(12))])
+        self.assertContains(response, "Comment 0 <small>&mdash; bidder")
+
+    def test_listing_page_cost_is_independent_of_thread_length(self):
+        url = reverse("individual_listing", args=[self.listing.id])
+        self.add_comments(3)
+        cache.clear()
+        with CaptureQueriesContext(connection) as few:
+            self.assertContains(self.client.get(url), "3 comment(s)")
+        self.add_comments(300)
+        cache.clear()
+        with CaptureQueriesContext(connection) as many:
+            self.assertContains(self.client.get(url), "303 comment(s)")
+        self.assertEqual(len(many), len(few))
+
+    def test_add_comment_counts_it(self):
+        self.client.post(reverse("add_comment", args=[self.listing.id]), {"comment": "Ticking?"})
+        self.listing.refresh_from_db()
+        self.assertEqual(self.listing.comment_count, 1)
+        comment = Comment.objects.select_related("user").get()
+        with self.assertNumQueries(0):
+            self.assertEqual(str(comment), f"Comment by bidder on listing {self.listing.id}")
+
+    def test_comment_and_count_commit_together(self):
+        with patch.object(Listings.objects, "filter", side_effect=DatabaseError("disk I/O error")):
+            with self.assertRaises(DatabaseError):
+                self.client.post(reverse("add_comment", args=[self.listing.id]), {"comment": "Ticking?"})
+        self.assertFalse(Comment.objects.exists())
+
+
+class LiveBidEventTests(AuctionTestCase):
+
+    async def test_slow_watcher_keeps_only_the_newest_events(self):
+        broker = Broker(queue_size=2)
+        subscription = broker.subscribe(1)
+        for price in ("11.00", "12.00", "13.00"):
+            broker.publish(1, {"price": price})
+        await asyncio.sleep(0)
+        self.assertEqual([(await subscription.get())["price"] for _ in range(2)], ["12.00", "13.00"])
+        broker.unsubscribe(subscription)
+        self.assertEqual(broker.subscriber_count(1), 0)
+
+    async def test_bid_is_published_after_commit(self):
+        listing = await sync_to_async(self.make_listing)()
+        subscription = events.broker.subscribe(listing.id)
+        try:
+            def bid():
+                with self.captureOnCommitCallbacks(execute=True):
+                    place_bid(listing.id, self.bidder, Decimal("15.00"))
+            await sync_to_async(bid)()
+            event = await subscription.get(timeout=1)
+        finally:
+            events.broker.unsubscribe(subscription)
+        self.assertEqual(event, {"listing": listing.id, "price": "15.00", "bidder": "bidder", "bid_count": 1})
+
+    async def test_event_stream_sends_state_then_bids(self):
+        listing = await sync_to_async(self.make_listing)()
+        response = await AsyncClient().get(reverse("listing_events", args=[listing.id]))
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = aiter(response.streaming_content)
+        first = await anext(stream)
+        self.assertIn('"bid_count": 0', first.decode())
+        events.broker.publish(listing.id, events.bid_event(listing.id, Decimal("20.00"), "bidder", 1))
+        second = await asyncio.wait_for(anext(stream), 1)
+        self.assertEqual(json.loads(second.decode()[len("data: "):]), {
+            "listing": listing.id, "price": "20.00", "bidder": "bidder", "bid_count": 1,
+        })
+
+    async def test_closed_stream_unsubscribes(self):
+        stream = events.event_stream(1, {"bid_count": 0})
+        await anext(stream)
+        self.assertEqual(events.broker.subscriber_count(1), 1)
+        await stream.aclose()
+        self.assertEqual(events.broker.subscriber_count(1), 0)
+
+    @override_settings(AUCTIONS_LONG_POLL_TIMEOUT=0.01)
+    def test_long_poll(self):
+        listing = self.make_listing()
+        url = reverse("listing_poll", args=[listing.id])
+        #a client that is behind gets the current state straight away, one that is up to date times out
+        self.assertEqual(self.client.get(url, {"since": -1}).json()["bid_count"], 0)
+        self.assertEqual(self.client.get(url, {"since": 0}).status_code, 204)
+        #the stream itself is only served over ASGI
+        self.assertEqual(self.client.get(reverse("listing_events", args=[listing.id])).status_code, 204)
+
+    @override_settings(AUCTIONS_LONG_POLL_TIMEOUT=3)
+    async def test_pending_long_poll_doesnt_hold_up_other_requests(self):
+        listing = await sync_to_async(self.make_listing)()
+        client = AsyncClient()
+        poll = asyncio.ensure_future(client.get(reverse("listing_poll", args=[listing.id]), {"since": 0}))
+        while not events.broker.subscriber_count(listing.id):
+            await asyncio.sleep(0.01)
+        #the index is served while the poll waits on the event loop, not after it has timed out
+        response = await client.get(reverse("index"))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(poll.done())
+        event = bid_event(listing.id, Decimal("12.00"), "bidder", 1)
+        events.broker.publish(listing.id, event)
+        self.assertEqual((await poll).json(), event)
+
+    @override_settings(AUCTIONS_LONG_POLL_TIMEOUT=5)
+    def test_long_poll_sees_a_bid_published_while_reading_the_state(self):
+        listing = self.make_listing()
+        event = bid_event(listing.id, Decimal("12.00"), "bidder", 1)
+
+        async def state_read_as_a_bid_lands(listing_id):
+            #the state is read before the bid commits, and the bid's event goes out right after
+            state = await aget_bid_state(listing_id)
+            events.broker.publish(listing_id, event)
+            return state
+
+        with patch("auctions.views.aget_bid_state", state_read_as_a_bid_lands):
+            response = self.client.get(reverse("listing_poll", args=[listing.id]), {"since": 0})
+        self.assertEqual(response.json(), event)
+
+
+@skipUnless(connection.vendor == "sqlite", "the full-text index is SQLite's FTS5")
+class SearchTests(AuctionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.lamp = self.make_listing(title="Brass lamp", item_detail="A heavy desk lamp")
+        self.shade = self.make_listing(title="Lampshade", item_detail="Fits most lamps")
+        self.chair = self.make_listing(title="Oak chair", item_detail="Goes well with a lamp", starting_bid="80.00")
+
+    def search(self, text, **filters):
+        page, next_cursor, window = search_page(Listings.objects.feed(self.bidder), text, **filters)
+        return [listing.title for listing in page]
+
+    def test_prefix_matches_ranked_by_title_first(self):
+        self.assertEqual(self.search("lamp")[-1], "Oak chair")
+        self.assertEqual(set(self.search("lamp")), {"Brass lamp", "Lampshade", "Oak chair"})
+        self.assertEqual(self.search("bra LAM"), ["Brass lamp"])
+
+    def test_filters(self):
+        self.assertEqual(self.search("lamp", min_price=Decimal("50")), ["Oak chair"])
+        self.assertEqual(set(self.search("lamp", max_price=Decimal("50"), category=self.category)), {"Brass lamp", "Lampshade"})
+        Listings.objects.filter(pk=self.chair.pk).update(active_status=False)
+        self.assertNotIn("Oak chair", self.search("lamp"))
+        self.assertIn("Oak chair", self.search("lamp", active=None))
+
+    @override_settings(AUCTIONS_SEARCH_CANDIDATES=10)
+    def test_filters_apply_before_the_candidate_window(self):
+        #one older match that passes the filters behind more newer ones than the window holds
+        art = Category.objects.create(name="Art")
+        Listings.objects.filter(pk=self.lamp.pk).update(category=art)
+        for i in range(20):
+            self.make_listing(title=f"Lamp {i}", active_status=False)
+        Listings.objects.filter(pk__in=[self.shade.pk, self.chair.pk]).update(active_status=False)
+        self.assertEqual(self.search("lamp"), ["Brass lamp"])
+        self.assertEqual(self.search("lamp", category=art, active=None), ["Brass lamp"])
+        self.assertEqual(len(self.search("lamp", active=None)), 10)
+
+    @override_settings(AUCTIONS_SEARCH_CANDIDATES=3)
+    def test_search_says_when_older_matches_are_left_unranked(self):
+        url = reverse("search")
+        #three matches fit the window, so they are all ranked and nothing is said
+        self.assertIsNone(search_page(Listings.objects.all(), "lamp")[2])
+        self.assertNotContains(self.client.get(url, {"q": "lamp"}), "newest")
+        #with a fourth, the oldest (the best match, by its title) falls outside it
+        self.make_listing(title="Table", item_detail="Lamp not included")
+        page, next_cursor, window = search_page(Listings.objects.all(), "lamp")
+        self.assertEqual(window, 3)
+        self.assertNotIn(self.lamp, page)
+        response = self.client.get(url, {"q": "lamp"})
+        self.assertContains(response, "these are the best of the 3 newest")
+        #a narrower search is ranked in full again
+        self.assertEqual(self.search("brass lamp"), ["Brass lamp"])
+
+    def test_index_follows_edits_and_deletes(self):
+        Listings.objects.filter(pk=self.lamp.pk).update(title="Copper kettle")
+        self.assertEqual(self.search("kettle"), ["Copper kettle"])
+        self.shade.delete()
+        self.assertEqual(self.search("lampshade"), [])
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(self.search("kettle"), ["Copper kettle"])
+
+    def test_operators_in_input_are_plain_words(self):
+        self.assertEqual(self.search('lamp" OR NEAR(*'), [])
+        self.assertEqual(self.search(""), [])
+
+    def test_keyset_pages_cover_every_match_once(self):
+        seen, cursor = [], None
+        while True:
+            page, cursor, window = search_page(Listings.objects.all(), "lamp", cursor=cursor, page_size=2)
+            seen += [listing.pk for listing in page]
+            if not cursor:
+                break
+        self.assertEqual(sorted(seen), sorted([self.lamp.pk, self.shade.pk, self.chair.pk]))
+
+    def test_icontains_fallback_finds_the_same_listings(self):
+        page, next_cursor = icontains_page(Listings.objects.feed(self.bidder), search_terms("lamp"))
+        self.assertEqual({listing.title for listing in page}, set(self.search("lamp")))
+
+    def test_search_view(self):
+        response = self.client.get(reverse("search"), {"q": "brass", "min_price": "oops"})
+        self.assertContains(response, "Brass lamp")
+        self.assertNotContains(response, "Oak chair")
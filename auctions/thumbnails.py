@@ -0,0 +1,68 @@
+from io import BytesIO
+
+#this module runs in the thumbnail pool's worker processes, so it imports nothing from Django: plain
+#bytes go in and out, and a worker never needs settings, models or a database connection
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    #optional: without Pillow listing images are still stored and served locally, just never resized
+    Image = ImageOps = None
+
+#the first bytes of each image format we accept, and the extension it is stored under
+SIGNATURES = [
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+]
+
+JPEG_QUALITY = 82
+
+
+def image_extension(data):
+    #sniffed from the file's contents rather than trusting its name or the browser's content type
+    for signature, extension in SIGNATURES:
+        if data.startswith(signature):
+            return extension
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def readable(data):
+    #whether Pillow can make sense of the file, so a corrupt upload is turned away rather than failing later
+    #in the pool. Without Pillow the signature check in image_extension is all there is
+    if Image is None:
+        return True
+    try:
+        Image.open(BytesIO(data)).verify()
+    except Exception:
+        return False
+    return True
+
+
+def render_thumbnails(data, widths):
+    #{width: JPEG bytes} for each width in widths (ascending) up to the image's own - never upscaled, so a
+    #small image gets fewer sizes. The keys are the widths the thumbnails actually came out at
+    image = Image.open(BytesIO(data))
+    #photos from phones are often stored sideways with an orientation tag; browsers honour the tag on the
+    #original, so the thumbnails must be turned the same way
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+        #JPEG has no transparency: flatten onto white, which is what the page shows behind it anyway
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    elif image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    rendered = {}
+    for width in widths:
+        thumbnail = image.copy()
+        thumbnail.thumbnail((width, image.height))
+        buffer = BytesIO()
+        thumbnail.save(buffer, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+        rendered[thumbnail.width] = buffer.getvalue()
+        if width >= image.width:
+            break
+    return rendered
@@ -0,0 +1,305 @@
+import csv
+import json
+import os
+from datetime import datetime
+from decimal import Decimal
+from itertools import groupby
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Case, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .cache import invalidate_categories
+from .models import Bids, Category, Comment, Listings, User
+from .stats import rebuild_category_stats
+
+#what gets exported for each record type, in import order: every type only refers to types before it.
+#Users and categories are referred to by their natural keys (username, name) so they can be matched up
+#with rows that already exist in the target database; listings, bids and comments keep their ids.
+#A listing's top bid can only be set once its bids exist, so it travels as a separate "top_bid" type
+EXPORTS = {
+    "category": (Category.objects.all(), {"name": "name"}),
+    "user": (User.objects.all(), {"username": "username", "email": "email", "date_joined": "date_joined"}),
+    "listing": (Listings.objects.all(), {
+        "id": "id",
+        "title": "title",
+        "category": "category__name",
+        "item_detail": "item_detail",
+        "starting_bid": "starting_bid",
+        "photo_url": "photo_url",
+        "listed_by": "listed_by__username",
+        "creation_time": "creation_time",
+        "active_status": "active_status",
+        "winner": "winner__username",
+        "current_price": "current_price",
+        "bid_count": "bid_count",
+        "comment_count": "comment_count",
+        "end_time": "end_time",
+        "closed_at": "closed_at",
+    }),
+    "bid": (Bids.objects.all(), {
+        "id": "id", "listing": "listing_id", "bid_amount": "bid_amount",
+        "bidder": "bidder__username", "timestamp": "timestamp",
+    }),
+    "comment": (Comment.objects.all(), {
+        "id": "id", "listing": "listing_id", "user": "user__username", "text": "text", "created_at": "created_at",
+    }),
+    "top_bid": (Listings.objects.filter(top_bid__isnull=False), {"listing": "id", "top_bid": "top_bid_id"}),
+}
+
+#how text read back from a file turns into field values; anything not listed stays a string
+DECIMALS = {"starting_bid", "current_price", "bid_amount"}
+DATETIMES = {"date_joined", "creation_time", "end_time", "closed_at", "timestamp", "created_at"}
+INTEGERS = {"id", "listing", "bid_count", "comment_count", "top_bid"}
+BOOLEANS = {"active_status"}
+#text fields where an empty CSV cell is an empty string rather than a missing value
+TEXTS = {"title", "item_detail", "photo_url", "email", "text"}
+
+#the fields that tell a row already imported (a chunk replayed after a crash) from a different row that
+#happens to have the same id in the target database
+IDENTITIES = {
+    Listings: ("title", "listed_by_id", "creation_time"),
+    Bids: ("listing_id", "bidder_id", "bid_amount", "timestamp"),
+    Comment: ("listing_id", "user_id", "created_at"),
+}
+
+
+class ImportConflict(Exception):
+    #raised when a record's id is already taken by a different row in the target database
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+class ExportEncoder(DjangoJSONEncoder):
+    #DjangoJSONEncoder rounds datetimes to milliseconds; an export has to keep every microsecond
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def export_rows(kind, chunk_size=2000):
+    #stream one record type as dicts straight from a server-side iterator, in primary key order
+    queryset, fields = EXPORTS[kind]
+    rows = queryset.order_by("pk").values_list(*fields.values()).iterator(chunk_size=chunk_size)
+    for row in rows:
+        yield dict(zip(fields, row))
+
+
+def write_jsonl(stream, kinds, chunk_size=2000):
+    #one JSON object per line, each tagged with its type. Nothing but the current chunk is held in memory
+    written = 0
+    for kind in kinds:
+        for row in export_rows(kind, chunk_size):
+            stream.write(json.dumps({"type": kind, **row}, cls=ExportEncoder) + "\n")
+            written += 1
+    return written
+
+
+def write_csv(stream, kind, chunk_size=2000):
+    #a CSV file holds a single record type, with a header row; None is written as an empty cell
+    writer = csv.DictWriter(stream, fieldnames=list(EXPORTS[kind][1]))
+    writer.writeheader()
+    written = 0
+    for row in export_rows(kind, chunk_size):
+        writer.writerow({key: "" if value is None else value for key, value in row.items()})
+        written += 1
+    return written
+
+
+def parse_value(field, value):
+    if value is None or (value == "" and field not in TEXTS):
+        return None
+    if field in DECIMALS:
+        return Decimal(str(value))
+    if field in DATETIMES:
+        return parse_datetime(value)
+    if field in INTEGERS:
+        return int(value)
+    if field in BOOLEANS:
+        return value if isinstance(value, bool) else value in ("True", "true", "1")
+    return value
+
+
+def read_jsonl(stream):
+    for line in stream:
+        if line.strip():
+            record = json.loads(line)
+            yield record.pop("type"), record
+
+
+def read_csv(stream, kind):
+    for row in csv.DictReader(stream):
+        yield kind, row
+
+
+class Importer:
+    #turns records into rows, a chunk at a time. Users and categories are looked up by natural key and
+    #created when missing; the lookups are remembered, as there are far fewer of them than bids
+
+    def __init__(self):
+        self.user_ids = {}
+        self.category_ids = {}
+
+    def insert(self, kind, model, rows):
+        #listings, bids and comments keep their exported ids, which the records after them refer to. A row
+        #whose id is already there is skipped if it is the same row, so replaying a chunk is harmless; if
+        #it is a different one, the bids, comments and top bids that follow would be attached to it, so
+        #the import stops instead
+        fields = IDENTITIES[model]
+        existing = {
+            pk: tuple(values)
+            for pk, *values in model.objects.filter(pk__in=[row.pk for row in rows]).values_list("pk", *fields)
+        }
+        for row in rows:
+            if row.pk in existing and existing[row.pk] != tuple(getattr(row, field) for field in fields):
+                raise ImportConflict(
+                    f"{kind.capitalize()} {row.pk} already exists in this database as a "
+                    "different row; import into an empty database, or one this file was exported from."
+                )
+        rows = [row for row in rows if row.pk not in existing]
+        #bulk_create stamps auto_now_add fields with the current time; the rows' own times are written back
+        #over them afterwards. The fields themselves are left alone, as other threads save through them too
+        stamps = [field.attname for field in model._meta.fields if getattr(field, "auto_now_add", False)]
+        kept = [[getattr(row, name) for name in stamps] for row in rows]
+        model.objects.bulk_create(rows)
+        for row, values in zip(rows, kept):
+            for name, value in zip(stamps, values):
+                if value is not None:
+                    setattr(row, name, value)
+        model.objects.bulk_update(rows, stamps)
+
+    def resolve_users(self, usernames):
+        missing = {name for name in usernames if name and name not in self.user_ids}
+        if missing:
+            found = dict(User.objects.filter(username__in=missing).values_list("username", "pk"))
+            #a user only seen as a seller or bidder is created without a usable password
+            User.objects.bulk_create(
+                [User(username=name, password="!") for name in missing - found.keys()], ignore_conflicts=True,
+            )
+            if missing - found.keys():
+                found = dict(User.objects.filter(username__in=missing).values_list("username", "pk"))
+            self.user_ids.update(found)
+
+    def resolve_categories(self, names):
+        missing = {name for name in names if name not in self.category_ids}
+        if missing:
+            Category.objects.bulk_create([Category(name=name) for name in missing], ignore_conflicts=True)
+            self.category_ids.update(Category.objects.filter(name__in=missing).values_list("name", "pk"))
+            invalidate_categories()
+
+    def load(self, kind, records):
+        #insert one chunk of records of a single type. Users and categories that already exist are matched
+        #by name; listings, bids and comments go through insert()
+        records = [{field: parse_value(field, value) for field, value in record.items()} for record in records]
+        if kind == "category":
+            self.resolve_categories(record["name"] for record in records)
+        elif kind == "user":
+            User.objects.bulk_create([
+                User(
+                    username=record["username"], email=record.get("email") or "",
+                    date_joined=record.get("date_joined") or timezone.now(), password="!",
+                )
+                for record in records
+            ], ignore_conflicts=True)
+        elif kind == "listing":
+            self.resolve_categories(record["category"] for record in records)
+            self.resolve_users([record["listed_by"] for record in records] + [record["winner"] for record in records])
+            self.insert(kind, Listings, [
+                Listings(
+                    **{field: record[field] for field in (
+                        "id", "title", "item_detail", "starting_bid", "photo_url", "creation_time", "active_status",
+                        "current_price", "bid_count", "end_time", "closed_at",
+                    )},
+                    #files exported before listings counted their comments recount them with backfill_listing_bids
+                    comment_count=record.get("comment_count") or 0,
+                    category_id=self.category_ids[record["category"]],
+                    listed_by_id=self.user_ids[record["listed_by"]],
+                    winner_id=self.user_ids.get(record["winner"]),
+                )
+                for record in records
+            ])
+        elif kind == "bid":
+            self.resolve_users(record["bidder"] for record in records)
+            self.insert(kind, Bids, [
+                Bids(
+                    id=record["id"], listing_id=record["listing"], bid_amount=record["bid_amount"],
+                    bidder_id=self.user_ids[record["bidder"]], timestamp=record["timestamp"],
+                )
+                for record in records
+            ])
+        elif kind == "comment":
+            self.resolve_users(record["user"] for record in records)
+            self.insert(kind, Comment, [
+                Comment(
+                    id=record["id"], listing_id=record["listing"], user_id=self.user_ids[record["user"]],
+                    text=record["text"], created_at=record["created_at"],
+                )
+                for record in records
+            ])
+        elif kind == "top_bid":
+            #one UPDATE per chunk, with a CASE picking each listing's top bid
+            Listings.objects.filter(pk__in=[record["listing"] for record in records]).update(top_bid_id=Case(
+                *[When(pk=record["listing"], then=record["top_bid"]) for record in records]
+            ), updated_at=timezone.now())
+        else:
+            raise ValueError(f"Unknown record type {kind!r}.")
+
+
+def read_checkpoint(path):
+    try:
+        with open(path) as checkpoint:
+            return json.load(checkpoint)["records"]
+    except FileNotFoundError:
+        return 0
+
+
+def write_checkpoint(path, records):
+    #written to a temporary file and renamed over the old one, so a crash never leaves half a checkpoint
+    with open(path + ".tmp", "w") as checkpoint:
+        json.dump({"records": records}, checkpoint)
+    os.replace(path + ".tmp", path)
+
+
+def import_records(records, batch_size=1000, checkpoint=None, log=None):
+    #load (type, record) pairs in chunks of batch_size, each chunk in its own transaction. With a
+    #checkpoint file, the number of records committed so far is saved after every chunk and a rerun
+    #skips that many records, so an interrupted import picks up where it stopped
+    log = log or (lambda message: None)
+    done = read_checkpoint(checkpoint) if checkpoint else 0
+    if done:
+        log(f"resuming after {done} records")
+    importer = Importer()
+    position = 0
+    for kind, group in groupby(records, key=lambda pair: pair[0]):
+        chunk = []
+        for _, record in group:
+            position += 1
+            if position <= done:
+                continue
+            chunk.append(record)
+            if len(chunk) == batch_size:
+                done = commit_chunk(importer, kind, chunk, position, checkpoint, log)
+                chunk = []
+        if chunk:
+            done = commit_chunk(importer, kind, chunk, position, checkpoint, log)
+    #rows were inserted with their own ids, so databases with id sequences must be told to skip past them
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [Listings, Bids, Comment]):
+            cursor.execute(sql)
+    #and bulk_create skips the signals that keep the category stats up to date
+    rebuild_category_stats()
+    return position
+
+
+def commit_chunk(importer, kind, chunk, position, checkpoint, log):
+    with transaction.atomic():
+        importer.load(kind, chunk)
+    if checkpoint:
+        write_checkpoint(checkpoint, position)
+    log(f"{position} records")
+    return position
@@ -8,14 +8,20 @@ urlpatterns = [
     path("categories/<int:category_id>/", views.listings_by_category, name = "listings_by_category"),
     path("closed_listings", views.closed_listings, name="closed_listings"),
     path("create_listing", views.create_listing, name="create_listing"),
+    path("listings/more", views.listings_page, name="listings_page"),
     path("listing/<int:listing_id>/", views.individual_listing, name = "individual_listing"),
+    path("listing/<int:listing_id>/comments/", views.listing_comments, name="listing_comments"),
+    path("listing/<int:listing_id>/events/", views.listing_events, name="listing_events"),
+    path("listing/<int:listing_id>/poll/", views.listing_poll, name="listing_poll"),
     path("listing/<int:listing_id>/add_bid/", views.add_bid, name="add_bid"),
     path("listing/<int:listing_id>/add_comment/", views.add_comment, name="add_comment"),
+    path("listing/<int:listing_id>/add_proxy_bid/", views.add_proxy_bid, name="add_proxy_bid"),
     path("listing/<int:listing_id>/add_to_watchlist/", views.add_to_watchlist, name="add_to_watchlist"),
     path("listing/<int:listing_id>/close_auction/", views.close_auction, name="close_auction"), 
     path("listing/<int:listing_id>/remove_from_watchlist/", views.remove_from_watchlist, name="remove_from_watchlist"),
     path("login", views.login_view, name="login"),
     path("logout", views.logout_view, name="logout"),
     path("register", views.register, name="register"),
+    path("search", views.search, name="search"),
     path("watchlist", views.watchlist, name="watchlist"),
 ]
@@ -1,77 +1,96 @@
+import asyncio
+import heapq
 from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
-from django.db import IntegrityError
-from django.db.models import Max
-from django.http import HttpResponse, HttpResponseRedirect
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
+from django.views.static import serve
 from django.contrib.auth.decorators import login_required
 from django.urls import reverse
-from decimal import Decimal
-from .helpers import get_listing_context, get_current_bid
-from .models import User, Listings, Category, Bids, Comment
+from django.utils.cache import patch_cache_control
+from django.utils import timezone
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from .bidding import BidRejected, place_bid, set_proxy_bid
+from .cache import get_categories, get_category
+from .closing import close_listings
+from .conditional import catalogue_version, categories_version, category_version, conditional, listing_version
+from .events import event_stream, wait_for_change
+from .helpers import (
+    acomment_page, aget_bid_state, archived_with_bids, aget_listing_context, alist, arender, arender_listing_page, aresolve_user,
+    get_current_bid, get_current_bidder, is_watching, keyset_page, listings_with_bids, record_bid,
+)
+from .images import ImageRejected, get_max_image_bytes, ingest, schedule_thumbnails
+from .models import ArchivedListing, User, Listings, Category, Bids, Comment
+from .search import search_page
+from .stats import acategory_stats
 
 
 @login_required
 def add_bid(request, listing_id): #add a bid to an active listing
-
+    #every POST view commits its write and redirects back to a page, with the outcome carried to it by
+    #the messages framework, so a POST never pays for rendering a page and a refresh never resubmits
     if request.method == "POST":
         try:
             bid_amount = Decimal(request.POST.get("bid_amount")) #fetch form data from listing.html form
-        except (TypeError, ValueError):
-            #call helper function to return a dictionary of the fields from Listings Model
-            context = get_listing_context(listing_id) 
-            #add a key of "bid_message" to the context dict 
-            context["bid_message"] = "Bid amount must be a number greater than the starting and current bids"  # Add the message to the context
-            return render(request, "auctions/listing.html", context)
-        
-        listing = Listings.objects.get(pk=listing_id) #get specific listing instance from Listings model
-        current_bid = get_current_bid(listing) #call helper to return current_bid as a decimal value
-        
-        if bid_amount <= current_bid: # check if form submitted bid_amount is less than current_bid, if so
-            context = get_listing_context(listing_id) #fetch context dict
-            #add keys of "bid_message" and "bid_value" to the context dict with appropriate values 
-            context["bid_message"] = "Bid amount must be greater than the current bid of: " 
-            context["bid_value"] = current_bid
-            return render(request, "auctions/listing.html", context)
-
-        #if submitted bid_amount is greater than current_bid, instantiate an instance of the Bids class
-        bid=Bids(listing=listing, bid_amount=bid_amount, bidder=request.user)
-        bid.save()
-        #fetch context dict again and add keys and values to the context dict
-        context = get_listing_context(listing_id)
-        context["bid_value"] = current_bid
-        context["current_bid"] = bid_amount
-        context["bid_value"] = bid_amount
-        
-        return render(request, "auctions/listing.html", context)
-                
-    return render(request, "auctions/listing.html", context)
+        except (TypeError, ValueError, InvalidOperation):
+            messages.error(request, "Bid amount must be a number greater than the starting and current bids")
+            return redirect("individual_listing", listing_id)
+
+        try:
+            #hand the bid to the bid engine, which rejects stale bids without locking and otherwise
+            #moves the price with a compare-and-set, so two bidders can never both win at one price
+            place_bid(listing_id, request.user, bid_amount)
+        except BidRejected as rejection: # bid_amount is not more than the current_bid, or the auction is closed
+            messages.error(request, f"{rejection.message} ${rejection.current_bid}")
+        else:
+            #a proxy bid may already have answered this one, so the page shows the price as it now stands
+            messages.success(request, f"Your bid of ${bid_amount} has been placed.")
+
+    return redirect("individual_listing", listing_id)
+
 
 @login_required
 def add_comment(request, listing_id): #to add a comment to an individual listing
     if request.method == "POST":
-        listing = Listings.objects.get(id=listing_id) #fetch the listing instance
         comment = (request.POST.get("comment")) #fetch the form data called "comment"
         #instantiate an instance of the Comment class
-        comment = Comment(listing=listing, user=request.user, text=comment)
-        comment.save()
-
-        current_bid = get_current_bid(listing) #call helper to retrieve current_bid as a value
-
-        context = get_listing_context(listing_id) #call helper to fetch context dict then add keys:values
-        #specifically, use listing.comments to use foreign key to access comments for the given listing
-        #then use .all on listing.comments to get all of the comments for that listing
-        context['comments'] = listing.comments.all() 
-        context['current_bid'] = current_bid
-        #specifically watchlist is a ManytoMany field in the User model connecting User and Listings 
-        # models, where one User can have many listings on their watchlist, and any Listing can be on 
-        # many User's watchlist But instead of accessing the watchlist field of the User model, the User
-        # model also has a decorator that returns watchlist_item_count as an attribute. So 
-        # request.user.watchlist_item_count is the product of a decorator leaning on the manytomany
-        # field called watchlist in the user model - linking the user and Listings models 
-        context['watchlist_item_count'] = request.user.watchlist_item_count
-
-        return render(request, "auctions/listing.html", context)
+        comment = Comment(listing_id=listing_id, user=request.user, text=comment)
+        #the comment and the count go in together, like a bid and record_bid, so the count can't drift
+        with transaction.atomic():
+            comment.save()
+            #count it on the listing, and move the listing's version stamp (and with it the page's ETag) on
+            Listings.objects.filter(pk=listing_id).update(comment_count=F("comment_count") + 1, updated_at=timezone.now())
+
+    #back to the listing, where the new comment shows up with the rest
+    return redirect("individual_listing", listing_id)
+
+
+@login_required
+def add_proxy_bid(request, listing_id): #bid automatically on the user's behalf, up to a maximum
+    if request.method != "POST":
+        return HttpResponse("Invalid request.")
+    try:
+        max_amount = Decimal(request.POST.get("max_amount"))
+    except (TypeError, ValueError, InvalidOperation):
+        messages.error(request, "Your maximum must be a number greater than the current bid")
+        return redirect("individual_listing", listing_id)
+    try:
+        #store the maximum and let the bid engine answer the other proxies on the listing right away
+        set_proxy_bid(listing_id, request.user, max_amount)
+    except BidRejected as rejection:
+        messages.error(request, f"{rejection.message} ${rejection.current_bid}")
+    else:
+        messages.success(request, f"We'll bid for you up to ${max_amount}.")
+    return redirect("individual_listing", listing_id)
+
 
 @login_required
 def add_to_watchlist(request, listing_id):
@@ -87,133 +106,78 @@ def add_to_watchlist(request, listing_id):
             #table and listings table, django is automatically making a join table called user_watchlist
             #that's storing all the listings that a user added at least once to their watchlist (via the
             #Add to Watchlist button on listings.html).  Even if a user removed a listing from their
-            #watchlist, it will still show in the user_watchlist join table.  So .all method applied to 
-            #the join table will use the manytomany to head to the listings table and pull all listings
-            #for that user that have been added to their watchlist.  And right below that, after we've
+            #watchlist, it will still show in the user_watchlist join table.  So .filter(pk=...).exists()
+            #applied to the join table asks the database whether just this one listing is on the user's
+            #watchlist, without pulling every listing they've ever added.  And right below that, after we've
             #checked that a listing in not in that join table, we'll add it to that join table with
             #the .add method applied to the watchlist related manager.  .add must take an instance as 
             #a parameter, so listing is that passed parameter to be added to the join table. remembering
             #that watchlist is a related manager SPECIFIC to the one authenticated user only
-            if listing not in request.user.watchlist.all():
+            if not request.user.watchlist.filter(pk=listing.pk).exists():
                 request.user.watchlist.add(listing)
-            #if the listing is in the join table, we'll use the property decorator (in the User model
-            # to directly access the watchlist_item_count attribute, which is the number of listings in 
-            # the user_watchlist join table Django makes behind the scenes.  So it's a count of listings
-            # in the join table for just this user where the listing has been added at one point or 
-            # another to their watchlist.  Note that the property decorator method watchlist_item_count
-            # is just using the .count() method of the watchlist related manager to do the counting in 
-            # the user_watchlist join table!!  
-            watchlist_item_count = request.user.watchlist_item_count
-            #now filter ALL users for active listings by the True filter and keep them unique
-            active_listings = Listings.objects.filter(active_status=True).distinct()
-            # initialize an empty list
-            listings_with_bids = []
-            #loop through queryset of listing instances
-            for listing in active_listings:
-                #return most current_bid value for each listing with helper function
-                current_bid = get_current_bid(listing)
-                #set bid_value to that current_bid value
-                bid_value = current_bid if current_bid else None
-                #for each iteration, adding a dict with 3 key:value pairs to the list
-                listings_with_bids.append({
-                    "listing": listing,
-                    "current_bid": current_bid if current_bid else None,
-                    "bid_value": bid_value,
-                })
-            #rendering to the template a value, list and instance, respectively
-            return render(request, "auctions/index.html", {
-                'watchlist_item_count': watchlist_item_count,
-                "listings_with_bids": listings_with_bids,
-                "active_listings": active_listings,
-            })
+            #the watchlist badge count isn't computed here - the watchlist_item_count context processor
+            #looks up this user's cached count only if the page the user lands on actually shows the badge
+            messages.success(request, f"{listing.title} is on your watchlist.")
+            return redirect("index")
         
         except Listings.DoesNotExist:
             raise Http404("Listing not found.")
     else:
         return HttpResponse("Invalid request.")
     
-def categories(request): # simple get request to render a queryset of all instances of Category table
-    return render(request, "auctions/categories.html", {"categories": Category.objects.all()})
+@conditional(categories_version)
+async def categories(request): # simple get request to render all instances of Category table
+    #categories almost never change, so they come from the cache rather than a query per request; their
+    #market stats come from the rollup table in one query, shared with the page's version check
+    await aresolve_user(request)
+    stats = await acategory_stats(request)
+    categories = [(category, stats.get(category.id)) for category in await sync_to_async(get_categories)()]
+    return await arender(request, "auctions/categories.html", {"categories": categories})
 
 @login_required
 def close_auction(request, listing_id): # if the listing shown was listed by the authenticated user
     #the user can close the auction with a button
     if request.method == "POST":
-        #get the correct Listings instance using the form data id
-        listing = Listings.objects.get(pk=listing_id)
+        #close the listing the same way the expiry sweep does: the winner is taken from the listing's
+        #top_bid foreign key, which is kept pointing at the winning bid row, so there is no lookup by
+        #bid_amount (which could match several bids). Closing an already closed listing changes nothing
+        close_listings([listing_id])
+        #get the correct Listings instance using the form data id, now closed and with its winner
+        listing = Listings.objects.select_related("winner").get(pk=listing_id)
         #get current bid from the helper function
         current_bid = get_current_bid(listing)
-        #fetch the current bidder by querying the Bids table, filtering on the listing and bid_amount
-        #fields (columns) of the table to get just the one bid instance for this user with the most recent
-        #bid and access the .bidder field to get an instance for that user since user and bids models 
-        # are linked with a one to many field. Note: if the bidder field were just a normal field, .bidder
-        #would return a value (string, integer, datetime). but the bidder field is a foreign key field
-        #so it will head over to the user model and return a complete instance
-        current_bidder = Bids.objects.get(listing=listing, bid_amount=current_bid).bidder
-        #access the winner field of the fetched listing instnace and set to current_bidder
-        listing.winner = current_bidder
-        #toggle active_status field of the listing instance to False and save it. 
-        listing.active_status = False
-        listing.save()
-        #complex use of request.user.watchlist.all to access all the listings in the user_watchlist
-        #join table for just his user and check if this particular listing instance is in that queryset
-        if listing in request.user.watchlist.all():
-            #if if is, remove the listing from the join table. Note that this is not the same as "removing"
-            #from the watchlist!  This is removing the entry from the join table
-            request.user.watchlist.remove(listing)
-            request.user.save()
+        #Note: the winner field is a foreign key field so it will return a complete user instance
+        current_bidder = listing.winner
+        #a closed listing has no reason to stay on the user's watchlist. .remove() on the related manager
+        #deletes the row from the user_watchlist join table, and does nothing if it isn't there
+        request.user.watchlist.remove(listing)
         #bc request.user retrieves an instance from the user model, and current_bidder is already an 
         #instance from the user model.... 
         if request.user == current_bidder:
-            #context rendered will be a formatted string, instance, value, and value respectively, with
-            #that last value bc current_bidder is an instance of the user table, but .username accesses 
-            #the string field (Charfield) of the actual name of the user from the instance
-            return render(request, "auctions/listing.html", {
-                "auction_message":f"Congratulations { current_bidder.username }, you won this auction!!",
-                "listing": listing,
-                "current_bid": current_bid,
-                "bidder":current_bidder.username,
-            })
-        
+            messages.success(request, f"Congratulations { current_bidder.username }, you won this auction!!")
+        elif current_bidder:
+            #.username accesses the string field (Charfield) of the actual name of the user from the instance
+            messages.success(request, f"This Auction is Closed!!! {current_bidder.username} wins the auction with a bid of ${current_bid}")
         else:
-            return render(request, "auctions/listing.html", {
-                "auction_message":"This Auction is Closed!!!",
-                "bidder":current_bidder.username,
-                "current_bid":current_bid,
-                "listing": listing,
-            })
+            messages.success(request, "This Auction is Closed!!!")
+
+    return redirect("individual_listing", listing_id)
 
 @login_required
 def closed_listings(request): #to render only closed listings upon get request from layout.html header link
-    #get a filtered and unique queryset from listings table
-    closed_listings = Listings.objects.filter(active_status=False).distinct()
-    #initiate an empty list
-    closed_listings_with_bids = []
-    #filter down even further on the returned query set to pull just the closed listings that the
-    #authentic user won.  Again, filtering on request.user, which has to be an instance of the user table
-    # equal to winner, which is a field in the listing table, but bc it's a foreign key to the user table
-    #winner will be an instance of the user table.  If winner.username, then we'd get the name of winner
-    won_listings = closed_listings.filter(winner=request.user) if request.user.is_authenticated else []
-    #loop through the closed_listings queryset
-    for listing in closed_listings:
-        #fetch current bid for each listing iteration with helper function
-        current_bid = get_current_bid(listing)
-        if current_bid:
-            #get the current_bidder instance from the user table via the Bids table via the bidder
-            #foreign key field in the Bids table and filter to get just the instance that matches
-            #the iterated listing and where the bid_amount field in the Bids table is a decimal
-            #value and current_bid is a value returned with the helper function
-            current_bidder = Bids.objects.get(listing=listing, bid_amount=current_bid).bidder
-        else:
-            current_bidder = None
-        #to the list, append a dict for each iteration with an instance, value and instance,
-        #respectively
-        closed_listings_with_bids.append({
-            "listing": listing,
-            "current_bid": current_bid if current_bid else None,
-            "current_bidder": current_bidder,
-        })
-    #render a list and queryset, respectively
+    #get a filtered queryset from listings table, with price and top bidder joined in (one query)
+    closed_listings = Listings.objects.feed(request.user).filter(active_status=False).order_by("-creation_time", "-id")
+    #and the listings that have since been archived, with their winner (a second query)
+    archived_listings = ArchivedListing.objects.select_related("winner").order_by("-creation_time", "-id")
+    #build the rows the template loops over, both newest first, so merging them keeps them that way
+    closed_listings_with_bids = list(heapq.merge(
+        listings_with_bids(closed_listings), archived_with_bids(archived_listings),
+        key=lambda row: (row["listing"].creation_time, row["listing"].pk), reverse=True,
+    ))
+    #narrow down to just the closed listings that the authentic user won.  winner_id is a plain column
+    #on each row, so this is done in Python on the rows we already have instead of a second query
+    won_listings = [row["listing"] for row in closed_listings_with_bids if row["listing"].winner_id == request.user.id]
+    #render a list and list, respectively
     return render(request, "auctions/index.html", {
         "closed_listings_with_bids": closed_listings_with_bids,
         "won_listings": won_listings,
@@ -229,15 +193,27 @@ def create_listing(request): #to make a new listing via a link in layout.html he
         #convert starting_bid to a decimal bc all form data is in string form
         starting_bid = Decimal(request.POST.get("starting_bid"))
         photo_url = request.POST.get("photo_url")
+        #an uploaded photo is checked and stored under a name hashed from its contents; it is shown
+        #instead of photo_url, and its thumbnails are made in the background once the listing exists
+        image = ""
+        if request.FILES.get("photo"):
+            try:
+                image = ingest(request.FILES["photo"].read(get_max_image_bytes() + 1))
+            except ImageRejected as rejection:
+                messages.error(request, rejection.message)
+                return redirect("create_listing")
+        #an optional auction length in days; without one the auction runs until its owner closes it
+        duration = request.POST.get("duration", "")
+        end_time = timezone.now() + timedelta(days=int(duration)) if duration.isdigit() else None
         #form data is coming in with either a value of "Other" or a name of the category selected from
         #a drop-down menu in the template.  Since it's a dropdown, we're dealing in incoming "values"
         if category == "Other":
             #if "Other" is the selected incoming value from dropdown, a textarea will deliver a name 
             # attribute called "other_category" containing the text we need in string form
             other_category = request.POST.get("other_category")
-            #filter on the name field of the category table equaling the string value of other_category
-            #and retrieve the correct instance from the Category table based on name
-            category_instance = Category.objects.create(name=other_category)
+            #look up the category whose name field equals the string value of other_category, creating
+            #it if it doesn't exist yet - names are unique, so an existing category is reused, not duplicated
+            category_instance, _ = Category.objects.get_or_create(name=other_category)
 
         else:
             #do the same if the incoming string value is the name of the category (bc the template form
@@ -257,104 +233,151 @@ def create_listing(request): #to make a new listing via a link in layout.html he
             item_detail=description, 
             starting_bid=starting_bid,
             photo_url=photo_url,
+            image=image,
             listed_by=request.user,
+            end_time=end_time,
             )
         
-        listing.save()
-        #instantiate an instance of the Bids table with .create  listing field needs an instance, since
-        #it's a foreign key to the listing table. and bidder must be an instance, since it's a foreign
-        #key to the user table.  timestamp is the 4th field of Bids, but Django will autopopulate 
-        Bids.objects.create(
-            listing=listing,
-            bid_amount=starting_bid,
-            bidder=request.user,  # The user creating the listing is the starting bidder
-        )
-        #pull a queryset from Listings of only active listings
-        listings = Listings.objects.filter(active_status=True)
-        #initiate an empty list
-        listings_with_bids = []
-        #loop through each instance in the queryset
-        for listing in listings:
-            #get current_bid for each instance from the helper
-            current_bid = get_current_bid(listing)
-            #append a dict to the list for each row with 2 keys an instance and a value, respectively
-            listings_with_bids.append({
-                "listing": listing,
-                "current_bid": current_bid if current_bid else None,
-            })
-
-        return render(request, "auctions/index.html", {
-            "listings_with_bids": listings_with_bids,
-        })
+        with transaction.atomic():
+            listing.save()
+            #instantiate an instance of the Bids table with .create  listing field needs an instance, since
+            #it's a foreign key to the listing table. and bidder must be an instance, since it's a foreign
+            #key to the user table.  timestamp is the 4th field of Bids, but Django will autopopulate 
+            bid = Bids.objects.create(
+                listing=listing,
+                bid_amount=starting_bid,
+                bidder=request.user,  # The user creating the listing is the starting bidder
+            )
+            #the starting bid becomes the listing's current price and top bid
+            record_bid(listing, bid)
+            if image:
+                transaction.on_commit(lambda: schedule_thumbnails(listing.pk, image))
+        #the new listing is at the top of the index, newest first
+        messages.success(request, f"{listing.title} is now listed.")
+        return redirect("index")
     
-    return render(request, "auctions/create_listing.html", {"categories": Category.objects.all()})
-
-def index(request): #to show the user's "home page" - with both active and closed listings
-    #fetch unique and filtered instances from listings table
-    active_listings = Listings.objects.filter(active_status=True).distinct()
-
-    listings_with_bids = []
-    #loop through each instance in the queryset
-    for listing in active_listings:
-        #get value of current_bid from helper
-        current_bid = get_current_bid(listing)
-        #set bid_value to current_bid
-        bid_value = current_bid if current_bid else None
-        #for each iteration, add dict of instance, value, value, respectively, to the list 
-        listings_with_bids.append({
-            "listing":listing,
-            "current_bid":current_bid if current_bid else None,
-            "bid_value":bid_value,
-        })
-
-    #render to the template a list and an instance
-    return render(request, "auctions/index.html", {
-        "listings_with_bids": listings_with_bids,
+    return render(request, "auctions/create_listing.html", {"categories": get_categories()})
+
+#the page only changes when some listing does, so a browser that already has it gets a 304 instead
+@conditional(catalogue_version)
+async def index(request): #to show the user's "home page" - with both active and closed listings
+    #async view: the user, the listings and the render are awaited, so a slow read doesn't hold a worker
+    user = await aresolve_user(request)
+    #fetch filtered instances from listings table, with the current bid, top bidder and the user's
+    #watchlist flag annotated onto every row by a single query
+    active_listings = Listings.objects.feed(user).filter(active_status=True)
+
+    #render one page of the queryset (newest first, starting after ?cursor=) or stream all of it
+    return await arender_listing_page(request, "auctions/index.html", {
         "active_listings": active_listings,
-    })
-
-def individual_listing(request, listing_id): #to show an individual listing from index.html hyperlink
-    #fetch correct instance
-    listing = Listings.objects.get(pk=listing_id)  
+    }, active_listings)
+
+@conditional(listing_version)
+async def individual_listing(request, listing_id): #to show an individual listing from index.html hyperlink
+    user = await aresolve_user(request)
+    #the listing, whether it's on the user's watchlist and its comments are independent reads, so they're
+    #awaited together with asyncio.gather instead of one after another
+    context, watchlist_status, (comments, next_comments) = await asyncio.gather(
+        #fetch context as dict with helper function, which also fetches the listing instance
+        aget_listing_context(listing_id),
+        #here, user.watchlist.filter(pk=..., active_status=True) will have the related manager "watchlist"
+        #apply the .filter method to the listings table and check the user's join table for just this
+        #listing where active_status is true in the Listings table.  It will evaluate to False if the
+        #listing is not BOTH in the join table and active_status is True in the Listing table.  In
+        #listing.html will be a conditional "if watchlist_status" that will check if the Bool is true
+        is_watching(user, listing_id),
+        #and the newest page of the listing's comments (or the page after ?comments=, for "load more"
+        #without JavaScript), each with its user joined in. The rest of the thread is fetched a page at a
+        #time from listing_comments, so a thread of any length costs the same to show
+        acomment_page(listing_id, request.GET.get("comments")),
+    )
+    listing = context["listing"]
     #get current_bid value from helper  
     current_bid = get_current_bid(listing)
-    #fetch current_bidder as an instance
-    if current_bid:
-        current_bidder = Bids.objects.get(listing=listing, bid_amount=current_bid).bidder
-    else:
-        current_bidder = None
-    #fetch context as dict with helper function
-    context = get_listing_context(listing_id)
+    #fetch current_bidder as an instance through the listing's top bid
+    current_bidder = get_current_bidder(listing)
     #add 5 keys to the dict for value, instance, value, bool, and queryset, respectively
     context['current_bid'] = current_bid
     context['current_bidder'] = current_bidder
-    #watchlist_item_count will be a value here as the @property decorator functions as an attribute
-    context['watchlist_item_count'] = request.user.watchlist_item_count
-    #here, request.user.watchlist.filter(active_status=True) will have the related manager "watchlist"
-    #apply the .filter method to the listings table and pull only the user's listings from the join table
-    #where active_status is true in the Listings table, then listing in is a Bool test that will 
-    #evaluate to true if the listing in question is both in the join user_watchlist table and active_status
-    #is True in listings table.context value "listing in request.user.watchlist.filter(active_status=True)"
-    #will evaluate to False if the listing is not BOTH in the join table and active_status is True in 
-    #the Listing table.  In listing.html will be a conditional "if watchlist_status" that will check
-    #if the rendered Bool is true or fals.
-    context['watchlist_status'] = listing in request.user.watchlist.filter(active_status=True)
-    #and a queryset here of all instances of the comments table for this listing, via a foreign key field
-    #in the comments table referencing this specific listing
-    context['comments'] = listing.comments.all()
-
-    return render(request, "auctions/listing.html", context)
-
-def listings_by_category(request, category_id): #from a hyperlink click on a category, return listings
-    #fetch the correct instance from Category table
-    category = Category.objects.get(id=category_id)
+    context['watchlist_status'] = watchlist_status
+    context['comments'] = comments
+    context['next_comments'] = next_comments
+
+    return await arender(request, "auctions/listing.html", context)
+
+async def listing_comments(request, listing_id): #the next page of a listing's comments, as an html fragment
+    await aresolve_user(request)
+    comments, next_comments = await acomment_page(listing_id, request.GET.get("cursor"))
+    return await arender(request, "auctions/comment_rows.html", {
+        "listing": {"id": listing_id},
+        "comments": comments,
+        "next_comments": next_comments,
+    })
+
+async def listing_events(request, listing_id): #a live feed of bids on a listing, as Server-Sent Events
+    #the stream holds its connection open on the event loop, which only works when served over ASGI - under
+    #WSGI it would pin a worker thread forever. A 204 tells EventSource not to reconnect, and the page's
+    #script falls back to long polling instead
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    try:
+        state = await aget_bid_state(listing_id)
+    except Listings.DoesNotExist:
+        raise Http404("Listing not found.")
+    response = StreamingHttpResponse(event_stream(listing_id, state), content_type="text/event-stream")
+    #stop caches and buffering proxies from holding events back
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+async def listing_poll(request, listing_id): #the long-poll fallback for listing_events
+    #?since= is the bid count the page already shows: answer straight away if there have been more bids
+    #since, otherwise wait for the next one (or a timeout, answered with 204 so the client asks again)
+    try:
+        since = int(request.GET.get("since", -1))
+    except ValueError:
+        since = -1
+    try:
+        event = await wait_for_change(
+            listing_id, aget_bid_state, since, getattr(settings, "AUCTIONS_LONG_POLL_TIMEOUT", 25),
+        )
+    except Listings.DoesNotExist:
+        raise Http404("Listing not found.")
+    if event is None:
+        return HttpResponse(status=204)
+    return JsonResponse(event)
+
+@conditional(category_version)
+async def listings_by_category(request, category_id): #from a hyperlink click on a category, return listings
+    user = await aresolve_user(request)
+    #fetch the correct instance from the cached categories
+    category = await sync_to_async(get_category)(category_id)
+    if category is None:
+        raise Http404("Category not found.")
     #return a queryset of all instances of listings that have this specific category - note that the
     # category field of the Listings table is a foreign key linking to the category table 
-    listings = category.listings.all()
+    listings = Listings.objects.feed(user).filter(category=category)
+
+    #render one keyset page of the category (or stream it) instead of every listing at once
+    return await arender_listing_page(request, "auctions/listings_by_category.html", {
+        "category": category,
+        "stats": await acategory_stats(request, category_id),
+    }, listings)
+
+def listings_page(request): #the next page of rows for infinite scroll, as an html fragment
+    #with ?category= this continues a category page, otherwise the index page of active listings
+    category_id = request.GET.get("category", "")
+    category = get_category(int(category_id)) if category_id.isdigit() else None
+    if category:
+        listings = Listings.objects.feed(request.user).filter(category=category)
+    else:
+        listings = Listings.objects.feed(request.user).filter(active_status=True)
+    page, next_cursor = keyset_page(listings, request.GET.get("cursor"))
 
-    return render(request,"auctions/listings_by_category.html", {
+    return render(request, "auctions/listing_rows.html", {
+        "listings_with_bids": listings_with_bids(page),
+        "next_cursor": next_cursor,
         "category": category,
-        "listings": listings
     })
 
 def login_view(request):
@@ -372,69 +395,8 @@ def login_view(request):
             #request object (from browser's http request and it will return a session 
             # (dict like structure) for this user
             login(request, user)
-            #fetch querysets of instances of active and closed listings filtering on active_status
-            active_listings = Listings.objects.filter(active_status=True).distinct()
-            closed_listings = Listings.objects.filter(active_status=False).distinct()
-            #filter to an even tighter query set on whether the winner instance equals the request.user
-            #instance - note that django made the request.user instance by first storing the user's session
-            #as a dictlike structure with a key of id, then each incoming request, django's middleware retrieves
-            #the id value and with that user id queries the user table to get the request.user instance
-            #from the user table
-            won_listings = closed_listings.filter(winner=request.user) if request.user.is_authenticated else []
-            listings_with_bids = []
-            closed_listings_with_bids = []
-            #loop through the active_listings q-set for each instance
-            for listing in active_listings:
-                #use helper to get current_bid of this listing as a value
-                current_bid = get_current_bid(listing)
-                #fetch current_bidder as an instance of the user table, looking for the instance with this 
-                #specific listing and the current_bid is the bid_amount field value.  using .get 
-                #here bc we expect only 1 instance returned.  .filter would be used if we were expecting
-                #a q-set of instances
-                current_bidder = ( 
-                    Bids.objects.get(listing=listing, bid_amount=current_bid).bidder
-                    if current_bid else None
-                )
-                #add listing instance, and current_bid value (twice!)
-                listings_with_bids.append({
-                    "listing": listing,
-                    "current_bid": current_bid if current_bid else None,
-                    "bid_value": current_bid if current_bid and current_bidder == user else None,
-                })
-            #loop through the closed_listings q-set for each instance
-            for listing in closed_listings:
-                current_bid = get_current_bid(listing)
-                current_bidder = (
-                Bids.objects.get(listing=listing, bid_amount=current_bid).bidder
-                if current_bid else None
-                )
-                # add to the list, including adding the current_bidder instance and only adding the 
-                #current_bid value if the current_bidder instance equals the user instance that django's
-                #authenticate method gave us (i.e. to tell us this particular user is the current 
-                #highest bidder)
-                closed_listings_with_bids.append({
-                    "listing": listing,
-                    "current_bid": current_bid if current_bid else None,
-                    "current_bidder": current_bidder,
-                    "bid_value": current_bid if current_bid and current_bidder == user else None,
-                })
-            # use the @property decorator to access the watchlist_item_count value of the request.user
-            # object, as the decorator uses the watchlist related manager to wield the .count method to
-            # count the instances in the join table.  BUT... here's where it gets very tricky... the join
-            # table includes all listings once added to the watchlist, and even those subsequently
-            # removed from the watchlist will stay in the join table.  But somehow, the watchlist related
-            # manager knows that a listing once added but since removed from the watchlist stays in the
-            # join table, but the "relationship" is "broken" and django's ORM abstracting applies a 
-            # filter like watchlist_status=True to the join table, so the line below somehow only pulls
-            # the instances from the join table where the listing is still actively on the watchlist!!!
-            watchlist_item_count = request.user.watchlist_item_count
-
-            return render(request, "auctions/index.html", {
-                "listings_with_bids": listings_with_bids,
-                "closed_listings_with_bids": closed_listings_with_bids,
-                "won_listings": won_listings,
-                "watchlist_item_count": watchlist_item_count,
-            })
+            #then off to the index, which reads through the cached and conditional path like any GET
+            return HttpResponseRedirect(reverse("index"))
         #if creds fail, send a message
         else:
             return render(request, "auctions/login.html", {
@@ -487,11 +449,12 @@ def remove_from_watchlist(request, listing_id):  # to remove a listing from a us
             listing = Listings.objects.get(id=listing_id)
 
             # again, that complex use of the request.user object having a related manager called 
-            #watchlist that can use the .all method to read the whole user_watchlist join table to see
-            #if our specific listing instance is in that table.  If it is, use the watchlist related
+            #watchlist that can use .filter(pk=...).exists() to check the user_watchlist join table for
+            #just our specific listing instance.  If it is there, use the watchlist related
             #manager to call the .remove method to remove this listing from the join table
-            if listing in request.user.watchlist.all():
+            if request.user.watchlist.filter(pk=listing.pk).exists():
                 request.user.watchlist.remove(listing)
+                messages.success(request, f"{listing.title} is no longer on your watchlist.")
 
             # Redirect to the watchlist page or the index page after the update
             return redirect('index')  # Or redirect('watchlist')
@@ -500,18 +463,60 @@ def remove_from_watchlist(request, listing_id):  # to remove a listing from a us
     else:
         return HttpResponse("Invalid request.")
 
+async def search(request): #full-text search over listing titles and descriptions, best match first
+    user = await aresolve_user(request)
+    query = request.GET.get("q", "").strip()
+    #the optional filters; anything that doesn't parse is ignored rather than an error
+    category_id = request.GET.get("category", "")
+    category = await sync_to_async(get_category)(int(category_id)) if category_id.isdigit() else None
+    prices = {}
+    for bound in ("min_price", "max_price"):
+        try:
+            prices[bound] = Decimal(request.GET[bound]) if request.GET.get(bound) else None
+        except InvalidOperation:
+            prices[bound] = None
+    #active listings only, unless closed ones are asked for too
+    active = None if request.GET.get("closed") else True
+
+    #window is set when there were too many matches to rank them all, and only the newest were
+    page, next_cursor, window = await sync_to_async(search_page)(
+        Listings.objects.feed(user), query, category=category, active=active,
+        cursor=request.GET.get("cursor"), **prices,
+    )
+    #the "next page" link keeps the search and its filters, with the new cursor
+    next_query = None
+    if next_cursor:
+        params = request.GET.copy()
+        params["cursor"] = next_cursor
+        next_query = params.urlencode()
+    return await arender(request, "auctions/search.html", {
+        "query": query,
+        "category": category,
+        "categories": await sync_to_async(get_categories)(),
+        "min_price": prices["min_price"],
+        "max_price": prices["max_price"],
+        "closed": active is None,
+        "listings_with_bids": listings_with_bids(page),
+        "next_query": next_query,
+        "window": window,
+    })
+
+def serve_media(request, path): #listing images from MEDIA_ROOT, for when no web server sits in front
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    #every stored file is named by a hash of its contents, so it never changes under its name and
+    #browsers and CDNs may keep it for good
+    patch_cache_control(response, public=True, max_age=365 * 24 * 60 * 60, immutable=True)
+    return response
+
 @login_required 
-def watchlist(request):
+async def watchlist(request):
+    user = await aresolve_user(request)
     if request.method == "GET":
         #again, the watchlist related manager will query the join table and pull all instances for this
         #user, somehow also applying a filter like watchlist_status=True to the query behind the scenes
-        #so that watchlist will be a q-set with only instances where watchlist_status=True
-        watchlist = request.user.watchlist.all()
-    #and again, how to get the count from the join table, while also filtering for watchlist_status=True
-    #with django doing that filtering behind the scenes for us!!
-    watchlist_item_count = request.user.watchlist_item_count
-
-    return render(request, "auctions/watchlist.html", {
+        #so that watchlist will be a list with only instances where watchlist_status=True
+        watchlist = await alist(user.watchlist.with_current_bid())
+    #the badge count comes from the watchlist_item_count context processor (cached per user)
+    return await arender(request, "auctions/watchlist.html", {
         "watchlist": watchlist,
-        "watchlist_item_count": watchlist_item_count,
     })
@@ -0,0 +1,76 @@
+"""
+Database configuration for the commerce project.
+
+The database is SQLite. Out of the box it runs in rollback-journal mode, and every request opens a new
+connection. That makes concurrent bidders queue behind each other's locks, and it pays the connection
+setup cost on every request. The "tuned" profile (the default) fixes both:
+
+- each connection is set up with the pragmas in SQLITE_PRAGMAS, applied by
+  auctions.signals.tune_sqlite_connection
+- connections are kept for CONN_MAX_AGE seconds, with a health check before reuse
+- transactions start with BEGIN IMMEDIATE, so a write waits its turn instead of failing halfway through
+
+Set AUCTIONS_DB_PROFILE=default for Django's stock behaviour, e.g. to benchmark against it. The
+individual settings can be overridden per environment:
+
+    AUCTIONS_DB_PATH            the database file (default: db.sqlite3 next to manage.py)
+    AUCTIONS_DB_CONN_MAX_AGE    seconds to keep a connection open, 0 to close it after every request
+    AUCTIONS_DB_HEALTH_CHECKS   "0" to reuse kept connections without checking them first
+    AUCTIONS_DB_BUSY_TIMEOUT    milliseconds to wait for another connection's write lock
+    AUCTIONS_DB_REPLICA_PATH    the "replica" alias's file, kept up to date with manage.py sync_replica
+                                (default: the primary's file, i.e. no separate copy)
+"""
+
+import os
+import tempfile
+
+import django
+
+PROFILES = ("tuned", "default")
+
+#run on every new connection, in this order
+SQLITE_PRAGMAS = {
+    #readers no longer block the writer, nor the writer readers. Stored in the database file itself
+    "journal_mode": "WAL",
+    #in WAL mode a commit only has to reach the log: a power cut can lose the last few transactions, but
+    #never corrupts the database
+    "synchronous": "NORMAL",
+    #wait this many milliseconds for another connection's lock before giving up with "database is locked"
+    "busy_timeout": 5000,
+    #read the file through a 256MB memory map instead of a read() call per page
+    "mmap_size": 256 * 1024 * 1024,
+    #a 64MB page cache per connection (negative sizes are in KiB)
+    "cache_size": -64 * 1024,
+    #temporary tables and sort spills stay in memory
+    "temp_store": "MEMORY",
+}
+
+
+def database_config(base_dir, environ=os.environ):
+    #returns (DATABASES, the pragmas to run on each new SQLite connection) for the selected profile
+    profile = environ.get("AUCTIONS_DB_PROFILE", "tuned")
+    if profile not in PROFILES:
+        raise ValueError(f"AUCTIONS_DB_PROFILE must be one of {', '.join(PROFILES)}, not {profile!r}.")
+    tuned = profile == "tuned"
+
+    default = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": environ.get("AUCTIONS_DB_PATH", os.path.join(base_dir, "db.sqlite3")),
+        "CONN_MAX_AGE": int(environ.get("AUCTIONS_DB_CONN_MAX_AGE", 600 if tuned else 0)),
+        "CONN_HEALTH_CHECKS": environ.get("AUCTIONS_DB_HEALTH_CHECKS", "1") != "0",
+        "OPTIONS": {},
+    }
+    pragmas = {}
+    if tuned:
+        pragmas = dict(SQLITE_PRAGMAS, busy_timeout=int(environ.get("AUCTIONS_DB_BUSY_TIMEOUT", SQLITE_PRAGMAS["busy_timeout"])))
+        if django.VERSION >= (5, 1):
+            #a deferred transaction that reads and then writes can't wait for the write lock: if another
+            #connection committed in between, SQLite fails it at once. Taking the lock up front means it
+            #waits (up to busy_timeout) like any other write
+            default["OPTIONS"]["transaction_mode"] = "IMMEDIATE"
+    #the read replica stand-in: a second SQLite file, configured like the primary. Its test database is a
+    #file too (unlike the in-memory default), as a replica's copy of the primary is a separate database
+    replica = dict(default, OPTIONS=dict(default["OPTIONS"]))
+    replica["NAME"] = environ.get("AUCTIONS_DB_REPLICA_PATH", default["NAME"])
+    replica["TEST"] = {"NAME": os.path.join(tempfile.gettempdir(), f"auctions-test-replica-{os.getpid()}.sqlite3")}
+    return {"default": default, "replica": replica}, pragmas
@@ -41,6 +41,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'auctions.middleware.QueryProfilerMiddleware',
+    'auctions.middleware.ReadReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -75,15 +77,123 @@ WSGI_APPLICATION = 'commerce.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
-}
+#
+# WAL mode, pragmas, persistent connections and IMMEDIATE transactions, switchable per environment with
+# AUCTIONS_DB_PROFILE and friends - see commerce/database.py. AUCTIONS_SQLITE_PRAGMAS are run on every new
+# SQLite connection (auctions/signals.py)
+
+from .database import database_config
+
+DATABASES, AUCTIONS_SQLITE_PRAGMAS = database_config(BASE_DIR)
+
+# Set AUCTIONS_READ_REPLICA to a database alias (e.g. "replica") to send the reads of GET requests to these
+# views there (auctions/replicas.py and ReadReplicaMiddleware). After any write the user reads from the
+# primary for AUCTIONS_REPLICA_STICKY_SECONDS, so they always see what they just did
+
+DATABASE_ROUTERS = ['auctions.replicas.PrimaryReplicaRouter']
+AUCTIONS_READ_REPLICA = os.environ.get('AUCTIONS_READ_REPLICA') or None
+AUCTIONS_REPLICA_STICKY_SECONDS = 10
+AUCTIONS_REPLICA_VIEWS = [
+    'index', 'categories', 'listings_by_category', 'closed_listings', 'listings_page', 'individual_listing',
+    'listing_comments', 'search', 'watchlist',
+]
 
 AUTH_USER_MODEL = 'auctions.User'
 
+# Per-request query profiling (auctions/middleware.py): query counts, N+1 suspects, DB and template
+# time in a Server-Timing header, plus one JSON log line per request on the auctions.profiler logger.
+# Set AUCTIONS_PROFILER_LOG_LEVEL=INFO to log every request; by default only N+1 suspects are logged.
+
+AUCTIONS_QUERY_PROFILER = True
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'auctions.profiler': {
+            'handlers': ['console'],
+            'level': os.environ.get('AUCTIONS_PROFILER_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+#
+# Categories, listing detail fragments and watchlist counts are cached (see auctions/cache.py).
+# The local-memory cache is per process and evicts least-recently-used entries past MAX_ENTRIES;
+# point AUCTIONS_CACHE_DIR at a directory to share a file-based cache between processes instead.
+
+if os.environ.get('AUCTIONS_CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ['AUCTIONS_CACHE_DIR'],
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'auctions',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+# Listing pages are keyset-paginated; set AUCTIONS_STREAM_LISTINGS to stream every row instead
+AUCTIONS_PAGE_SIZE = 25
+# Comment threads are shown newest first, this many comments at a time
+AUCTIONS_COMMENTS_PAGE_SIZE = 20
+AUCTIONS_STREAM_LISTINGS = False
+
+# Live bid updates: each Server-Sent Events watcher keeps at most this many undelivered events (oldest
+# dropped first); long-poll requests wait this many seconds before answering 204
+AUCTIONS_EVENT_QUEUE_SIZE = 8
+AUCTIONS_LONG_POLL_TIMEOUT = 25
+
+# Search ranks at most this many of the newest listings matching a query, which keeps broad searches
+# fast however large the catalogue grows
+AUCTIONS_SEARCH_CANDIDATES = 1000
+
+# Proxy bids outbid each other (and manual bids) by this much, up to each bidder's maximum
+AUCTIONS_BID_INCREMENT = "1.00"
+
+# Category pages show market stats kept in a rollup table (see auctions/stats.py). Run
+# manage.py rebuild_category_stats periodically to refresh the medians; the bid velocity then covers this
+# many days
+AUCTIONS_STATS_WINDOW_DAYS = 7
+
+# Outbid and auction-won notifications are queued in the outbox with the bid or close and sent by
+# manage.py deliver_notifications through this backend (see auctions/notifications.py for the others).
+# Failed sends are retried after RETRY_DELAY seconds, doubling up to MAX_RETRY_DELAY, MAX_ATTEMPTS times
+AUCTIONS_NOTIFICATION_BACKEND = os.environ.get('AUCTIONS_NOTIFICATION_BACKEND', 'auctions.notifications.ConsoleBackend')
+AUCTIONS_NOTIFICATION_FILE = os.environ.get('AUCTIONS_NOTIFICATION_FILE')
+AUCTIONS_NOTIFICATION_RETRY_DELAY = 30
+AUCTIONS_NOTIFICATION_MAX_RETRY_DELAY = 3600
+AUCTIONS_NOTIFICATION_MAX_ATTEMPTS = 8
+# seconds a worker keeps the events it claimed before another worker may take them over
+AUCTIONS_NOTIFICATION_LEASE = 300
+
+# manage.py archive_closed_listings moves listings closed this many days ago, with their bids and
+# comments, into archive tables in the same database (see auctions/archive.py). The closed listings page
+# reads both
+AUCTIONS_ARCHIVE_AFTER_DAYS = 30
+
+# Auctions relisted from the admin whose end time had passed run for this many more days
+AUCTIONS_RELIST_DAYS = 7
+
+# Flash messages left by the POST views for the page they redirect to, styled as Bootstrap alerts
+from django.contrib.messages import constants as message_constants
+
+MESSAGE_TAGS = {message_constants.ERROR: 'danger'}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -121,3 +231,14 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
 STATIC_URL = '/static/'
+
+# Listing images, uploaded or ingested from photo_url (manage.py backfill_listing_images), are stored
+# here under names hashed from their contents, and served with far-future cache headers. With
+# AUCTIONS_SERVE_MEDIA off, have the web server serve MEDIA_ROOT at MEDIA_URL with the same headers
+MEDIA_URL = '/media/'
+MEDIA_ROOT = os.environ.get('AUCTIONS_MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
+AUCTIONS_SERVE_MEDIA = True
+AUCTIONS_MAX_IMAGE_BYTES = 5 * 1024 * 1024
+# Thumbnails (JPEG, these widths in pixels) are made by a pool of this many processes, and need Pillow
+AUCTIONS_THUMBNAIL_WIDTHS = [160, 320, 640]
+AUCTIONS_THUMBNAIL_WORKERS = 2